@@ -1,9 +1,10 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS
 import boto3
 import json
 import uuid
 import os
+import atexit
 import logging
 from datetime import datetime
 from werkzeug.utils import secure_filename
@@ -13,6 +14,8 @@ from services.patent_service import PatentService
 from services.analysis_service import AnalysisService
 from services.notification_service import NotificationService
 from services.system_logs_service import SystemLogsService
+from services.aws_clients import verify_tables_in_background
+from services.password_hasher import PasswordHashingBusy
 
 # Configure logging
 logging.basicConfig(
@@ -32,16 +35,69 @@ app.config.from_object(Config)
 # Enable CORS
 CORS(app, resources={r"/*": {"origins": app.config['ALLOWED_ORIGINS']}})
 
-# Initialize services
+# Initialize services (they share one set of AWS clients and make no AWS calls here)
 auth_service = AuthService()
 patent_service = PatentService()
-analysis_service = AnalysisService()
 notification_service = NotificationService()
+analysis_service = AnalysisService(notification_service=notification_service)
 system_logs_service = SystemLogsService()
 
+# Fork the document extraction processes before any thread is started
+analysis_service.start_extractor()
+
+# Ship application logs to the system logs table in the background
+# (registered first so it is stopped last and drains the workers' final logs)
+system_logs_service.start_shipper()
+logging.getLogger().addHandler(system_logs_service.create_log_handler())
+atexit.register(system_logs_service.stop_shipper, 10)
+
+# Publish queued notifications in the background
+notification_service.start_dispatcher()
+atexit.register(notification_service.stop_dispatcher, 10)
+
+# Start the background workers that process queued analysis jobs
+analysis_service.start_workers()
+atexit.register(analysis_service.stop_workers, 10)
+
+# Check (and create if needed) the DynamoDB tables once, off the startup path
+verify_tables_in_background()
+
 # Create upload folder if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Roles allowed on endpoints under each path prefix; other endpoints don't require a token
+ROLE_REQUIREMENTS = {
+    '/api/admin/': ('admin',)
+}
+
+@app.before_request
+def authenticate_request():
+    """Attach the user of the request's bearer token to g.user and enforce role requirements"""
+    g.user = None
+    if request.method == 'OPTIONS':
+        return None
+    
+    required_roles = next((roles for prefix, roles in ROLE_REQUIREMENTS.items() if request.path.startswith(prefix)), None)
+    
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        if required_roles:
+            return jsonify({'error': 'Authentication required'}), 401
+        return None
+    
+    try:
+        g.user = auth_service.authenticate(token.strip())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 401
+    except Exception as e:
+        logger.error(f"Error authenticating request: {str(e)}")
+        return jsonify({'error': 'Authentication failed'}), 500
+    
+    if required_roles and g.user['role'] not in required_roles:
+        return jsonify({'error': 'Insufficient permissions'}), 403
+    return None
+
 # Health check endpoint
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -62,6 +118,8 @@ def register():
             data.get('role', 'inventor')
         )
         return jsonify(result)
+    except PasswordHashingBusy as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         logger.error(f"Registration error: {str(e)}")
         return jsonify({'error': str(e)}), 400
@@ -75,6 +133,8 @@ def login():
             data.get('password')
         )
         return jsonify(result)
+    except PasswordHashingBusy as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         logger.error(f"Login error: {str(e)}")
         return jsonify({'error': str(e)}), 401
@@ -101,14 +161,14 @@ def submit_patent():
                 # Process the patent submission
                 result = patent_service.submit_patent(patent_data)
                 
-                # Trigger analysis
+                # Queue the analysis
                 analysis_job = analysis_service.start_analysis(result['patent_id'])
                 
                 return jsonify({
                     'success': True,
                     'patent_id': result['patent_id'],
                     'analysis_job_id': analysis_job['job_id'],
-                    'message': 'Patent submitted successfully and analysis started'
+                    'message': 'Patent submitted successfully and analysis queued'
                 })
             else:
                 return jsonify({'error': 'File type not allowed'}), 400
@@ -117,14 +177,14 @@ def submit_patent():
             patent_data = request.json
             result = patent_service.submit_patent(patent_data)
             
-            # Trigger analysis
+            # Queue the analysis
             analysis_job = analysis_service.start_analysis(result['patent_id'])
             
             return jsonify({
                 'success': True,
                 'patent_id': result['patent_id'],
                 'analysis_job_id': analysis_job['job_id'],
-                'message': 'Patent submitted successfully and analysis started'
+                'message': 'Patent submitted successfully and analysis queued'
             })
     except Exception as e:
         logger.error(f"Patent submission error: {str(e)}")
@@ -174,7 +234,6 @@ def get_analysis_status(job_id):
 @app.route('/api/admin/users', methods=['GET'])
 def get_users():
     try:
-        # Check admin authorization here
         result = auth_service.get_all_users()
         return jsonify(result)
     except Exception as e:
@@ -184,7 +243,6 @@ def get_users():
 @app.route('/api/admin/system-health', methods=['GET'])
 def get_system_health():
     try:
-        # Check admin authorization here
         # This would be implemented to get actual system metrics
         # For now, return mock data
         return jsonify({
@@ -195,16 +253,30 @@ def get_system_health():
             'dbConnections': 8,
             'activeUsers': 12,
             'uptime': '5d 7h 22m',
-            'lastRestart': datetime.now().isoformat()
+            'lastRestart': datetime.now().isoformat(),
+            'caches': analysis_service.get_cache_stats(),
+            'logShipper': system_logs_service.get_shipper_stats(),
+            'notificationDispatcher': notification_service.get_dispatcher_stats(),
+            'auth': auth_service.get_cache_stats(),
+            'passwordHashing': auth_service.get_hashing_stats()
         })
     except Exception as e:
         logger.error(f"Error retrieving system health: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/duplicates', methods=['GET'])
+def get_duplicate_report():
+    try:
+        threshold = request.args.get('threshold', type=float)
+        result = analysis_service.get_duplicate_report(threshold)
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Error retrieving duplicate report: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/admin/domain-keywords', methods=['GET'])
 def get_domain_keywords():
     try:
-        # Check admin authorization here
         result = analysis_service.get_domain_keywords()
         return jsonify(result)
     except Exception as e:
@@ -214,7 +286,6 @@ def get_domain_keywords():
 @app.route('/api/admin/domain-keywords', methods=['POST'])
 def update_domain_keywords():
     try:
-        # Check admin authorization here
         data = request.json
         result = analysis_service.update_domain_keywords(data)
         return jsonify(result)
@@ -225,7 +296,6 @@ def update_domain_keywords():
 @app.route('/api/admin/system-logs', methods=['GET'])
 def get_system_logs():
     try:
-        # Check admin authorization here
         filters = {}
         
         # Get query parameters for filtering
@@ -238,11 +308,14 @@ def get_system_logs():
         if request.args.get('end_date'):
             filters['end_date'] = request.args.get('end_date')
         
-        # Get limit parameter
+        # Get pagination parameters
         limit = int(request.args.get('limit', 100))
+        cursor = request.args.get('cursor')
         
-        logs = system_logs_service.get_logs(filters, limit)
+        logs = system_logs_service.get_logs(filters, limit, cursor)
         return jsonify(logs)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error retrieving system logs: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -250,7 +323,6 @@ def get_system_logs():
 @app.route('/api/admin/system-logs', methods=['POST'])
 def add_system_log():
     try:
-        # Check admin authorization here
         data = request.json
         
         if not data or not data.get('message') or not data.get('level') or not data.get('service'):
@@ -271,16 +343,28 @@ def add_system_log():
 @app.route('/api/admin/system-logs/clear', methods=['POST'])
 def clear_system_logs():
     try:
-        # Check admin authorization here
         data = request.json
         older_than = data.get('older_than') if data else None
         
-        count = system_logs_service.clear_logs(older_than)
-        return jsonify({'deleted_count': count})
+        # Logs are deleted by a background job; poll its status with the job ID
+        job = system_logs_service.clear_logs(older_than)
+        return jsonify(job), 202
     except Exception as e:
         logger.error(f"Error clearing system logs: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/system-logs/clear/<job_id>', methods=['GET'])
+def get_clear_system_logs_status(job_id):
+    try:
+        job = system_logs_service.get_purge_job(job_id)
+        if not job:
+            return jsonify({'error': 'Purge job not found'}), 404
+        
+        return jsonify(job)
+    except Exception as e:
+        logger.error(f"Error retrieving log purge status: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 # Helper functions
 def allowed_file(filename):
     return '.' in filename and \
@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -14,31 +15,98 @@ class Config:
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16 MB max upload
     ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'txt'}
+    EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', 2))  # Processes parsing uploaded documents
+    EXTRACTION_TIMEOUT = int(os.environ.get('EXTRACTION_TIMEOUT', 120))  # Seconds
+    EXTRACTION_MAX_CHARS = int(os.environ.get('EXTRACTION_MAX_CHARS', 2000000))
+    EXTRACTION_CACHE_DIR = os.environ.get('EXTRACTION_CACHE_DIR', os.path.join(UPLOAD_FOLDER, '.extracted'))
     
     # AWS Configuration
     AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
+    AWS_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 50))  # HTTP connections per client
+    AWS_CONNECT_TIMEOUT = int(os.environ.get('AWS_CONNECT_TIMEOUT', 5))  # Seconds
+    AWS_READ_TIMEOUT = int(os.environ.get('AWS_READ_TIMEOUT', 30))  # Seconds
+    AWS_RETRY_MODE = os.environ.get('AWS_RETRY_MODE', 'adaptive')  # 'legacy', 'standard' or 'adaptive'
+    AWS_MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', 5))
     
     # DynamoDB configuration
     DYNAMODB_USERS_TABLE = os.environ.get('DYNAMODB_USERS_TABLE', 'PatentAnalyzer-Users')
     DYNAMODB_PATENTS_TABLE = os.environ.get('DYNAMODB_PATENTS_TABLE', 'PatentAnalyzer-Patents')
     DYNAMODB_ANALYSIS_TABLE = os.environ.get('DYNAMODB_ANALYSIS_TABLE', 'PatentAnalyzer-Analysis')
     DYNAMODB_DOMAIN_KEYWORDS_TABLE = os.environ.get('DYNAMODB_DOMAIN_KEYWORDS_TABLE', 'PatentAnalyzer-DomainKeywords')
+    DYNAMODB_COMPREHEND_CACHE_TABLE = os.environ.get('DYNAMODB_COMPREHEND_CACHE_TABLE', 'PatentAnalyzer-ComprehendCache')
     
     # Amazon Comprehend configuration
     COMPREHEND_MIN_CONFIDENCE = float(os.environ.get('COMPREHEND_MIN_CONFIDENCE', 0.5))
+    COMPREHEND_MAX_CONCURRENCY = int(os.environ.get('COMPREHEND_MAX_CONCURRENCY', 16))  # Concurrent Comprehend calls per process
+    COMPREHEND_CALL_TIMEOUT = float(os.environ.get('COMPREHEND_CALL_TIMEOUT', 30))  # Seconds a running request gets before its chunks fall back
+    COMPREHEND_QUEUE_TIMEOUT = float(os.environ.get('COMPREHEND_QUEUE_TIMEOUT', 120))  # Seconds a request may wait for a free thread before it is cancelled
+    COMPREHEND_MAX_CHUNK_BYTES = int(os.environ.get('COMPREHEND_MAX_CHUNK_BYTES', 4900))  # Per-document limit is 5000 bytes of UTF-8
+    COMPREHEND_BATCH_SIZE = int(os.environ.get('COMPREHEND_BATCH_SIZE', 25))  # Batch* APIs accept up to 25 documents
+    COMPREHEND_MAX_CHUNKS = int(os.environ.get('COMPREHEND_MAX_CHUNKS', 200))  # Upper bound on chunks analysed per patent
+    COMPREHEND_CACHE_BACKEND = os.environ.get('COMPREHEND_CACHE_BACKEND', 'dynamodb')  # 'dynamodb' or 'memory'
+    COMPREHEND_CACHE_MAX_ENTRIES = int(os.environ.get('COMPREHEND_CACHE_MAX_ENTRIES', 2048))  # Responses kept in memory
+    COMPREHEND_CACHE_TTL = int(os.environ.get('COMPREHEND_CACHE_TTL', 30 * 24 * 3600))  # 30 days
     
     # Amazon SNS configuration
     SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN', '')
+    SNS_SUBSCRIPTION_CACHE_TTL = int(os.environ.get('SNS_SUBSCRIPTION_CACHE_TTL', 300))  # Seconds before the topic's subscriptions are reloaded
+    SNS_SUBSCRIPTION_RETRY_DELAY = int(os.environ.get('SNS_SUBSCRIPTION_RETRY_DELAY', 10))  # Seconds before a failed load is retried
+    NOTIFICATION_DEFAULT_TEMPLATE = os.environ.get('NOTIFICATION_DEFAULT_TEMPLATE', 'sns_alert_template')  # Used for unknown template names
+    NOTIFICATION_TEMPLATE_CHECK_INTERVAL = float(os.environ.get('NOTIFICATION_TEMPLATE_CHECK_INTERVAL', 2))  # Seconds between template file mtime checks
+    NOTIFICATION_OUTBOX_BACKEND = os.environ.get('NOTIFICATION_OUTBOX_BACKEND', 'dynamodb')  # 'dynamodb' or 'local'
+    DYNAMODB_NOTIFICATION_OUTBOX_TABLE = os.environ.get('DYNAMODB_NOTIFICATION_OUTBOX_TABLE', 'PatentAnalyzer-NotificationOutbox')
+    NOTIFICATION_OUTBOX_RETENTION = int(os.environ.get('NOTIFICATION_OUTBOX_RETENTION', 7 * 24 * 3600))  # Seconds sent entries are kept for deduplication
+    NOTIFICATION_TRANSPORT = os.environ.get('NOTIFICATION_TRANSPORT', 'sns')  # 'sns' or 'local'
+    NOTIFICATION_DISPATCH_INTERVAL = float(os.environ.get('NOTIFICATION_DISPATCH_INTERVAL', 1.0))  # Seconds between outbox polls
+    NOTIFICATION_MAX_ATTEMPTS = int(os.environ.get('NOTIFICATION_MAX_ATTEMPTS', 5))
+    NOTIFICATION_RETRY_DELAY = int(os.environ.get('NOTIFICATION_RETRY_DELAY', 5))  # Seconds, doubled on each retry
+    NOTIFICATION_LEASE_SECONDS = int(os.environ.get('NOTIFICATION_LEASE_SECONDS', 60))  # Seconds a claimed entry is hidden from other dispatchers
+    NOTIFICATION_DIGEST_WINDOW = int(os.environ.get('NOTIFICATION_DIGEST_WINDOW', 0))  # Seconds a recipient's alerts are collected into one digest (0 to send each alert)
+    NOTIFICATION_DIGEST_TEMPLATE = os.environ.get('NOTIFICATION_DIGEST_TEMPLATE', 'alert_digest')
+    NOTIFICATION_RATE_LIMIT = int(os.environ.get('NOTIFICATION_RATE_LIMIT', 0))  # Messages per recipient per NOTIFICATION_RATE_PERIOD (0 for no cap)
+    NOTIFICATION_RATE_PERIOD = int(os.environ.get('NOTIFICATION_RATE_PERIOD', 3600))  # Seconds
     
     # Frontend URL for links in notifications
     FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
     
     # Analysis configuration
     SIMILARITY_THRESHOLD = float(os.environ.get('SIMILARITY_THRESHOLD', 0.8))  # 80% similarity for alerts
+    SIMILARITY_ENGINE = os.environ.get('SIMILARITY_ENGINE', 'tfidf')  # 'tfidf', 'bm25', 'embedding' or 'keyword'
+    SIMILARITY_TOP_K = int(os.environ.get('SIMILARITY_TOP_K', 20))
+    SIMILARITY_BM25_K1 = float(os.environ.get('SIMILARITY_BM25_K1', 1.2))
+    SIMILARITY_BM25_B = float(os.environ.get('SIMILARITY_BM25_B', 0.75))
+    SIMILARITY_SNAPSHOT_DIR = os.environ.get('SIMILARITY_SNAPSHOT_DIR', os.path.join('index', 'similarity'))
+    SIMILARITY_SEGMENT_SIZE = int(os.environ.get('SIMILARITY_SEGMENT_SIZE', 64))  # Changed patents per delta segment
+    SIMILARITY_MAX_SEGMENTS = int(os.environ.get('SIMILARITY_MAX_SEGMENTS', 16))  # Delta segments before compaction
+    SIMILARITY_MAX_PENDING = int(os.environ.get('SIMILARITY_MAX_PENDING', 1000))  # Changed patents that trigger an immediate compaction
+    EMBEDDING_DIM = int(os.environ.get('EMBEDDING_DIM', 256))  # Stored as int8, so bytes per patent
+    EMBEDDING_SEED = int(os.environ.get('EMBEDDING_SEED', 1))  # Changing it invalidates stored vectors
+    EMBEDDING_IVF_MIN_SIZE = int(os.environ.get('EMBEDDING_IVF_MIN_SIZE', 50000))  # Patents before searches switch from exact to IVF
+    EMBEDDING_IVF_NPROBE = int(os.environ.get('EMBEDDING_IVF_NPROBE', 8))  # IVF clusters searched per query
+    SIMILARITY_RELATED_DOMAINS = json.loads(os.environ.get('SIMILARITY_RELATED_DOMAINS', '{}'))  # JSON: {"domain": ["related domain", ...]}
+    SIMILARITY_GLOBAL_FALLBACK = os.environ.get('SIMILARITY_GLOBAL_FALLBACK', 'False') == 'True'  # Compare against every domain when a domain has no candidates
+    CLAIM_SIMILARITY_THRESHOLD = float(os.environ.get('CLAIM_SIMILARITY_THRESHOLD', 0.6))  # Claim overlap that counts toward risk
+    CLAIM_MATCH_CANDIDATES = int(os.environ.get('CLAIM_MATCH_CANDIDATES', 10))  # Most similar patents whose claims are compared
+    DOMAIN_KEYWORDS_CACHE_TTL = int(os.environ.get('DOMAIN_KEYWORDS_CACHE_TTL', 300))  # Seconds between domain keyword reloads
+    
+    # Near-duplicate detection configuration
+    MINHASH_SHINGLE_SIZE = int(os.environ.get('MINHASH_SHINGLE_SIZE', 5))  # Words per shingle
+    MINHASH_PERMUTATIONS = int(os.environ.get('MINHASH_PERMUTATIONS', 128))
+    MINHASH_BANDS = int(os.environ.get('MINHASH_BANDS', 16))  # LSH bands, must divide MINHASH_PERMUTATIONS
+    MINHASH_SEED = int(os.environ.get('MINHASH_SEED', 1))  # Changing it invalidates stored signatures
+    NEAR_DUPLICATE_THRESHOLD = float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', 0.9))  # Estimated Jaccard similarity
+    NEAR_DUPLICATE_INDEX_TTL = int(os.environ.get('NEAR_DUPLICATE_INDEX_TTL', 600))  # Seconds before the index is reloaded
     
     # JWT configuration for authentication
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-key-change-in-production')
     JWT_ACCESS_TOKEN_EXPIRES = int(os.environ.get('JWT_ACCESS_TOKEN_EXPIRES', 3600))  # 1 hour
+    AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_TOKEN_CACHE_MAX_ENTRIES', 10000))  # Verified tokens kept until they expire
+    AUTH_ROLE_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_ROLE_CACHE_MAX_ENTRIES', 10000))
+    AUTH_ROLE_CACHE_TTL = int(os.environ.get('AUTH_ROLE_CACHE_TTL', 60))  # Seconds before a user's role and status are re-read
+    PASSWORD_HASH_ALGORITHM = os.environ.get('PASSWORD_HASH_ALGORITHM', 'pbkdf2_sha256')  # 'pbkdf2_sha256' or 'scrypt'
+    PASSWORD_HASH_COST = int(os.environ.get('PASSWORD_HASH_COST', 0))  # PBKDF2 iterations or scrypt N (0 for the algorithm's default)
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))  # Threads hashing passwords
+    PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 32))  # Hashes waiting for a thread before sign-ins are refused
     
     # Logging configuration
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
@@ -48,7 +116,28 @@ class Config:
     CACHE_DEFAULT_TIMEOUT = int(os.environ.get('CACHE_DEFAULT_TIMEOUT', 300))  # 5 minutes
     
     # Performance configuration
+    PRIOR_ART_INDEX_PATH = os.environ.get('PRIOR_ART_INDEX_PATH', os.path.join('index', 'prior_art_index.json'))
+    DYNAMODB_PATENTS_DOMAIN_INDEX = os.environ.get('DYNAMODB_PATENTS_DOMAIN_INDEX', 'DomainIndex')  # technology_domain GSI on the patents table
+    DYNAMODB_SCAN_SEGMENTS = int(os.environ.get('DYNAMODB_SCAN_SEGMENTS', 4))  # Parallel segments for full-table scans
+    
+    # Analysis job queue configuration
+    ANALYSIS_QUEUE_BACKEND = os.environ.get('ANALYSIS_QUEUE_BACKEND', 'local')  # 'local' or 'sqs'
+    ANALYSIS_QUEUE_URL = os.environ.get('ANALYSIS_QUEUE_URL', '')
+    ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', 4))
+    ANALYSIS_MAX_ATTEMPTS = int(os.environ.get('ANALYSIS_MAX_ATTEMPTS', 3))
+    ANALYSIS_RETRY_DELAY = int(os.environ.get('ANALYSIS_RETRY_DELAY', 5))  # Seconds, doubled on each retry
+    ANALYSIS_VISIBILITY_TIMEOUT = int(os.environ.get('ANALYSIS_VISIBILITY_TIMEOUT', 600))  # Seconds before an unacknowledged job is redelivered
+    ANALYSIS_STATUS_CACHE_TTL = int(os.environ.get('ANALYSIS_STATUS_CACHE_TTL', 5))  # Seconds a polled job status is served from memory
+    ANALYSIS_STATUS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYSIS_STATUS_CACHE_MAX_ENTRIES', 10000))
     
     # System logs configuration
     DYNAMODB_SYSTEM_LOGS_TABLE = os.environ.get('DYNAMODB_SYSTEM_LOGS_TABLE', 'PatentAnalyzer-SystemLogs')
-    BATCH_SIZE = int(os.environ.get('BATCH_SIZE', 25))  # Number of items to process in a batch
\ No newline at end of file
+    SYSTEM_LOG_LEVELS = os.environ.get('SYSTEM_LOG_LEVELS', 'DEBUG,INFO,WARNING,ERROR,CRITICAL').split(',')  # Levels merged when logs aren't filtered by level
+    BATCH_SIZE = int(os.environ.get('BATCH_SIZE', 25))  # Number of items to process in a batch
+    LOG_SHIPPER_FLUSH_INTERVAL = float(os.environ.get('LOG_SHIPPER_FLUSH_INTERVAL', 1.0))  # Seconds between flushes of a partial batch
+    LOG_SHIPPER_MAX_QUEUE = int(os.environ.get('LOG_SHIPPER_MAX_QUEUE', 10000))  # Log items buffered before the overflow policy applies
+    LOG_SHIPPER_OVERFLOW = os.environ.get('LOG_SHIPPER_OVERFLOW', 'drop_oldest')  # 'drop_oldest' or 'drop_newest'
+    SYSTEM_LOGS_RETENTION_DAYS = int(os.environ.get('SYSTEM_LOGS_RETENTION_DAYS', 30))  # Days before DynamoDB TTL deletes a log, 0 keeps logs forever
+    SYSTEM_LOGS_PURGE_WORKERS = int(os.environ.get('SYSTEM_LOGS_PURGE_WORKERS', 4))  # Threads deleting logs in a purge job
+    SYSTEM_LOGS_PURGE_CHUNK_SIZE = int(os.environ.get('SYSTEM_LOGS_PURGE_CHUNK_SIZE', 500))  # Log keys handed to a delete thread at a time
+    SYSTEM_LOGS_PURGE_JOB_HISTORY = int(os.environ.get('SYSTEM_LOGS_PURGE_JOB_HISTORY', 100))  # Finished purge jobs kept for status polls
\ No newline at end of file
@@ -0,0 +1,41 @@
+import boto3
+import os
+import sys
+
+# Add the parent directory to the path so we can import from the config
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import Config
+from services.prior_art_index import PriorArtIndex, DOCUMENT_FIELDS, INDEXED_FIELDS
+from services.dynamodb_repository import iter_scan
+from services.similarity_engine import create_similarity_engine
+
+dynamodb = boto3.resource('dynamodb', region_name=Config.AWS_REGION)
+
+def scan_patents():
+    """Yield every patent in the Patents table"""
+    table = dynamodb.Table(Config.DYNAMODB_PATENTS_TABLE)
+    return iter_scan(
+        table,
+        attributes=('patent_id',) + DOCUMENT_FIELDS + INDEXED_FIELDS,
+        segments=Config.DYNAMODB_SCAN_SEGMENTS
+    )
+
+def main():
+    """Rebuild the prior art index snapshot from the Patents table"""
+    try:
+        index = PriorArtIndex()
+        print(f"Rebuilding prior art index from {Config.DYNAMODB_PATENTS_TABLE}...")
+        index.rebuild(scan_patents())
+        print(f"Indexed {len(index)} patents into {index.path}")
+
+        # Publish a fresh similarity snapshot so workers start warm
+        engine = create_similarity_engine(index)
+        if engine is not None:
+            engine.rebuild()
+            print(f"Published {Config.SIMILARITY_ENGINE} similarity snapshot to {Config.SIMILARITY_SNAPSHOT_DIR}")
+    except Exception as e:
+        print(f"Error rebuilding prior art index: {str(e)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -104,6 +104,42 @@ def create_patents_table():
     print(f"Table {Config.DYNAMODB_PATENTS_TABLE} is now active.")
     return table
 
+def add_patents_domain_index():
+    """Add the domain index to a Patents table created without it"""
+    client = dynamodb.meta.client
+    description = client.describe_table(TableName=Config.DYNAMODB_PATENTS_TABLE)['Table']
+    index_names = [index['IndexName'] for index in description.get('GlobalSecondaryIndexes', [])]
+    if Config.DYNAMODB_PATENTS_DOMAIN_INDEX in index_names:
+        return
+    
+    client.update_table(
+        TableName=Config.DYNAMODB_PATENTS_TABLE,
+        AttributeDefinitions=[
+            {'AttributeName': 'technology_domain', 'AttributeType': 'S'},
+            {'AttributeName': 'submission_date', 'AttributeType': 'S'}
+        ],
+        GlobalSecondaryIndexUpdates=[
+            {
+                'Create': {
+                    'IndexName': Config.DYNAMODB_PATENTS_DOMAIN_INDEX,
+                    'KeySchema': [
+                        {'AttributeName': 'technology_domain', 'KeyType': 'HASH'},
+                        {'AttributeName': 'submission_date', 'KeyType': 'RANGE'}
+                    ],
+                    'Projection': {
+                        'ProjectionType': 'KEYS_ONLY'
+                    },
+                    'ProvisionedThroughput': {
+                        'ReadCapacityUnits': 5,
+                        'WriteCapacityUnits': 5
+                    }
+                }
+            }
+        ]
+    )
+    # The index is backfilled in the background; until it is active, analyses compare against all patents
+    print(f"Adding {Config.DYNAMODB_PATENTS_DOMAIN_INDEX} to {Config.DYNAMODB_PATENTS_TABLE}; it will be usable once DynamoDB finishes backfilling it.")
+
 def create_analysis_table():
     """Create the Analysis table in DynamoDB"""
     table = dynamodb.create_table(
@@ -114,7 +150,8 @@ def create_analysis_table():
         AttributeDefinitions=[
             {'AttributeName': 'analysis_id', 'AttributeType': 'S'},
             {'AttributeName': 'patent_id', 'AttributeType': 'S'},
-            {'AttributeName': 'creation_date', 'AttributeType': 'S'}
+            {'AttributeName': 'creation_date', 'AttributeType': 'S'},
+            {'AttributeName': 'job_id', 'AttributeType': 'S'}
         ],
         GlobalSecondaryIndexes=[
             {
@@ -131,6 +168,21 @@ def create_analysis_table():
                     'WriteCapacityUnits': 5
                 }
             },
+            {
+                # Name used by AnalysisService.get_analysis_status
+                'IndexName': 'job-id-index',
+                'KeySchema': [
+                    {'AttributeName': 'job_id', 'KeyType': 'HASH'}
+                ],
+                'Projection': {
+                    'ProjectionType': 'INCLUDE',
+                    'NonKeyAttributes': ['status', 'attempts', 'queued_time', 'start_time', 'end_time', 'error']
+                },
+                'ProvisionedThroughput': {
+                    'ReadCapacityUnits': 5,
+                    'WriteCapacityUnits': 5
+                }
+            },
         ],
         ProvisionedThroughput={
             'ReadCapacityUnits': 5,
@@ -178,6 +230,32 @@ def create_domain_keywords_table():
     print(f"Table {Config.DYNAMODB_DOMAIN_KEYWORDS_TABLE} is now active.")
     return table
 
+def create_comprehend_cache_table():
+    """Create the Comprehend Cache table in DynamoDB"""
+    table = dynamodb.create_table(
+        TableName=Config.DYNAMODB_COMPREHEND_CACHE_TABLE,
+        KeySchema=[
+            {'AttributeName': 'cache_key', 'KeyType': 'HASH'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'cache_key', 'AttributeType': 'S'}
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 5
+        }
+    )
+    print(f"Created table {Config.DYNAMODB_COMPREHEND_CACHE_TABLE}. Waiting for it to become active...")
+    table.meta.client.get_waiter('table_exists').wait(TableName=Config.DYNAMODB_COMPREHEND_CACHE_TABLE)
+    
+    # Expired cache entries are removed by DynamoDB TTL
+    table.meta.client.update_time_to_live(
+        TableName=Config.DYNAMODB_COMPREHEND_CACHE_TABLE,
+        TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'}
+    )
+    print(f"Table {Config.DYNAMODB_COMPREHEND_CACHE_TABLE} is now active.")
+    return table
+
 def create_system_logs_table():
     """Create the System Logs table in DynamoDB"""
     table = dynamodb.create_table(
@@ -241,9 +319,59 @@ def create_system_logs_table():
     )
     print(f"Created table {Config.DYNAMODB_SYSTEM_LOGS_TABLE}. Waiting for it to become active...")
     table.meta.client.get_waiter('table_exists').wait(TableName=Config.DYNAMODB_SYSTEM_LOGS_TABLE)
+    
+    # Logs past their retention period are removed by DynamoDB TTL
+    table.meta.client.update_time_to_live(
+        TableName=Config.DYNAMODB_SYSTEM_LOGS_TABLE,
+        TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'}
+    )
     print(f"Table {Config.DYNAMODB_SYSTEM_LOGS_TABLE} is now active.")
     return table
 
+def create_notification_outbox_table():
+    """Create the Notification Outbox table in DynamoDB"""
+    table = dynamodb.create_table(
+        TableName=Config.DYNAMODB_NOTIFICATION_OUTBOX_TABLE,
+        KeySchema=[
+            {'AttributeName': 'notification_id', 'KeyType': 'HASH'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'notification_id', 'AttributeType': 'S'},
+            {'AttributeName': 'status', 'AttributeType': 'S'},
+            {'AttributeName': 'next_attempt_at', 'AttributeType': 'N'}
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'status-index',
+                'KeySchema': [
+                    {'AttributeName': 'status', 'KeyType': 'HASH'},
+                    {'AttributeName': 'next_attempt_at', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                },
+                'ProvisionedThroughput': {
+                    'ReadCapacityUnits': 5,
+                    'WriteCapacityUnits': 5
+                }
+            }
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 5
+        }
+    )
+    print(f"Created table {Config.DYNAMODB_NOTIFICATION_OUTBOX_TABLE}. Waiting for it to become active...")
+    table.meta.client.get_waiter('table_exists').wait(TableName=Config.DYNAMODB_NOTIFICATION_OUTBOX_TABLE)
+    
+    # Sent notifications are removed by DynamoDB TTL once they're no longer needed for deduplication
+    table.meta.client.update_time_to_live(
+        TableName=Config.DYNAMODB_NOTIFICATION_OUTBOX_TABLE,
+        TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'}
+    )
+    print(f"Table {Config.DYNAMODB_NOTIFICATION_OUTBOX_TABLE} is now active.")
+    return table
+
 def load_sample_data():
     """Load sample data into the DynamoDB tables"""
     # Load sample patents
@@ -397,7 +525,9 @@ def main():
             ("Patents", create_patents_table),
             ("Analysis", create_analysis_table),
             ("Domain Keywords", create_domain_keywords_table),
-            ("System Logs", create_system_logs_table)
+            ("System Logs", create_system_logs_table),
+            ("Comprehend Cache", create_comprehend_cache_table),
+            ("Notification Outbox", create_notification_outbox_table)
         ]
         
         for table_name, create_function in tables_to_create:
@@ -410,6 +540,9 @@ def main():
                     print(f"Error creating {table_name} table: {str(e)}")
                     raise
         
+        # Tables created before the domain index existed need it added
+        add_patents_domain_index()
+        
         # Load sample data
         print("\nLoading sample data...")
         try:
@@ -4,26 +4,80 @@ import logging
 import json
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
 from botocore.exceptions import ClientError
 from config import Config
+from services.aws_clients import get_client, get_resource, get_table, register_table_check
 from services.notification_service import NotificationService
+from services.prior_art_index import get_prior_art_index, DOCUMENT_FIELDS, INDEXED_FIELDS
+from services.dynamodb_repository import batch_get_items, iter_query, iter_scan, projection_kwargs
+from services.job_queue import WorkerPool, create_job_queue
+from services.comprehend_cache import create_comprehend_cache
+from services.text_chunker import chunk_text
+from services.document_extractor import DocumentExtractor
+from services.keyword_matcher import KeywordMatcher
+from services.similarity_engine import create_similarity_engine
+from services.near_duplicate import get_near_duplicate_index
+from services.claim_parser import match_claims
 
 logger = logging.getLogger(__name__)
 
 class AnalysisService:
-    def __init__(self):
-        self.dynamodb = boto3.resource('dynamodb', region_name=Config.AWS_REGION)
-        self.comprehend = boto3.client('comprehend', region_name=Config.AWS_REGION)
-        self.s3 = boto3.client('s3', region_name=Config.AWS_REGION)
-        self.analysis_table = self.dynamodb.Table(Config.DYNAMODB_ANALYSIS_TABLE)
-        self.patents_table = self.dynamodb.Table(Config.DYNAMODB_PATENTS_TABLE)
-        self.domain_keywords_table = self.dynamodb.Table(Config.DYNAMODB_DOMAIN_KEYWORDS_TABLE)
-        self.notification_service = NotificationService()
+    # Attributes of an analysis record returned by status polls
+    JOB_STATUS_ATTRIBUTES = ('status', 'attempts', 'queued_time', 'start_time', 'end_time', 'error')
+    
+    def __init__(self, notification_service=None):
+        self.dynamodb = get_resource('dynamodb')
+        self.comprehend = get_client('comprehend')
+        self.s3 = get_client('s3')
+        self.analysis_table = get_table(Config.DYNAMODB_ANALYSIS_TABLE)
+        self.patents_table = get_table(Config.DYNAMODB_PATENTS_TABLE)
+        self.domain_keywords_table = get_table(Config.DYNAMODB_DOMAIN_KEYWORDS_TABLE)
+        self.notification_service = notification_service or NotificationService()
+        self.prior_art_index = get_prior_art_index()
+        self.similarity_engine = create_similarity_engine(self.prior_art_index)
+        self.near_duplicate_index = get_near_duplicate_index()
         self.similarity_threshold = Config.SIMILARITY_THRESHOLD
         
-        # Ensure the tables exist
-        self._create_analysis_table_if_not_exists()
+        # Cache of Comprehend responses keyed by the text sent
+        self.comprehend_cache = create_comprehend_cache()
+        
+        # Shared, bounded pool for the independent Comprehend calls of every analysis
+        self.nlp_executor = ThreadPoolExecutor(
+            max_workers=Config.COMPREHEND_MAX_CONCURRENCY,
+            thread_name_prefix='comprehend'
+        )
+        
+        # In-process snapshot of the domain keywords table, indexed by lowercased domain
+        self._domain_snapshot = None
+        self._domain_snapshot_expires = 0
+        self._domain_snapshot_lock = threading.Lock()
+        
+        # Text extraction for uploaded patent documents
+        self.document_extractor = DocumentExtractor()
+        
+        # Short-lived statuses of the jobs this process has touched, keyed by job ID
+        self._job_statuses = {}
+        self._job_statuses_lock = threading.Lock()
+        
+        # Analysis jobs are queued by start_analysis and processed by the worker pool
+        self.job_queue = create_job_queue()
+        self.worker_pool = WorkerPool(
+            self.job_queue,
+            handler=self._run_analysis_job,
+            on_error=self._handle_analysis_job_error,
+            name='analysis-worker'
+        )
+        
+        # Ensure the tables exist (verified once at startup)
+        register_table_check(Config.DYNAMODB_ANALYSIS_TABLE, self._create_analysis_table_if_not_exists)
+        register_table_check(Config.DYNAMODB_DOMAIN_KEYWORDS_TABLE, self._prepare_domain_keywords_table)
+    
+    def _prepare_domain_keywords_table(self):
+        """Create the domain keywords table if needed and seed the default domains"""
         self._create_domain_keywords_table_if_not_exists()
         
         # Initialize domain keywords if empty
@@ -45,7 +99,8 @@ class AnalysisService:
                     ],
                     AttributeDefinitions=[
                         {'AttributeName': 'analysis_id', 'AttributeType': 'S'},
-                        {'AttributeName': 'patent_id', 'AttributeType': 'S'}
+                        {'AttributeName': 'patent_id', 'AttributeType': 'S'},
+                        {'AttributeName': 'job_id', 'AttributeType': 'S'}
                     ],
                     GlobalSecondaryIndexes=[
                         {
@@ -60,6 +115,20 @@ class AnalysisService:
                                 'ReadCapacityUnits': 5,
                                 'WriteCapacityUnits': 5
                             }
+                        },
+                        {
+                            'IndexName': 'job-id-index',
+                            'KeySchema': [
+                                {'AttributeName': 'job_id', 'KeyType': 'HASH'}
+                            ],
+                            'Projection': {
+                                'ProjectionType': 'INCLUDE',
+                                'NonKeyAttributes': list(self.JOB_STATUS_ATTRIBUTES)
+                            },
+                            'ProvisionedThroughput': {
+                                'ReadCapacityUnits': 5,
+                                'WriteCapacityUnits': 5
+                            }
                         }
                     ],
                     ProvisionedThroughput={
@@ -131,14 +200,33 @@ class AnalysisService:
             
             logger.info("Initialized domain keywords with default values")
     
+    def start_extractor(self):
+        """Start the document extraction processes
+        
+        Call this before any background thread is started, since the
+        processes are forked from the application process.
+        """
+        self.document_extractor.start()
+    
+    def start_workers(self):
+        """Start the worker pool that processes queued analysis jobs"""
+        self.worker_pool.start()
+    
+    def stop_workers(self, timeout=None):
+        """Stop the analysis worker pool"""
+        self.worker_pool.stop(timeout)
+        self.document_extractor.shutdown()
+    
     def start_analysis(self, patent_id):
-        """Start the analysis process for a patent"""
+        """Queue the analysis of a patent and return without waiting for it"""
         try:
-            # Get the patent
-            response = self.patents_table.get_item(Key={'patent_id': patent_id})
-            patent = response.get('Item')
+            # Make sure the patent exists before queueing any work
+            response = self.patents_table.get_item(
+                Key={'patent_id': patent_id},
+                ProjectionExpression='patent_id'
+            )
             
-            if not patent:
+            if not response.get('Item'):
                 raise ValueError(f"Patent with ID {patent_id} not found")
             
             # Generate a unique ID for the analysis job
@@ -150,8 +238,10 @@ class AnalysisService:
                 'analysis_id': analysis_id,
                 'patent_id': patent_id,
                 'job_id': job_id,
-                'status': 'in_progress',
-                'start_time': datetime.utcnow().isoformat(),
+                'status': 'queued',
+                'attempts': 0,
+                'queued_time': datetime.utcnow().isoformat(),
+                'start_time': None,
                 'end_time': None,
                 'results': None,
                 'error': None
@@ -165,43 +255,134 @@ class AnalysisService:
                 Key={'patent_id': patent_id},
                 UpdateExpression="set #status = :status",
                 ExpressionAttributeNames={'#status': 'status'},
-                ExpressionAttributeValues={':status': 'analyzing'}
+                ExpressionAttributeValues={':status': 'queued'}
             )
             
-            # In a real application, you would start an asynchronous job here
-            # For this example, we'll perform the analysis synchronously
-            self._perform_analysis(patent, analysis_id, job_id)
+            self._cache_job_status(job_id, analysis_item)
+            
+            # Hand the job to the worker pool
+            self.job_queue.enqueue({
+                'analysis_id': analysis_id,
+                'job_id': job_id,
+                'patent_id': patent_id,
+                'attempt': 1
+            })
             
             return {
                 'analysis_id': analysis_id,
                 'job_id': job_id,
-                'status': 'in_progress'
+                'status': 'queued'
             }
             
         except Exception as e:
             logger.error(f"Error starting analysis for patent {patent_id}: {str(e)}")
             raise
     
+    def _run_analysis_job(self, job):
+        """Process a queued analysis job (called by the worker pool)"""
+        analysis_id = job['analysis_id']
+        patent_id = job['patent_id']
+        
+        # Get the patent
+        response = self.patents_table.get_item(Key={'patent_id': patent_id})
+        patent = response.get('Item')
+        
+        if not patent:
+            raise ValueError(f"Patent with ID {patent_id} not found")
+        
+        # Mark the job as started
+        response = self.analysis_table.update_item(
+            Key={'analysis_id': analysis_id},
+            UpdateExpression="set #status = :status, start_time = :start_time, attempts = :attempts",
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':status': 'in_progress',
+                ':start_time': datetime.utcnow().isoformat(),
+                ':attempts': job.get('attempt', 1)
+            },
+            ReturnValues='ALL_NEW'
+        )
+        self._cache_job_status(job['job_id'], response.get('Attributes', {}))
+        
+        self.patents_table.update_item(
+            Key={'patent_id': patent_id},
+            UpdateExpression="set #status = :status",
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':status': 'analyzing'}
+        )
+        
+        self._perform_analysis(patent, analysis_id, job['job_id'])
+    
+    def _handle_analysis_job_error(self, job, error, will_retry):
+        """Record a failed analysis attempt (called by the worker pool)"""
+        if will_retry:
+            # The worker pool will deliver the job again after a backoff
+            response = self.analysis_table.update_item(
+                Key={'analysis_id': job['analysis_id']},
+                UpdateExpression="set #status = :status, error = :error",
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={
+                    ':status': 'retrying',
+                    ':error': str(error)
+                },
+                ReturnValues='ALL_NEW'
+            )
+            self._cache_job_status(job['job_id'], response.get('Attributes', {}))
+            return
+        
+        # Update the analysis record with the error
+        response = self.analysis_table.update_item(
+            Key={'analysis_id': job['analysis_id']},
+            UpdateExpression="set #status = :status, error = :error, end_time = :end_time",
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':status': 'failed',
+                ':error': str(error),
+                ':end_time': datetime.utcnow().isoformat()
+            },
+            ReturnValues='ALL_NEW'
+        )
+        self._cache_job_status(job['job_id'], response.get('Attributes', {}))
+        
+        # Update patent status
+        self.patents_table.update_item(
+            Key={'patent_id': job['patent_id']},
+            UpdateExpression="set #status = :status",
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':status': 'analysis_failed'}
+        )
+    
     def _perform_analysis(self, patent, analysis_id, job_id):
         """Perform the analysis on the patent"""
         try:
+            # A near-duplicate of an earlier patent skips the expensive stages
+            duplicates = self._find_near_duplicates(patent)
+            if duplicates:
+                self._complete_duplicate_analysis(patent, analysis_id, job_id, duplicates)
+                return
+            
             # Extract text from the patent
             text = self._extract_text(patent)
             
-            # Get domain keywords
+            # Get domain keywords and count their occurrences in the text
             domain_keywords = self._get_domain_keywords(patent.get('technology_domain'))
+            domain_keyword_matches = self._match_domain_keywords(patent.get('technology_domain'), text)
             
             # Use Amazon Comprehend for NLP analysis
-            entities = self._extract_entities(text)
-            key_phrases = self._extract_key_phrases(text)
-            sentiment = self._analyze_sentiment(text)
-            syntax = self._analyze_syntax(text)
+            nlp_results, nlp_timings = self._run_nlp_analysis(text)
+            entities = nlp_results['entities']
+            key_phrases = nlp_results['key_phrases']
+            sentiment = nlp_results['sentiment']
+            syntax = nlp_results['syntax']
             
             # Perform similarity check with existing patents
             similar_patents = self._find_similar_patents(patent, key_phrases, entities)
             
+            # Compare the patent's claims with the claims of the closest matches
+            claim_matches = self._match_claims(patent, similar_patents)
+            
             # Calculate risk levels
-            risk_assessment = self._assess_risk(similar_patents)
+            risk_assessment = self._assess_risk(similar_patents, claim_matches)
             
             # Prepare results
             results = {
@@ -210,58 +391,125 @@ class AnalysisService:
                 'sentiment': sentiment,
                 'syntax': syntax,
                 'domain_keywords': domain_keywords,
+                'domain_keyword_matches': domain_keyword_matches,
                 'similar_patents': similar_patents,
-                'risk_assessment': risk_assessment
+                'claim_matches': claim_matches,
+                'risk_assessment': risk_assessment,
+                'nlp_timings_ms': nlp_timings
             }
             
-            # Update the analysis record
-            self.analysis_table.update_item(
-                Key={'analysis_id': analysis_id},
-                UpdateExpression="set #status = :status, results = :results, end_time = :end_time",
-                ExpressionAttributeNames={'#status': 'status'},
-                ExpressionAttributeValues={
-                    ':status': 'completed',
-                    ':results': results,
-                    ':end_time': datetime.utcnow().isoformat()
-                }
-            )
-            
-            # Update patent status
-            self.patents_table.update_item(
-                Key={'patent_id': patent['patent_id']},
-                UpdateExpression="set #status = :status",
-                ExpressionAttributeNames={'#status': 'status'},
-                ExpressionAttributeValues={':status': 'analyzed'}
-            )
-            
-            # Send notifications if high risk
+            # Queue a notification if high risk, written together with the results
+            notification = None
             if risk_assessment['overall_risk'] == 'high':
-                self._send_high_risk_notification(patent, risk_assessment, similar_patents)
+                notification = self._high_risk_notification(patent, analysis_id, risk_assessment, similar_patents)
+            
+            self._complete_analysis(patent, analysis_id, job_id, results, notification)
             
             logger.info(f"Analysis completed for patent {patent['patent_id']}")
             
         except Exception as e:
             logger.error(f"Error performing analysis: {str(e)}")
-            
-            # Update the analysis record with the error
-            self.analysis_table.update_item(
-                Key={'analysis_id': analysis_id},
-                UpdateExpression="set #status = :status, error = :error, end_time = :end_time",
-                ExpressionAttributeNames={'#status': 'status'},
-                ExpressionAttributeValues={
-                    ':status': 'failed',
-                    ':error': str(e),
-                    ':end_time': datetime.utcnow().isoformat()
-                }
-            )
-            
-            # Update patent status
-            self.patents_table.update_item(
-                Key={'patent_id': patent['patent_id']},
-                UpdateExpression="set #status = :status",
-                ExpressionAttributeNames={'#status': 'status'},
-                ExpressionAttributeValues={':status': 'analysis_failed'}
+            # Let the worker pool record the failure and decide whether to retry
+            raise
+    
+    def _find_near_duplicates(self, patent):
+        """Find earlier patents that the patent nearly duplicates"""
+        self._ensure_near_duplicate_index()
+        
+        signature = self.near_duplicate_index.patent_signature(patent)
+        if signature is None:
+            return []
+        
+        duplicates = self.near_duplicate_index.find_duplicates(signature, exclude_patent_id=patent['patent_id'])
+        
+        # Only earlier submissions count; for later ones this patent is the original
+        submission_date = patent.get('submission_date') or ''
+        return [d for d in duplicates if (d.get('submission_date') or '') < submission_date]
+    
+    def _complete_duplicate_analysis(self, patent, analysis_id, job_id, duplicates):
+        """Record the analysis of a near-duplicate without running the NLP stages"""
+        original = duplicates[0]
+        similar_patents = [{
+            'patent_id': duplicate['patent_id'],
+            'title': duplicate.get('title'),
+            'similarity': round(duplicate['similarity'], 4),
+            'submission_date': duplicate.get('submission_date'),
+            'matching_keywords': []
+        } for duplicate in duplicates]
+        
+        risk_assessment = self._assess_risk(similar_patents)
+        risk_assessment['overall_risk'] = 'high'
+        risk_assessment['risk_factors'] = [
+            f"Near-duplicate of patent {original['patent_id']}",
+            'Claims and abstract largely match an earlier submission'
+        ]
+        
+        results = {
+            'duplicate_of': original['patent_id'],
+            'similar_patents': similar_patents,
+            'risk_assessment': risk_assessment
+        }
+        
+        notification = self._high_risk_notification(patent, analysis_id, risk_assessment, similar_patents)
+        self._complete_analysis(patent, analysis_id, job_id, results, notification)
+        
+        logger.info(f"Patent {patent['patent_id']} is a near-duplicate of {original['patent_id']}")
+    
+    def _complete_analysis(self, patent, analysis_id, job_id, results, notification=None):
+        """Record the results of an analysis and mark the patent as analyzed
+        
+        A notification is queued in the outbox in the same write as the
+        results, so it is sent if and only if the results are recorded.
+        """
+        end_time = datetime.utcnow().isoformat()
+        update_kwargs = {
+            'Key': {'analysis_id': analysis_id},
+            'UpdateExpression': "set #status = :status, results = :results, end_time = :end_time, error = :error",
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {
+                ':status': 'completed',
+                ':results': results,
+                ':end_time': end_time,
+                ':error': None
+            }
+        }
+        
+        if notification:
+            if not self.notification_service.outbox.add_with_update(notification, self.analysis_table, **update_kwargs):
+                logger.info(f"Notification {notification['notification_id']} was already queued")
+            self.notification_service.dispatcher.notify()
+        else:
+            self.analysis_table.update_item(**update_kwargs)
+        self._cache_job_status(job_id, {'status': 'completed', 'end_time': end_time, 'error': None})
+        
+        # Update patent status
+        self.patents_table.update_item(
+            Key={'patent_id': patent['patent_id']},
+            UpdateExpression="set #status = :status",
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':status': 'analyzed'}
+        )
+    
+    def _ensure_near_duplicate_index(self):
+        """Load the near-duplicate index, reloading it once it is older than its TTL
+        
+        Only one worker scans the table; the others keep using the current index.
+        """
+        # Signatures are stored on the items; the text is only needed for older patents without one
+        def load_patents():
+            return iter_scan(
+                self.patents_table,
+                attributes=['patent_id', 'title', 'submission_date', 'minhash', 'claims', 'abstract'],
+                segments=Config.DYNAMODB_SCAN_SEGMENTS
             )
+        
+        if self.near_duplicate_index.refresh(load_patents, Config.NEAR_DUPLICATE_INDEX_TTL):
+            logger.info(f"Loaded near-duplicate index with {len(self.near_duplicate_index)} patents")
+    
+    def get_duplicate_report(self, threshold=None):
+        """Find every pair of near-duplicate patents in the corpus"""
+        self._ensure_near_duplicate_index()
+        return self.near_duplicate_index.duplicate_report(threshold)
     
     def _extract_text(self, patent):
         """Extract text from the patent for analysis"""
@@ -283,140 +531,274 @@ class AnalysisService:
         if patent.get('description'):
             text_parts.append(patent['description'])
         
-        # If there's a file path, we would extract text from the file
-        # This would require additional processing based on file type
-        # For this example, we'll just use the text fields
+        # Add the text of the uploaded document
+        if patent.get('file_path'):
+            try:
+                file_text = self.document_extractor.extract(patent['file_path'])
+                if file_text:
+                    text_parts.append(file_text)
+            except Exception as e:
+                logger.error(f"Error extracting text from {patent['file_path']}: {str(e)}")
         
         return ' '.join(text_parts)
     
     def _get_domain_keywords(self, domain):
         """Get keywords for a specific domain"""
-        # Scan the domain keywords table
-        response = self.domain_keywords_table.scan()
-        domains = response.get('Items', [])
-        
-        # Find the matching domain
-        for d in domains:
-            if d.get('domain', '').lower() == domain.lower():
-                return d.get('keywords', [])
+        entry = self._get_domain_snapshot().get((domain or '').lower())
         
         # If no match, return empty list
-        return []
+        return list(entry['keywords']) if entry else []
+    
+    def _match_domain_keywords(self, domain, text):
+        """Count the occurrences of a domain's keywords in the text"""
+        entry = self._get_domain_snapshot().get((domain or '').lower())
+        return entry['matcher'].find(text) if entry else {}
     
-    def _extract_entities(self, text):
-        """Extract entities from text using Amazon Comprehend"""
-        # Limit text length to Comprehend's maximum (5000 bytes)
-        text = text[:5000]
+    def _get_domain_snapshot(self):
+        """Get the cached domain keywords, reloading them once the TTL has passed"""
+        with self._domain_snapshot_lock:
+            if self._domain_snapshot is None or time.monotonic() >= self._domain_snapshot_expires:
+                self._domain_snapshot = self._load_domain_snapshot()
+                self._domain_snapshot_expires = time.monotonic() + Config.DOMAIN_KEYWORDS_CACHE_TTL
+            return self._domain_snapshot
+    
+    def _load_domain_snapshot(self):
+        """Read the domain keywords table and compile a keyword matcher per domain"""
+        keywords_by_domain = {}
+        for item in iter_scan(self.domain_keywords_table, attributes=['domain', 'keywords', 'keyword']):
+            keywords = keywords_by_domain.setdefault(item.get('domain', '').lower(), [])
+            keywords.extend(item.get('keywords', []))
+            # Items loaded by setup_dynamodb.py hold a single keyword each
+            if item.get('keyword'):
+                keywords.append(item['keyword'])
         
-        try:
-            response = self.comprehend.detect_entities(
-                Text=text,
-                LanguageCode='en'
-            )
-            
-            # Filter entities by confidence threshold
-            entities = [e for e in response.get('Entities', []) 
-                       if e.get('Score', 0) >= Config.COMPREHEND_MIN_CONFIDENCE]
+        return {
+            domain: {'keywords': keywords, 'matcher': KeywordMatcher(keywords)}
+            for domain, keywords in keywords_by_domain.items()
+        }
+    
+    def _invalidate_domain_snapshot(self):
+        """Force the domain keywords to be reloaded on next use"""
+        with self._domain_snapshot_lock:
+            self._domain_snapshot = None
+    
+    def _run_nlp_analysis(self, text):
+        """Run the Comprehend analyses over the whole text
+        
+        The text is split into sentence-aligned chunks that fit Comprehend's
+        per-document byte limit. Chunks not already cached are sent through the
+        Batch* APIs, up to COMPREHEND_BATCH_SIZE per request, with all requests
+        of all four analyses running concurrently. The per-chunk results are then
+        merged into one result per analysis.
+        
+        Returns the results and the time each analysis took in milliseconds.
+        Each request gets COMPREHEND_CALL_TIMEOUT seconds from when it starts
+        running, and may wait COMPREHEND_QUEUE_TIMEOUT seconds for a free
+        executor thread before it is cancelled. Chunks whose request fails or
+        times out are left out of the merge, and an analysis with no answered
+        chunks falls back to an empty result.
+        """
+        analyses = {
+            'entities': ('detect_entities', 'batch_detect_entities', self._merge_entities, dict),
+            'key_phrases': ('detect_key_phrases', 'batch_detect_key_phrases', self._merge_key_phrases, list),
+            'sentiment': ('detect_sentiment', 'batch_detect_sentiment', self._merge_sentiment,
+                          lambda: {'sentiment': 'NEUTRAL', 'scores': {}}),
+            'syntax': ('detect_syntax', 'batch_detect_syntax', self._merge_syntax, dict)
+        }
+        
+        chunks = chunk_text(text)
+        if len(chunks) > Config.COMPREHEND_MAX_CHUNKS:
+            logger.warning(f"Analysing the first {Config.COMPREHEND_MAX_CHUNKS} of {len(chunks)} text chunks")
+            chunks = chunks[:Config.COMPREHEND_MAX_CHUNKS]
+        
+        # Serve what we can from the cache before any request is timed
+        chunk_results = {}
+        for name, (api, _, _, _) in analyses.items():
+            chunk_results[name] = self.comprehend_cache.get_many(api, chunks)
+        
+        # Submit a batch request per group of misses
+        submitted = time.monotonic()
+        requests = []
+        for name, (api, batch_api, _, _) in analyses.items():
+            missing = [index for index, result in enumerate(chunk_results[name]) if result is None]
             
-            # Group entities by type
-            grouped_entities = {}
-            for entity in entities:
-                entity_type = entity.get('Type')
-                if entity_type not in grouped_entities:
-                    grouped_entities[entity_type] = []
+            for offset in range(0, len(missing), Config.COMPREHEND_BATCH_SIZE):
+                indexes = missing[offset:offset + Config.COMPREHEND_BATCH_SIZE]
+                started = {'event': threading.Event(), 'at': None}
+                future = self.nlp_executor.submit(
+                    self._timed_call, started, self._batch_call_comprehend, api, batch_api, [chunks[i] for i in indexes]
+                )
+                requests.append((name, indexes, future, started))
+        
+        timings = {name: 0 for name in analyses}
+        timed_out = {name: 0 for name in analyses}
+        for name, indexes, future, started in requests:
+            try:
+                # Time spent queued behind other analyses' requests doesn't count against the call timeout
+                if not started['event'].wait(max(submitted + Config.COMPREHEND_QUEUE_TIMEOUT - time.monotonic(), 0)):
+                    if future.cancel():
+                        raise FutureTimeoutError()
+                    started['event'].wait()
                 
-                grouped_entities[entity_type].append({
-                    'text': entity.get('Text'),
-                    'score': entity.get('Score')
-                })
+                responses, elapsed = future.result(
+                    timeout=max(started['at'] + Config.COMPREHEND_CALL_TIMEOUT - time.monotonic(), 0)
+                )
+                for index, response in zip(indexes, responses):
+                    chunk_results[name][index] = response
+            except FutureTimeoutError:
+                future.cancel()
+                timed_out[name] += len(indexes)
+                elapsed = time.monotonic() - (started['at'] or submitted)
+            except Exception as e:
+                logger.error(f"Error running Comprehend {name} request: {str(e)}")
+                elapsed = time.monotonic() - (started['at'] or submitted)
             
-            return grouped_entities
+            # Requests of one analysis run in parallel, so its time is the slowest one
+            timings[name] = max(timings[name], int(elapsed * 1000))
+        
+        results = {}
+        for name, (_, _, merge, fallback) in analyses.items():
+            answered = [(chunk, result) for chunk, result in zip(chunks, chunk_results[name]) if result is not None]
+            if len(answered) < len(chunks):
+                logger.warning(
+                    f"Comprehend {name} has no result for {len(chunks) - len(answered)} of {len(chunks)} chunks "
+                    f"({timed_out[name]} timed out)"
+                )
             
-        except Exception as e:
-            logger.error(f"Error extracting entities: {str(e)}")
-            return {}
+            try:
+                results[name] = merge(answered) if answered else fallback()
+            except Exception as e:
+                logger.error(f"Error merging Comprehend {name} results: {str(e)}")
+                results[name] = fallback()
+        
+        logger.info(f"Comprehend analysed {len(chunks)} chunks, timings (ms): {timings}")
+        
+        return results, timings
     
-    def _extract_key_phrases(self, text):
-        """Extract key phrases from text using Amazon Comprehend"""
-        # Limit text length to Comprehend's maximum (5000 bytes)
-        text = text[:5000]
+    def _timed_call(self, started, function, *args):
+        """Call a function and return its result with the elapsed time in seconds
         
-        try:
-            response = self.comprehend.detect_key_phrases(
-                Text=text,
-                LanguageCode='en'
-            )
-            
-            # Filter key phrases by confidence threshold
-            key_phrases = [{
-                'text': kp.get('Text'),
-                'score': kp.get('Score')
-            } for kp in response.get('KeyPhrases', []) 
-              if kp.get('Score', 0) >= Config.COMPREHEND_MIN_CONFIDENCE]
-            
-            # Sort by score (highest first)
-            key_phrases.sort(key=lambda x: x.get('score', 0), reverse=True)
-            
-            return key_phrases
-            
-        except Exception as e:
-            logger.error(f"Error extracting key phrases: {str(e)}")
-            return []
+        The start time is recorded in started['at'] and signalled through
+        started['event'], so the caller can time the call from when it runs.
+        """
+        started['at'] = time.monotonic()
+        started['event'].set()
+        result = function(*args)
+        return result, time.monotonic() - started['at']
     
-    def _analyze_sentiment(self, text):
-        """Analyze sentiment of text using Amazon Comprehend"""
-        # Limit text length to Comprehend's maximum (5000 bytes)
-        text = text[:5000]
+    def _batch_call_comprehend(self, api, batch_api, texts, language='en'):
+        """Call a Comprehend Batch* API and cache the per-document results
         
-        try:
-            response = self.comprehend.detect_sentiment(
-                Text=text,
-                LanguageCode='en'
-            )
-            
-            return {
-                'sentiment': response.get('Sentiment'),
-                'scores': response.get('SentimentScore')
-            }
-            
-        except Exception as e:
-            logger.error(f"Error analyzing sentiment: {str(e)}")
-            return {'sentiment': 'NEUTRAL', 'scores': {}}
+        Returns one response per text, shaped like the single-document API's
+        response, or None for documents Comprehend reported an error for.
+        """
+        response = getattr(self.comprehend, batch_api)(TextList=texts, LanguageCode=language)
+        
+        results = [None] * len(texts)
+        for result in response.get('ResultList', []):
+            index = result.pop('Index')
+            results[index] = result
+        
+        for error in response.get('ErrorList', []):
+            logger.error(f"Comprehend {batch_api} failed for document {error.get('Index')}: {error.get('ErrorMessage')}")
+        
+        self.comprehend_cache.put_many(
+            api,
+            [(text, result) for text, result in zip(texts, results) if result is not None],
+            language
+        )
+        
+        return results
     
-    def _analyze_syntax(self, text):
-        """Analyze syntax of text using Amazon Comprehend"""
-        # Limit text length to Comprehend's maximum (5000 bytes)
-        text = text[:5000]
+    def get_cache_stats(self):
+        """Get hit/miss counters for the analysis caches"""
+        return {
+            'comprehend': self.comprehend_cache.stats()
+        }
+    
+    def _merge_entities(self, chunk_results):
+        """Combine the entities found in each chunk, grouped by type"""
+        # Keep the best score for each distinct entity across chunks
+        best = {}
+        for _, result in chunk_results:
+            for entity in result.get('Entities', []):
+                score = entity.get('Score', 0)
+                if score < Config.COMPREHEND_MIN_CONFIDENCE:
+                    continue
+                
+                key = (entity.get('Type'), entity.get('Text', '').lower())
+                if key not in best or score > best[key]['score']:
+                    best[key] = {'text': entity.get('Text'), 'score': score}
         
-        try:
-            response = self.comprehend.detect_syntax(
-                Text=text,
-                LanguageCode='en'
-            )
-            
-            # Group tokens by part of speech
-            pos_groups = {}
-            for token in response.get('SyntaxTokens', []):
-                pos = token.get('PartOfSpeech', {}).get('Tag')
-                if pos not in pos_groups:
-                    pos_groups[pos] = []
+        # Group entities by type
+        grouped_entities = {}
+        for (entity_type, _), entity in best.items():
+            grouped_entities.setdefault(entity_type, []).append(entity)
+        
+        return grouped_entities
+    
+    def _merge_key_phrases(self, chunk_results):
+        """Combine the key phrases found in each chunk"""
+        # Keep the best score for each distinct phrase across chunks
+        best = {}
+        for _, result in chunk_results:
+            for kp in result.get('KeyPhrases', []):
+                score = kp.get('Score', 0)
+                if score < Config.COMPREHEND_MIN_CONFIDENCE:
+                    continue
                 
-                pos_groups[pos].append({
-                    'text': token.get('Text'),
-                    'score': token.get('PartOfSpeech', {}).get('Score')
-                })
-            
-            return pos_groups
-            
-        except Exception as e:
-            logger.error(f"Error analyzing syntax: {str(e)}")
-            return {}
+                key = kp.get('Text', '').lower()
+                if key not in best or score > best[key]['score']:
+                    best[key] = {'text': kp.get('Text'), 'score': score}
+        
+        key_phrases = list(best.values())
+        
+        # Sort by score (highest first)
+        key_phrases.sort(key=lambda x: x.get('score', 0), reverse=True)
+        
+        return key_phrases
+    
+    def _merge_sentiment(self, chunk_results):
+        """Combine the sentiment of each chunk, weighted by chunk length"""
+        totals = {}
+        total_weight = 0
+        for chunk, result in chunk_results:
+            weight = len(chunk)
+            total_weight += weight
+            for label, score in (result.get('SentimentScore') or {}).items():
+                totals[label] = totals.get(label, 0) + score * weight
+        
+        if not totals or not total_weight:
+            return {'sentiment': 'NEUTRAL', 'scores': {}}
+        
+        scores = {label: total / total_weight for label, total in totals.items()}
+        
+        return {
+            'sentiment': max(scores, key=scores.get).upper(),
+            'scores': scores
+        }
+    
+    def _merge_syntax(self, chunk_results):
+        """Combine the syntax tokens of each chunk, grouped by part of speech"""
+        # Distinct tokens only, so the size of the result stays bounded for long documents
+        best = {}
+        for _, result in chunk_results:
+            for token in result.get('SyntaxTokens', []):
+                pos = token.get('PartOfSpeech', {}).get('Tag')
+                score = token.get('PartOfSpeech', {}).get('Score')
+                key = (pos, token.get('Text', '').lower())
+                if key not in best or (score or 0) > (best[key]['score'] or 0):
+                    best[key] = {'text': token.get('Text'), 'score': score}
+        
+        # Group tokens by part of speech
+        pos_groups = {}
+        for (pos, _), token in best.items():
+            pos_groups.setdefault(pos, []).append(token)
+        
+        return pos_groups
     
     def _find_similar_patents(self, patent, key_phrases, entities):
         """Find patents similar to the given patent"""
-        # In a real application, this would use more sophisticated similarity algorithms
-        # For this example, we'll use a simple keyword matching approach
-        
         # Extract keywords from the patent
         keywords = [kp['text'].lower() for kp in key_phrases[:20]]  # Top 20 key phrases
         
@@ -424,32 +806,40 @@ class AnalysisService:
         if 'TECHNICAL' in entities:
             keywords.extend([e['text'].lower() for e in entities['TECHNICAL']])
         
-        # Scan the patents table
-        response = self.patents_table.scan()
-        all_patents = response.get('Items', [])
+        self._ensure_prior_art_index()
         
-        # Filter out the current patent
-        other_patents = [p for p in all_patents if p.get('patent_id') != patent.get('patent_id')]
+        # Only compare against patents of the same (or a related) domain
+        candidate_ids = self._get_candidate_ids(patent)
+        if candidate_ids is not None and not candidate_ids:
+            return []
+        
+        if self.similarity_engine is not None:
+            return self._rank_similar_patents(patent, keywords, candidate_ids)
+        
+        if not keywords:
+            return []
+        
+        # Look up the patents containing each keyword in the prior art index
+        matches = self.prior_art_index.match(
+            keywords,
+            exclude_patent_id=patent.get('patent_id'),
+            candidate_ids=candidate_ids
+        )
         
         similar_patents = []
         
-        for other_patent in other_patents:
-            # Extract text from the other patent
-            other_text = self._extract_text(other_patent).lower()
-            
-            # Count keyword matches
-            match_count = sum(1 for kw in keywords if kw in other_text)
-            
+        for patent_id, matching_keywords in matches.items():
             # Calculate similarity score (simple version)
-            similarity = match_count / len(keywords) if keywords else 0
+            similarity = len(matching_keywords) / len(keywords)
             
             if similarity >= self.similarity_threshold * 0.5:  # Lower threshold for finding all potential matches
+                document = self.prior_art_index.document(patent_id) or {}
                 similar_patents.append({
-                    'patent_id': other_patent.get('patent_id'),
-                    'title': other_patent.get('title'),
+                    'patent_id': patent_id,
+                    'title': document.get('title'),
                     'similarity': similarity,
-                    'submission_date': other_patent.get('submission_date'),
-                    'matching_keywords': [kw for kw in keywords if kw in other_text]
+                    'submission_date': document.get('submission_date'),
+                    'matching_keywords': matching_keywords
                 })
         
         # Sort by similarity (highest first)
@@ -457,11 +847,123 @@ class AnalysisService:
         
         return similar_patents
     
-    def _assess_risk(self, similar_patents):
-        """Assess the risk level based on similar patents"""
+    def _get_candidate_ids(self, patent):
+        """Get the IDs of the patents to compare against, or None for the whole corpus
+        
+        Candidates are the patents of the patent's domain and its configured
+        related domains, read from the domain index of the patents table.
+        """
+        domain = patent.get('technology_domain')
+        if not domain:
+            return None
+        
+        domains = [domain] + [d for d in Config.SIMILARITY_RELATED_DOMAINS.get(domain, []) if d != domain]
+        
+        candidate_ids = set()
+        try:
+            for candidate_domain in domains:
+                for item in iter_query(
+                    self.patents_table,
+                    attributes=['patent_id'],
+                    IndexName=Config.DYNAMODB_PATENTS_DOMAIN_INDEX,
+                    KeyConditionExpression=boto3.dynamodb.conditions.Key('technology_domain').eq(candidate_domain)
+                ):
+                    candidate_ids.add(item['patent_id'])
+        except ClientError as e:
+            # Tables created before the index was added (see scripts/setup_dynamodb.py) can't be queried by domain
+            if e.response['Error']['Code'] != 'ValidationException':
+                raise
+            logger.warning(f"Patents table has no {Config.DYNAMODB_PATENTS_DOMAIN_INDEX}, comparing against all patents: {str(e)}")
+            return None
+        candidate_ids.discard(patent.get('patent_id'))
+        
+        if not candidate_ids and Config.SIMILARITY_GLOBAL_FALLBACK:
+            logger.info(f"No candidates in domains {domains}, comparing against all patents")
+            return None
+        
+        return candidate_ids
+    
+    def _rank_similar_patents(self, patent, keywords, candidate_ids=None):
+        """Score the patent against the candidates with the similarity engine"""
+        ranked = self.similarity_engine.top_k(
+            patent,
+            Config.SIMILARITY_TOP_K,
+            exclude_patent_id=patent.get('patent_id'),
+            candidate_ids=candidate_ids
+        )
+        
+        # Report which of the patent's keywords each match shares
+        matches = {}
+        if keywords and ranked:
+            matches = self.prior_art_index.match(keywords, candidate_ids={patent_id for patent_id, _ in ranked})
+        
+        similar_patents = []
+        for patent_id, similarity in ranked:
+            if similarity >= self.similarity_threshold * 0.5:  # Lower threshold for finding all potential matches
+                document = self.prior_art_index.document(patent_id) or {}
+                similar_patents.append({
+                    'patent_id': patent_id,
+                    'title': document.get('title'),
+                    'similarity': round(similarity, 4),
+                    'submission_date': document.get('submission_date'),
+                    'matching_keywords': matches.get(patent_id, [])
+                })
+        
+        return similar_patents
+    
+    def _ensure_prior_art_index(self):
+        """Make sure the prior art index is loaded and up to date"""
+        if self.prior_art_index.is_loaded:
+            self.prior_art_index.refresh()
+        else:
+            self.rebuild_prior_art_index()
+    
+    def rebuild_prior_art_index(self):
+        """Rebuild the prior art index from the patents table"""
+        # Stream only the indexed attributes straight into the index
+        patents = iter_scan(
+            self.patents_table,
+            attributes=('patent_id',) + DOCUMENT_FIELDS + INDEXED_FIELDS,
+            segments=Config.DYNAMODB_SCAN_SEGMENTS
+        )
+        self.prior_art_index.rebuild(patents)
+        logger.info(f"Rebuilt prior art index with {len(self.prior_art_index)} patents")
+        
+        return {'indexed_patents': len(self.prior_art_index)}
+    
+    def _match_claims(self, patent, similar_patents):
+        """Find the best match among the similar patents' claims for every claim of the patent"""
+        if not patent.get('claims') or not similar_patents:
+            return []
+        
+        try:
+            # Fetch the claims of the closest matches in one batched read
+            candidate_ids = [p['patent_id'] for p in similar_patents[:Config.CLAIM_MATCH_CANDIDATES]]
+            items = batch_get_items(
+                self.dynamodb,
+                Config.DYNAMODB_PATENTS_TABLE,
+                [{'patent_id': patent_id} for patent_id in candidate_ids],
+                attributes=['patent_id', 'claims']
+            )
+            candidates = {item['patent_id']: item['claims'] for item in items if item.get('claims')}
+            
+            return match_claims(patent['claims'], candidates)
+        except Exception as e:
+            logger.error(f"Error matching claims: {str(e)}")
+            return []
+    
+    def _assess_risk(self, similar_patents, claim_matches=None):
+        """Assess the risk level based on similar patents and overlapping independent claims"""
         # Count patents above the similarity threshold
         high_similarity_count = sum(1 for p in similar_patents if p.get('similarity', 0) >= self.similarity_threshold)
         
+        # Independent claims whose best match in another patent overlaps them
+        independent_claims = [m for m in claim_matches or [] if m['independent']]
+        overlapping_claims = [
+            m['claim'] for m in independent_claims
+            if m['best_match'] and m['best_match']['similarity'] >= Config.CLAIM_SIMILARITY_THRESHOLD
+        ]
+        
         # Determine risk levels
         if high_similarity_count > 2:
             overall_risk = 'high'
@@ -473,6 +975,16 @@ class AnalysisService:
             overall_risk = 'low'
             risk_factors = ['No highly similar patents found']
         
+        # Every independent claim overlapping existing claims is high risk on its own
+        if overlapping_claims:
+            if len(overlapping_claims) == len(independent_claims):
+                overall_risk = 'high'
+                risk_factors.append('All independent claims overlap claims of existing patents')
+            else:
+                if overall_risk == 'low':
+                    overall_risk = 'medium'
+                risk_factors.append(f"Independent claims {', '.join(map(str, overlapping_claims))} overlap claims of existing patents")
+        
         # Calculate average similarity of top matches
         top_similarities = [p.get('similarity', 0) for p in similar_patents[:3]]
         avg_similarity = sum(top_similarities) / len(top_similarities) if top_similarities else 0
@@ -481,11 +993,13 @@ class AnalysisService:
             'overall_risk': overall_risk,
             'risk_factors': risk_factors,
             'high_similarity_count': high_similarity_count,
-            'average_similarity': avg_similarity
+            'average_similarity': avg_similarity,
+            'independent_claim_count': len(independent_claims),
+            'overlapping_independent_claims': overlapping_claims
         }
     
-    def _send_high_risk_notification(self, patent, risk_assessment, similar_patents):
-        """Send notification for high-risk patents"""
+    def _high_risk_notification(self, patent, analysis_id, risk_assessment, similar_patents):
+        """Create the outbox entry notifying the owner of a high-risk patent"""
         # Prepare the message data
         message_data = {
             'patent_id': patent.get('patent_id'),
@@ -509,8 +1023,9 @@ class AnalysisService:
             'timestamp': datetime.utcnow().isoformat()
         }
         
-        # Send the notification using the template
-        self.notification_service.send_alert_from_template(
+        # One notification per analysis, however often the job is retried
+        return self.notification_service.alert_outbox_entry(
+            f"high-risk-{analysis_id}",
             template_name='high_risk_alert',
             data=message_data,
             recipient=patent.get('user_id')
@@ -519,48 +1034,97 @@ class AnalysisService:
     def get_analysis_results(self, patent_id):
         """Get the analysis results for a patent"""
         # Query the analysis table by patent ID
-        response = self.analysis_table.query(
+        analyses = iter_query(
+            self.analysis_table,
             IndexName='patent-id-index',
             KeyConditionExpression=boto3.dynamodb.conditions.Key('patent_id').eq(patent_id)
         )
         
-        analyses = response.get('Items', [])
+        # Return the most recent analysis (queued jobs have no start time yet)
+        latest = max(analyses, key=lambda x: x.get('queued_time') or x.get('start_time') or '', default=None)
         
-        if not analyses:
+        if not latest:
             raise ValueError(f"No analysis found for patent {patent_id}")
         
-        # Sort by start time (newest first)
-        analyses.sort(key=lambda x: x.get('start_time', ''), reverse=True)
-        
-        # Return the most recent analysis
-        return analyses[0]
+        return latest
     
     def get_analysis_status(self, job_id):
         """Get the status of an analysis job"""
-        # Scan the analysis table for the job ID
-        response = self.analysis_table.scan(
-            FilterExpression=boto3.dynamodb.conditions.Attr('job_id').eq(job_id)
-        )
+        status = self._get_cached_job_status(job_id)
+        if status is not None:
+            return status
         
-        analyses = response.get('Items', [])
+        analysis = self._load_job_status(job_id)
         
-        if not analyses:
+        if not analysis:
             raise ValueError(f"No analysis job found with ID {job_id}")
         
-        analysis = analyses[0]
+        return self._cache_job_status(job_id, analysis)
+    
+    def _load_job_status(self, job_id):
+        """Read the status fields of a job's analysis record"""
+        # Job IDs are derived from the analysis ID, so the record can be read by key
+        if job_id.startswith('job-'):
+            response = self.analysis_table.get_item(
+                Key={'analysis_id': job_id[len('job-'):]},
+                ConsistentRead=True,
+                **projection_kwargs(('job_id',) + self.JOB_STATUS_ATTRIBUTES)
+            )
+            analysis = response.get('Item')
+            if analysis and analysis.get('job_id') == job_id:
+                return analysis
         
-        return {
-            'job_id': job_id,
-            'status': analysis.get('status'),
-            'start_time': analysis.get('start_time'),
-            'end_time': analysis.get('end_time'),
-            'error': analysis.get('error')
-        }
+        # Fall back to the job ID index for job IDs that don't follow that scheme
+        try:
+            return next(iter_query(
+                self.analysis_table,
+                attributes=self.JOB_STATUS_ATTRIBUTES,
+                IndexName='job-id-index',
+                KeyConditionExpression=boto3.dynamodb.conditions.Key('job_id').eq(job_id),
+                Limit=1
+            ), None)
+        except ClientError as e:
+            # Tables created before the index was added can only be read by key
+            if e.response['Error']['Code'] != 'ValidationException':
+                raise
+            logger.warning(f"Analysis table has no job-id-index: {str(e)}")
+            return None
+    
+    def _get_cached_job_status(self, job_id):
+        with self._job_statuses_lock:
+            entry = self._job_statuses.get(job_id)
+            if entry and entry[0] > time.monotonic():
+                return dict(entry[1])
+        return None
+    
+    def _cache_job_status(self, job_id, analysis):
+        """Remember the latest status of a job for the next few polls"""
+        status = {'job_id': job_id}
+        status.update({attribute: analysis.get(attribute) for attribute in self.JOB_STATUS_ATTRIBUTES})
+        
+        with self._job_statuses_lock:
+            # Re-inserted on every write, so entries stay ordered by expiry
+            cached = self._job_statuses.pop(job_id, None)
+            if cached:
+                # Partial updates (e.g. UPDATED_NEW) keep the fields they didn't return
+                for attribute, value in cached[1].items():
+                    if attribute not in analysis:
+                        status[attribute] = value
+            
+            # Drop expired entries, then the oldest ones if the cache is still full
+            now = time.monotonic()
+            while self._job_statuses:
+                oldest = next(iter(self._job_statuses))
+                if self._job_statuses[oldest][0] > now and len(self._job_statuses) < Config.ANALYSIS_STATUS_CACHE_MAX_ENTRIES:
+                    break
+                del self._job_statuses[oldest]
+            self._job_statuses[job_id] = (now + Config.ANALYSIS_STATUS_CACHE_TTL, status)
+        
+        return dict(status)
     
     def get_domain_keywords(self):
         """Get all domain keywords"""
-        response = self.domain_keywords_table.scan()
-        return response.get('Items', [])
+        return list(iter_scan(self.domain_keywords_table))
     
     def update_domain_keywords(self, domain_data):
         """Update domain keywords"""
@@ -580,6 +1144,7 @@ class AnalysisService:
         
         # Update or create the domain
         self.domain_keywords_table.put_item(Item=domain_data)
+        self._invalidate_domain_snapshot()
         
         return {
             'domain_id': domain_data['domain_id'],
@@ -595,5 +1160,6 @@ class AnalysisService:
         
         # Delete the domain
         self.domain_keywords_table.delete_item(Key={'domain_id': domain_id})
+        self._invalidate_domain_snapshot()
         
         return {'message': f"Domain {domain_id} deleted successfully"}
\ No newline at end of file
@@ -1,26 +1,41 @@
 import boto3
 import uuid
 import hashlib
-import hmac
-import base64
 import json
 import jwt
 import logging
+import time
 from datetime import datetime, timedelta
 from botocore.exceptions import ClientError
 from config import Config
+from services.auth_cache import ExpiringCache
+from services.aws_clients import get_resource, get_table, register_table_check
+from services.password_hasher import PasswordHashing
+from services.dynamodb_repository import iter_scan
 
 logger = logging.getLogger(__name__)
 
 class AuthService:
+    # User attributes that are safe to return to clients
+    PUBLIC_USER_ATTRIBUTES = ['user_id', 'email', 'name', 'role', 'status', 'created_at', 'last_login']
+    
     def __init__(self):
-        self.dynamodb = boto3.resource('dynamodb', region_name=Config.AWS_REGION)
-        self.users_table = self.dynamodb.Table(Config.DYNAMODB_USERS_TABLE)
+        self.dynamodb = get_resource('dynamodb')
+        self.users_table = get_table(Config.DYNAMODB_USERS_TABLE)
         self.jwt_secret = Config.JWT_SECRET_KEY
         self.token_expiry = Config.JWT_ACCESS_TOKEN_EXPIRES
         
-        # Ensure the table exists
-        self._create_users_table_if_not_exists()
+        # Verified token payloads keyed by token hash, and user roles, so
+        # authorising a request needs neither a signature check nor a read
+        self.token_cache = ExpiringCache(Config.AUTH_TOKEN_CACHE_MAX_ENTRIES)
+        self.role_cache = ExpiringCache(Config.AUTH_ROLE_CACHE_MAX_ENTRIES)
+        
+        # Passwords are hashed with a slow KDF on a bounded pool of their own
+        self.passwords = PasswordHashing()
+        self._dummy_password_hash = None
+        
+        # Ensure the table exists (verified once at startup)
+        register_table_check(Config.DYNAMODB_USERS_TABLE, self._create_users_table_if_not_exists)
     
     def _create_users_table_if_not_exists(self):
         """Create the users table if it doesn't exist"""
@@ -67,24 +82,19 @@ class AuthService:
                 logger.error(f"Error checking/creating table: {e}")
                 raise
     
-    def _hash_password(self, password, salt=None):
+    def _hash_password(self, password):
         """Hash a password for storing"""
-        if salt is None:
-            salt = base64.b64encode(uuid.uuid4().bytes).decode('utf-8')
-        
-        # Use HMAC with SHA-256 for password hashing
-        pwdhash = base64.b64encode(hmac.new(
-            salt.encode('utf-8'),
-            password.encode('utf-8'),
-            hashlib.sha256
-        ).digest()).decode('utf-8')
-        
-        return f"{salt}${pwdhash}"
+        return self.passwords.hash(password)
     
     def _verify_password(self, stored_password, provided_password):
-        """Verify a stored password against one provided by user"""
-        salt, stored_hash = stored_password.split('$')
-        return stored_password == self._hash_password(provided_password, salt)
+        """Verify a stored password against one provided by user, returning (valid, needs_rehash)"""
+        return self.passwords.verify(stored_password, provided_password)
+    
+    def _get_dummy_password_hash(self):
+        """Get a hash made with the current hasher that no password matches"""
+        if self._dummy_password_hash is None:
+            self._dummy_password_hash = self._hash_password(str(uuid.uuid4()))
+        return self._dummy_password_hash
     
     def _generate_token(self, user):
         """Generate a JWT token for the user"""
@@ -153,23 +163,30 @@ class AuthService:
         # Get user by email
         user = self._get_user_by_email(email)
         if not user:
+            # Spend as long as a real check, so response times don't reveal which emails have accounts
+            self._verify_password(self._get_dummy_password_hash(), password)
             raise ValueError("Invalid email or password")
         
         # Check password
-        if not self._verify_password(user['password'], password):
+        valid, needs_rehash = self._verify_password(user['password'], password)
+        if not valid:
             raise ValueError("Invalid email or password")
         
         # Check if user is active
         if user.get('status') != 'active':
             raise ValueError("Account is inactive. Please contact an administrator.")
         
-        # Update last login
+        # Update last login, upgrading a hash made with an old algorithm or cost
+        update_expression = "set last_login = :login"
+        expression_attribute_values = {':login': datetime.utcnow().isoformat()}
+        if needs_rehash:
+            update_expression += ", password = :password"
+            expression_attribute_values[':password'] = self._hash_password(password)
+        
         self.users_table.update_item(
             Key={'user_id': user['user_id']},
-            UpdateExpression="set last_login = :login",
-            ExpressionAttributeValues={
-                ':login': datetime.utcnow().isoformat()
-            }
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=expression_attribute_values
         )
         
         # Don't return the password
@@ -227,6 +244,8 @@ class AuthService:
             ExpressionAttributeValues=expression_attribute_values
         )
         
+        self.role_cache.invalidate(user_id)
+        
         # Get and return the updated user
         return self.get_user(user_id)
     
@@ -237,26 +256,69 @@ class AuthService:
         
         # Delete the user
         self.users_table.delete_item(Key={'user_id': user_id})
+        self.role_cache.invalidate(user_id)
         
         return {'message': f"User {user_id} deleted successfully"}
     
     def get_all_users(self):
         """Get all users (admin only)"""
-        response = self.users_table.scan()
-        users = response.get('Items', [])
-        
-        # Don't return passwords
-        for user in users:
-            user.pop('password', None)
-        
-        return users
+        # Don't read passwords at all
+        return list(iter_scan(self.users_table, attributes=self.PUBLIC_USER_ATTRIBUTES))
     
     def verify_token(self, token):
         """Verify a JWT token"""
+        # Tokens already verified are trusted until their exp
+        key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        payload = self.token_cache.get(key)
+        if payload is not None:
+            return dict(payload)
+        
         try:
             payload = jwt.decode(token, self.jwt_secret, algorithms=['HS256'])
-            return payload
         except jwt.ExpiredSignatureError:
             raise ValueError("Token has expired")
         except jwt.InvalidTokenError:
-            raise ValueError("Invalid token")
\ No newline at end of file
+            raise ValueError("Invalid token")
+        
+        if 'exp' in payload:
+            self.token_cache.put(key, dict(payload), payload['exp'])
+        return payload
+    
+    def get_user_access(self, user_id):
+        """Get the role and status of a user, cached for AUTH_ROLE_CACHE_TTL seconds"""
+        access = self.role_cache.get(user_id)
+        if access is None:
+            user = self.get_user(user_id)
+            access = {'role': user.get('role'), 'status': user.get('status')}
+            self.role_cache.put(user_id, access, time.time() + Config.AUTH_ROLE_CACHE_TTL)
+        return dict(access)
+    
+    def authenticate(self, token):
+        """Get the user a request's token belongs to, with their current role
+        
+        The role comes from the users table rather than the token, so a
+        changed role or a deactivated account takes effect within
+        AUTH_ROLE_CACHE_TTL seconds instead of when the token expires.
+        """
+        payload = self.verify_token(token)
+        
+        access = self.get_user_access(payload['user_id'])
+        if access['status'] != 'active':
+            raise ValueError("Account is inactive. Please contact an administrator.")
+        
+        return {
+            'user_id': payload['user_id'],
+            'email': payload.get('email'),
+            'role': access['role']
+        }
+    
+    def get_hashing_stats(self):
+        """Get the queue depth and timings of the password hashing pool"""
+        return self.passwords.stats()
+    
+    def get_cache_stats(self):
+        """Get hit/miss counters for the token and role caches"""
+        return {
+            'tokens': self.token_cache.stats(),
+            'roles': self.role_cache.stats()
+        }
\ No newline at end of file
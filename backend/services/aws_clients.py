@@ -0,0 +1,105 @@
+import boto3
+import logging
+import threading
+from botocore.config import Config as BotoConfig
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Process-wide AWS session, clients and resources shared by every service
+_session = None
+_clients = {}
+_resources = {}
+_tables = {}
+_lock = threading.Lock()
+
+# Table checks registered by the services, run once by verify_tables()
+_table_checks = {}
+_verified_tables = set()
+_verify_lock = threading.Lock()
+
+
+def _boto_config():
+    """Connection pool, keep-alive, timeout and retry settings for every client"""
+    return BotoConfig(
+        region_name=Config.AWS_REGION,
+        max_pool_connections=Config.AWS_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=Config.AWS_CONNECT_TIMEOUT,
+        read_timeout=Config.AWS_READ_TIMEOUT,
+        retries={
+            'mode': Config.AWS_RETRY_MODE,
+            'max_attempts': Config.AWS_MAX_ATTEMPTS
+        }
+    )
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = boto3.session.Session(region_name=Config.AWS_REGION)
+    return _session
+
+
+def get_client(service_name):
+    """Get the shared low-level client for an AWS service"""
+    client = _clients.get(service_name)
+    if client is None:
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                client = _get_session().client(service_name, config=_boto_config())
+                _clients[service_name] = client
+    return client
+
+
+def get_resource(service_name):
+    """Get the shared resource for an AWS service"""
+    resource = _resources.get(service_name)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(service_name)
+            if resource is None:
+                resource = _get_session().resource(service_name, config=_boto_config())
+                _resources[service_name] = resource
+    return resource
+
+
+def get_table(table_name):
+    """Get the shared DynamoDB Table for a table name"""
+    table = _tables.get(table_name)
+    if table is None:
+        table = get_resource('dynamodb').Table(table_name)
+        _tables[table_name] = table
+    return table
+
+
+def register_table_check(table_name, check):
+    """Register the function that verifies (or creates) a table
+
+    Checks don't run when they are registered; verify_tables() runs each of
+    them once per process.
+    """
+    with _verify_lock:
+        _table_checks.setdefault(table_name, check)
+
+
+def verify_tables():
+    """Run every registered table check that hasn't run yet"""
+    with _verify_lock:
+        pending = [(name, check) for name, check in _table_checks.items() if name not in _verified_tables]
+
+    for table_name, check in pending:
+        try:
+            check()
+            with _verify_lock:
+                _verified_tables.add(table_name)
+        except Exception as e:
+            logger.error(f"Error verifying table {table_name}: {str(e)}")
+
+
+def verify_tables_in_background():
+    """Verify the registered tables without blocking startup"""
+    thread = threading.Thread(target=verify_tables, name='table-verification', daemon=True)
+    thread.start()
+    return thread
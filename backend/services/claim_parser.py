@@ -0,0 +1,164 @@
+import math
+import re
+from collections import Counter
+import numpy as np
+from services.prior_art_index import tokenize
+
+# Start of a numbered claim: "1. A method...", "2) The method..." at the start of a line
+_CLAIM_START = re.compile(r'(?:^|\n)\s*(\d{1,3})\s*[.)]\s+')
+
+# References to other claims: "of claim 1", "according to claims 1 or 2", "as in any of claims 1-3"
+_CLAIM_REFERENCE = re.compile(r'\bclaims?\s+(\d{1,3}(?:\s*(?:-|to|through|,|or|and)\s*\d{1,3})*)', re.IGNORECASE)
+_REFERENCE_RANGE = re.compile(r'(\d{1,3})\s*(?:-|to|through)\s*(\d{1,3})')
+
+
+def parse_claims(text):
+    """Split the claims text of a patent into numbered claims
+
+    Returns a list of dicts with number, text, depends_on (the earlier claims
+    it references), independent, and root (the independent claim it
+    ultimately depends on). Text without numbered claims is returned as a
+    single independent claim.
+    """
+    text = (text or '').strip()
+    if not text:
+        return []
+
+    matches = list(_CLAIM_START.finditer(text))
+    if not matches:
+        return [{'number': 1, 'text': text, 'depends_on': [], 'independent': True, 'root': 1}]
+
+    claims = []
+    seen = set()
+    for i, match in enumerate(matches):
+        number = int(match.group(1))
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        claim_text = ' '.join(text[match.end():end].split())
+        if not claim_text or number in seen:
+            continue
+        seen.add(number)
+
+        # Only earlier claims can be depended on
+        depends_on = sorted(n for n in _referenced_claims(claim_text) if n in seen and n != number)
+        claims.append({
+            'number': number,
+            'text': claim_text,
+            'depends_on': depends_on,
+            'independent': not depends_on
+        })
+
+    roots = {}
+    for claim in claims:
+        claim['root'] = roots[claim['depends_on'][0]] if claim['depends_on'] else claim['number']
+        roots[claim['number']] = claim['root']
+
+    return claims
+
+
+def _referenced_claims(claim_text):
+    referenced = set()
+    for match in _CLAIM_REFERENCE.finditer(claim_text):
+        references = match.group(1)
+        for start, end in _REFERENCE_RANGE.findall(references):
+            referenced.update(range(int(start), int(end) + 1))
+        referenced.update(int(n) for n in re.findall(r'\d{1,3}', references))
+    return referenced
+
+
+def resolved_claim_texts(claims):
+    """Get the full text of every claim, including the limitations it inherits
+
+    A dependent claim incorporates every limitation of the claims it
+    depends on, so its text is prefixed with theirs.
+    """
+    resolved = {}
+    for claim in claims:
+        inherited = []
+        for number in claim['depends_on']:
+            if number in resolved and resolved[number] not in inherited:
+                inherited.append(resolved[number])
+        resolved[claim['number']] = ' '.join(inherited + [claim['text']])
+    return [resolved[claim['number']] for claim in claims]
+
+
+def claim_similarity_matrix(claim_texts, other_claim_texts):
+    """Compute the cosine similarity of every claim against every other claim
+
+    Claims are weighted as log-scaled TF-IDF over all the claims given, and
+    the whole matrix is computed with a single matrix product. Only the
+    terms of claim_texts get a column, since no other term can contribute
+    to a score; the other claims are still normalised over all their terms.
+    """
+    claim_terms = [Counter(tokenize(text)) for text in claim_texts]
+    other_terms = [Counter(tokenize(text)) for text in other_claim_texts]
+    if not claim_terms or not other_terms:
+        return np.zeros((len(claim_terms), len(other_terms)), dtype=np.float32)
+
+    document_frequencies = Counter()
+    for terms in claim_terms + other_terms:
+        document_frequencies.update(terms.keys())
+    document_count = len(claim_terms) + len(other_terms)
+
+    vocabulary = {}
+    for terms in claim_terms:
+        for term in terms:
+            vocabulary.setdefault(term, len(vocabulary))
+
+    def weigh(terms_list):
+        matrix = np.zeros((len(terms_list), len(vocabulary)), dtype=np.float32)
+        for row, terms in enumerate(terms_list):
+            norm = 0.0
+            for term, count in terms.items():
+                weight = (1 + math.log(count)) * (math.log(document_count / document_frequencies[term]) + 1)
+                norm += weight * weight
+                column = vocabulary.get(term)
+                if column is not None:
+                    matrix[row, column] = weight
+            if norm > 0:
+                matrix[row] /= math.sqrt(norm)
+        return matrix
+
+    return np.clip(weigh(claim_terms) @ weigh(other_terms).T, 0, 1)
+
+
+def match_claims(claims_text, candidates):
+    """Find the best matching candidate claim for every claim of a patent
+
+    candidates maps patent IDs to their claims text. All candidate claims
+    are scored against all of the patent's claims in one batch. Returns one
+    dict per claim with number, independent and best_match (patent_id,
+    claim and similarity, or None when nothing overlaps).
+    """
+    claims = parse_claims(claims_text)
+    if not claims:
+        return []
+
+    # Flatten the candidates' claims into the columns of the matrix
+    columns = []
+    candidate_texts = []
+    for patent_id, candidate_claims_text in candidates.items():
+        candidate_claims = parse_claims(candidate_claims_text)
+        columns.extend((patent_id, claim['number']) for claim in candidate_claims)
+        candidate_texts.extend(resolved_claim_texts(candidate_claims))
+
+    similarities = claim_similarity_matrix(resolved_claim_texts(claims), candidate_texts)
+    best_columns = similarities.argmax(axis=1) if columns else None
+
+    claim_matches = []
+    for row, claim in enumerate(claims):
+        best_match = None
+        if best_columns is not None and similarities[row, best_columns[row]] > 0:
+            patent_id, number = columns[best_columns[row]]
+            best_match = {
+                'patent_id': patent_id,
+                'claim': number,
+                'similarity': round(float(similarities[row, best_columns[row]]), 4)
+            }
+        claim_matches.append({
+            'claim': claim['number'],
+            'independent': claim['independent'],
+            'depends_on': claim['depends_on'],
+            'best_match': best_match
+        })
+
+    return claim_matches
@@ -0,0 +1,266 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from config import Config
+from services.aws_clients import get_resource, get_table, register_table_check
+from services.dynamodb_repository import batch_get_items
+
+logger = logging.getLogger(__name__)
+
+
+class DynamoDBCacheStore:
+    """Durable cache tier stored in a DynamoDB table.
+
+    Entries carry an expires_at epoch attribute that DynamoDB TTL uses to
+    delete them; expired entries that haven't been removed yet are ignored.
+    """
+
+    def __init__(self, table_name=None):
+        self.table_name = table_name or Config.DYNAMODB_COMPREHEND_CACHE_TABLE
+        self.dynamodb = get_resource('dynamodb')
+        self.table = get_table(self.table_name)
+
+        # Ensure the table exists (verified once at startup)
+        register_table_check(self.table_name, self._create_cache_table_if_not_exists)
+
+    def _create_cache_table_if_not_exists(self):
+        """Create the cache table if it doesn't exist"""
+        try:
+            # Check if table exists
+            self.dynamodb.meta.client.describe_table(TableName=self.table_name)
+            logger.info(f"Table {self.table_name} already exists")
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                # Create the table
+                table = self.dynamodb.create_table(
+                    TableName=self.table_name,
+                    KeySchema=[
+                        {'AttributeName': 'cache_key', 'KeyType': 'HASH'}
+                    ],
+                    AttributeDefinitions=[
+                        {'AttributeName': 'cache_key', 'AttributeType': 'S'}
+                    ],
+                    ProvisionedThroughput={
+                        'ReadCapacityUnits': 5,
+                        'WriteCapacityUnits': 5
+                    }
+                )
+                # Wait for the table to be created
+                table.meta.client.get_waiter('table_exists').wait(TableName=self.table_name)
+
+                # Let DynamoDB delete expired entries
+                self.dynamodb.meta.client.update_time_to_live(
+                    TableName=self.table_name,
+                    TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'}
+                )
+                logger.info(f"Created table {self.table_name}")
+            else:
+                logger.error(f"Error checking/creating table: {e}")
+                raise
+
+    def get(self, key):
+        """Get a cached value, or None if it is missing or expired"""
+        response = self.table.get_item(Key={'cache_key': key})
+        item = response.get('Item')
+
+        if not item or int(item.get('expires_at', 0)) <= time.time():
+            return None
+
+        return json.loads(item['value'])
+
+    def get_many(self, keys):
+        """Get several cached values at once, as a dict of the keys found"""
+        found = {}
+        now = time.time()
+
+        # Keys still unprocessed after the retries are treated as misses
+        for item in batch_get_items(self.dynamodb, self.table_name, [{'cache_key': key} for key in keys]):
+            if int(item.get('expires_at', 0)) > now:
+                found[item['cache_key']] = json.loads(item['value'])
+
+        return found
+
+    def put(self, key, value, ttl):
+        """Store a value for ttl seconds"""
+        self.table.put_item(Item=self._item(key, value, ttl))
+
+    def put_many(self, entries, ttl):
+        """Store several (key, value) pairs for ttl seconds"""
+        with self.table.batch_writer(overwrite_by_pkeys=['cache_key']) as batch:
+            for key, value in entries:
+                batch.put_item(Item=self._item(key, value, ttl))
+
+    def _item(self, key, value, ttl):
+        return {
+            'cache_key': key,
+            'value': json.dumps(value),
+            'expires_at': int(time.time() + ttl)
+        }
+
+
+class ComprehendCache:
+    """Content-addressed cache of Amazon Comprehend responses.
+
+    Responses are keyed by a hash of the API name, language and the exact text
+    sent, and kept in an in-memory LRU tier in front of an optional durable tier.
+    Both tiers expire entries after the TTL; the memory tier also evicts the
+    least recently used entries beyond max_entries.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, store=None):
+        self.max_entries = max_entries or Config.COMPREHEND_CACHE_MAX_ENTRIES
+        self.ttl = ttl or Config.COMPREHEND_CACHE_TTL
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'durable_hits': 0,
+            'misses': 0,
+            'evictions': 0
+        }
+
+    @staticmethod
+    def make_key(api, text, language):
+        """Build the cache key for a Comprehend request"""
+        digest = hashlib.sha256()
+        digest.update(f"{api}\0{language}\0".encode('utf-8'))
+        digest.update(text.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, api, text, language='en'):
+        """Get the cached response for a request, or None on a miss"""
+        key = self.make_key(api, text, language)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return value
+                del self._entries[key]
+
+        if self.store is not None:
+            try:
+                value = self.store.get(key)
+            except Exception as e:
+                logger.error(f"Error reading Comprehend cache: {str(e)}")
+                value = None
+
+            if value is not None:
+                self._remember(key, value)
+                with self._lock:
+                    self._stats['durable_hits'] += 1
+                return value
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def put(self, api, text, language, value):
+        """Cache the response for a request"""
+        key = self.make_key(api, text, language)
+        self._remember(key, value)
+
+        if self.store is not None:
+            try:
+                self.store.put(key, value, self.ttl)
+            except Exception as e:
+                # The memory tier still has the entry; the durable copy is best effort
+                logger.error(f"Error writing Comprehend cache: {str(e)}")
+
+    def get_many(self, api, texts, language='en'):
+        """Get the cached responses for several requests, with None for each miss"""
+        keys = [self.make_key(api, text, language) for text in texts]
+        values = [None] * len(texts)
+        missing = []
+        now = time.monotonic()
+
+        with self._lock:
+            for index, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    values[index] = entry[1]
+                    self._stats['memory_hits'] += 1
+                else:
+                    missing.append(index)
+
+        if missing and self.store is not None:
+            try:
+                found = self.store.get_many(list({keys[index] for index in missing}))
+            except Exception as e:
+                logger.error(f"Error reading Comprehend cache: {str(e)}")
+                found = {}
+
+            still_missing = []
+            for index in missing:
+                value = found.get(keys[index])
+                if value is None:
+                    still_missing.append(index)
+                    continue
+                values[index] = value
+                self._remember(keys[index], value)
+                with self._lock:
+                    self._stats['durable_hits'] += 1
+            missing = still_missing
+
+        with self._lock:
+            self._stats['misses'] += len(missing)
+
+        return values
+
+    def put_many(self, api, entries, language='en'):
+        """Cache the responses for several (text, response) pairs"""
+        keyed = [(self.make_key(api, text, language), value) for text, value in entries]
+        for key, value in keyed:
+            self._remember(key, value)
+
+        if keyed and self.store is not None:
+            try:
+                self.store.put_many(keyed, self.ttl)
+            except Exception as e:
+                logger.error(f"Error writing Comprehend cache: {str(e)}")
+
+    def stats(self):
+        """Get hit/miss counters for the cache"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+
+        stats['hits'] = stats['memory_hits'] + stats['durable_hits']
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0
+        return stats
+
+    def clear(self):
+        """Drop every entry from the memory tier"""
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+
+def create_comprehend_cache(backend=None):
+    """Create the Comprehend cache with the configured durable tier"""
+    backend = backend or Config.COMPREHEND_CACHE_BACKEND
+
+    if backend == 'dynamodb':
+        return ComprehendCache(store=DynamoDBCacheStore())
+    if backend == 'memory':
+        return ComprehendCache()
+
+    raise ValueError(f"Unknown Comprehend cache backend: {backend}")
@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = {'pdf', 'docx', 'txt'}
+
+
+def _init_worker():
+    # Handlers whose background threads weren't forked along would silently drop the worker's logs
+    from services.log_shipper import DynamoDBLogHandler
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, DynamoDBLogHandler):
+            root.removeHandler(handler)
+
+
+def _iter_pdf_pages(path):
+    """Yield the text of a PDF one page at a time"""
+    from PyPDF2 import PdfReader
+
+    # PdfReader parses pages on access, so only one page is held at a time
+    reader = PdfReader(path)
+    for page in reader.pages:
+        yield page.extract_text() or ''
+
+
+def _iter_docx_paragraphs(path):
+    """Yield the text of a DOCX document one paragraph at a time"""
+    from docx import Document
+
+    document = Document(path)
+    for paragraph in document.paragraphs:
+        yield paragraph.text
+    for table in document.tables:
+        for row in table.rows:
+            yield ' '.join(cell.text for cell in row.cells)
+
+
+def _iter_text_lines(path):
+    """Yield the lines of a plain text file"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            yield line.rstrip('\n')
+
+
+def _extract_to_file(path, extension, output_path, max_chars):
+    """Stream the text of a document into output_path (runs in a worker process)
+
+    Text is written as it is extracted so a large document is never held in
+    memory. Returns the number of characters written.
+    """
+    if extension == 'pdf':
+        parts = _iter_pdf_pages(path)
+    elif extension == 'docx':
+        parts = _iter_docx_paragraphs(path)
+    else:
+        parts = _iter_text_lines(path)
+
+    written = 0
+    partial_path = f"{output_path}.{os.getpid()}.partial"
+    with open(partial_path, 'w', encoding='utf-8') as output:
+        for part in parts:
+            if not part:
+                continue
+            part = part[:max_chars - written]
+            output.write(part)
+            output.write('\n')
+            written += len(part)
+            if written >= max_chars:
+                break
+
+    # Publish the result atomically so readers never see a partial extraction
+    os.replace(partial_path, output_path)
+    return written
+
+
+class DocumentExtractor:
+    """Extracts the text of uploaded patent documents.
+
+    Parsing runs in a process pool so CPU-heavy PDF parsing doesn't hold the
+    GIL of the request and analysis threads. Extracted text is cached on disk
+    by the SHA-256 of the file contents, so an unchanged document is only
+    parsed once.
+    """
+
+    def __init__(self, cache_dir=None, workers=None, max_chars=None):
+        self.cache_dir = cache_dir or Config.EXTRACTION_CACHE_DIR
+        self.workers = workers or Config.EXTRACTION_WORKERS
+        self.max_chars = max_chars or Config.EXTRACTION_MAX_CHARS
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def extract(self, file_path):
+        """Get the text of a document, extracting it if it isn't cached"""
+        extension = file_path.rsplit('.', 1)[-1].lower() if '.' in file_path else ''
+        if extension not in SUPPORTED_EXTENSIONS:
+            logger.warning(f"Text extraction is not supported for {file_path}")
+            return ''
+
+        output_path = os.path.join(self.cache_dir, f"{self._content_hash(file_path)}.txt")
+
+        if not os.path.exists(output_path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            future = self._get_executor().submit(
+                _extract_to_file, file_path, extension, output_path, self.max_chars
+            )
+            written = future.result(timeout=Config.EXTRACTION_TIMEOUT)
+            logger.info(f"Extracted {written} characters from {file_path}")
+
+        with open(output_path, 'r', encoding='utf-8') as file:
+            return file.read()
+
+    def start(self):
+        """Start the worker processes
+
+        Call this before the application starts its own threads, so the workers
+        are forked from a process that isn't holding any thread's locks.
+        """
+        executor = self._get_executor()
+        for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+            return self._executor
+
+    def _content_hash(self, file_path):
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
@@ -0,0 +1,153 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of one segment's pages in a parallel scan
+_SEGMENT_DONE = object()
+
+# Most keys a single BatchGetItem request accepts
+BATCH_GET_SIZE = 100
+
+
+def projection_kwargs(attributes, existing_names=None):
+    """Build the ProjectionExpression kwargs for a list of attribute names
+
+    Every attribute goes through an expression attribute name, so reserved
+    words such as 'status' or 'timestamp' can be projected. Names already used
+    by other expressions in the request can be passed in existing_names.
+    """
+    names = dict(existing_names or {})
+    placeholders = []
+    for index, attribute in enumerate(attributes):
+        placeholder = f"#proj{index}"
+        names[placeholder] = attribute
+        placeholders.append(placeholder)
+
+    return {
+        'ProjectionExpression': ', '.join(placeholders),
+        'ExpressionAttributeNames': names
+    }
+
+
+def _request_kwargs(attributes, kwargs):
+    request = dict(kwargs)
+    if attributes:
+        request.update(projection_kwargs(attributes, request.get('ExpressionAttributeNames')))
+    return request
+
+
+def iter_pages(operation, **kwargs):
+    """Yield every page of a paginated scan or query"""
+    while True:
+        response = operation(**kwargs)
+        yield response
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def iter_query(table, attributes=None, **kwargs):
+    """Yield every item matched by a query, following pagination
+
+    attributes limits the item to the listed attributes; any other keyword
+    arguments are passed to Table.query unchanged.
+    """
+    for page in iter_pages(table.query, **_request_kwargs(attributes, kwargs)):
+        yield from page.get('Items', [])
+
+
+def iter_scan(table, attributes=None, segments=None, **kwargs):
+    """Yield every item of a scan, following pagination
+
+    With more than one segment the table is read as a parallel scan, one
+    thread per segment, and items are yielded in the order pages arrive.
+    attributes limits the item to the listed attributes; any other keyword
+    arguments are passed to Table.scan unchanged.
+    """
+    request = _request_kwargs(attributes, kwargs)
+    segments = segments or 1
+
+    if segments == 1:
+        for page in iter_pages(table.scan, **request):
+            yield from page.get('Items', [])
+        return
+
+    yield from _parallel_scan(table, request, segments)
+
+
+def _parallel_scan(table, request, segments):
+    # A small bound keeps memory flat when the consumer is slower than the scan
+    pages = queue.Queue(maxsize=segments * 2)
+    stopping = threading.Event()
+
+    def scan_segment(segment):
+        try:
+            for page in iter_pages(table.scan, Segment=segment, TotalSegments=segments, **request):
+                while not stopping.is_set():
+                    try:
+                        pages.put(page.get('Items', []), timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stopping.is_set():
+                    return
+        except Exception as e:
+            pages.put(e)
+        finally:
+            pages.put(_SEGMENT_DONE)
+
+    threads = [
+        threading.Thread(target=scan_segment, args=(segment,), name=f"scan-segment-{segment}", daemon=True)
+        for segment in range(segments)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        remaining = segments
+        while remaining:
+            page = pages.get()
+            if page is _SEGMENT_DONE:
+                remaining -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        # Let the segment threads exit if the consumer stops early or a segment failed
+        stopping.set()
+        while any(thread.is_alive() for thread in threads):
+            try:
+                pages.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def batch_get_items(dynamodb, table_name, keys, attributes=None, max_retries=5):
+    """Get many items by key with BatchGetItem, in requests of up to 100 keys
+
+    Unprocessed keys are retried with exponential backoff. Returns the items
+    found, in no particular order.
+    """
+    items = []
+    keys = list(keys)
+    for start in range(0, len(keys), BATCH_GET_SIZE):
+        request = {'Keys': keys[start:start + BATCH_GET_SIZE]}
+        if attributes:
+            request.update(projection_kwargs(attributes))
+
+        request_items = {table_name: request}
+        for attempt in range(max_retries + 1):
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(response.get('Responses', {}).get(table_name, []))
+            request_items = response.get('UnprocessedKeys') or {}
+            if not request_items:
+                break
+            time.sleep(min(0.05 * (2 ** attempt), 1.0))
+        else:
+            logger.warning(f"Gave up on {len(request_items[table_name]['Keys'])} unprocessed keys of {table_name}")
+
+    return items
@@ -0,0 +1,263 @@
+import logging
+import math
+import os
+import threading
+import zlib
+from collections import Counter
+import numpy as np
+from config import Config
+from services.prior_art_index import INDEXED_FIELDS, tokenize
+from services.similarity_snapshot import Segment, SegmentedSimilarityEngine, SnapshotStore, encode_ids
+
+logger = logging.getLogger(__name__)
+
+# Width of the hashing vectorizer, before the random projection
+HASH_FEATURES = 1 << 18
+
+# Output dimensions each hashed feature contributes to in the sparse projection
+PROJECTION_NONZEROS = 4
+
+# Rows multiplied at a time when scoring, to bound the float32 working set
+SCORE_BLOCK_SIZE = 65536
+
+_projections = {}
+_projections_lock = threading.Lock()
+
+
+def _get_projection(dim, seed):
+    """Get the (positions, signs) of the sparse random projection for a dimension and seed"""
+    key = (dim, seed)
+    with _projections_lock:
+        if key not in _projections:
+            generator = np.random.RandomState(seed)
+            positions = generator.randint(0, dim, size=(HASH_FEATURES, PROJECTION_NONZEROS)).astype(np.int32)
+            signs = generator.choice(np.array([-1.0, 1.0], dtype=np.float32), size=(HASH_FEATURES, PROJECTION_NONZEROS))
+            _projections[key] = (positions, signs)
+        return _projections[key]
+
+
+def _hash_features(keys):
+    return np.fromiter((zlib.crc32(key) for key in keys), dtype=np.int64, count=len(keys)) & (HASH_FEATURES - 1)
+
+
+def quantize(vectors):
+    """Quantize unit vectors to int8 codes with one float32 scale per vector"""
+    scales = (np.abs(vectors).max(axis=1) / 127).astype(np.float32)
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, np.newaxis]).astype(np.int8), scales
+
+
+class HashingEmbedder:
+    """Turns term frequencies into a fixed-size unit vector without a model.
+
+    Terms are hashed into HASH_FEATURES features (a hashing vectorizer),
+    weighted by log term frequency times IDF, and reduced to dim dimensions
+    with a seeded sparse random projection in which every feature adds
+    +/-1 to PROJECTION_NONZEROS dimensions. The projection depends only on
+    the seed, so vectors computed by different processes are comparable.
+    """
+
+    def __init__(self, dim, seed, idf_terms, idf, document_count):
+        self.dim = dim
+        self._positions, self._signs = _get_projection(dim, seed)
+
+        # IDF is frozen with the snapshot so every vector uses the same weights
+        self._idf_terms = idf_terms
+        self._idf = idf
+        self._unseen_idf = math.log(document_count + 1) + 1
+
+    def embed(self, term_frequencies):
+        """Embed a {term: count} mapping, returning None if it has no terms"""
+        if not term_frequencies:
+            return None
+
+        keys = encode_ids(term_frequencies)
+        counts = np.fromiter(term_frequencies.values(), dtype=np.float32, count=len(keys))
+        features = _hash_features(keys)
+        weights = (1 + np.log(counts)) * self.idf_of(keys)
+
+        contributions = self._signs[features] * weights[:, np.newaxis]
+        vector = np.bincount(self._positions[features].ravel(), weights=contributions.ravel(),
+                             minlength=self.dim).astype(np.float32)
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def embed_postings(self, terms, rows, frequencies, row_count, block_size=10000):
+        """Embed a whole corpus given as postings (see PriorArtIndex.export_postings)
+
+        Yields (first_row, vectors) blocks of unit vectors; rows without terms
+        are left as zero vectors.
+        """
+        keys = encode_ids(terms)
+        term_features = _hash_features(keys)
+        term_idf = self.idf_of(keys)
+
+        entry_counts = np.fromiter((len(term_rows) for term_rows in rows), dtype=np.int64, count=len(terms))
+        entry_terms = np.repeat(np.arange(len(terms)), entry_counts)
+        entry_rows = np.fromiter((row for term_rows in rows for row in term_rows), dtype=np.int64,
+                                 count=len(entry_terms))
+        entry_weights = (1 + np.log(np.fromiter((f for term_frequencies in frequencies for f in term_frequencies),
+                                                dtype=np.float32, count=len(entry_terms)))) * term_idf[entry_terms]
+
+        # Group the entries by row so the corpus can be projected a block of rows at a time
+        order = np.argsort(entry_rows, kind='stable')
+        sorted_rows = entry_rows[order]
+
+        for start in range(0, row_count, block_size):
+            end = min(start + block_size, row_count)
+            selected = order[np.searchsorted(sorted_rows, start):np.searchsorted(sorted_rows, end)]
+
+            features = term_features[entry_terms[selected]]
+            flat_positions = (entry_rows[selected] - start)[:, np.newaxis] * self.dim + self._positions[features]
+            contributions = self._signs[features] * entry_weights[selected, np.newaxis]
+            vectors = np.bincount(flat_positions.ravel(), weights=contributions.ravel(),
+                                  minlength=(end - start) * self.dim).reshape(end - start, self.dim).astype(np.float32)
+
+            norms = np.linalg.norm(vectors, axis=1)
+            vectors /= np.where(norms > 0, norms, 1)[:, np.newaxis]
+            yield start, vectors
+
+    def embed_patent(self, patent):
+        """Embed the indexed text of a patent item"""
+        return self.embed(Counter(tokenize(' '.join(str(patent.get(field) or '') for field in INDEXED_FIELDS))))
+
+    def idf_of(self, keys):
+        """Look up the IDF of encoded terms"""
+        idf = np.full(len(keys), self._unseen_idf, dtype=np.float32)
+        if len(self._idf_terms) and len(keys):
+            positions = np.minimum(np.searchsorted(self._idf_terms, keys), len(self._idf_terms) - 1)
+            found = self._idf_terms[positions] == keys
+            idf[found] = self._idf[positions[found]]
+        return idf
+
+
+def train_ivf(codes, scales, iterations=10, seed=0):
+    """Train an IVF coarse quantiser (spherical k-means with sqrt(n) clusters)
+
+    Returns the centroids and the cluster assignment of every vector.
+    """
+    generator = np.random.RandomState(seed)
+    clusters = int(math.sqrt(len(codes)))
+    sample = np.arange(len(codes))
+    if len(sample) > clusters * 256:
+        sample = np.sort(generator.choice(sample, clusters * 256, replace=False))
+    vectors = codes[sample].astype(np.float32) * scales[sample, np.newaxis]
+
+    centroids = vectors[generator.choice(len(vectors), clusters, replace=False)]
+    for _ in range(iterations):
+        nearest = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, nearest, vectors)
+        norms = np.linalg.norm(sums, axis=1)
+        filled = norms > 0
+        # Empty clusters keep their previous centroid
+        centroids[filled] = sums[filled] / norms[filled, np.newaxis]
+
+    assignments = np.zeros(len(codes), dtype=np.int32)
+    for start in range(0, len(codes), SCORE_BLOCK_SIZE):
+        block = slice(start, start + SCORE_BLOCK_SIZE)
+        assignments[block] = np.argmax(codes[block].astype(np.float32) @ centroids.T, axis=1)
+
+    logger.info(f"Trained IVF quantiser with {clusters} clusters over {len(codes)} vectors")
+    return centroids.astype(np.float32), assignments
+
+
+class _VectorSegment(Segment):
+    """int8-quantised unit vectors, searched exactly or through an IVF quantiser.
+
+    Each vector is dim int8 codes plus a float32 scale. Segments with
+    centroids only score the vectors of the nprobe closest clusters;
+    otherwise every vector is scored with a blocked matrix-vector product.
+    """
+
+    def __init__(self, arrays, nprobe, embedder=None):
+        super().__init__(arrays)
+        self.codes = arrays['codes']
+        self.scales = arrays['scales']
+        self.centroids = arrays.get('centroids')
+        self.assignments = arrays.get('assignments')
+        self.nprobe = nprobe
+        self.embedder = embedder
+
+    def score(self, query, rows=None):
+        """Score the vectors (or only the given rows) against a unit query vector"""
+        if rows is None and self.centroids is not None and len(self.centroids):
+            probes = np.argsort(-(self.centroids @ query))[:self.nprobe]
+            rows = np.flatnonzero(np.isin(self.assignments, probes))
+
+        scores = np.zeros(len(self), dtype=np.float32)
+        for start in range(0, len(self) if rows is None else len(rows), SCORE_BLOCK_SIZE):
+            block = slice(start, start + SCORE_BLOCK_SIZE) if rows is None else rows[start:start + SCORE_BLOCK_SIZE]
+            scores[block] = (self.codes[block].astype(np.float32) @ query) * self.scales[block]
+        return scores
+
+
+class EmbeddingEngine(SegmentedSimilarityEngine):
+    """Similarity engine that ranks patents by the cosine of their hashed embeddings.
+
+    It has the same interface as SimilarityEngine and is persisted the same
+    way. The base snapshot holds the IDF the embedder was built with and, once
+    it has EMBEDDING_IVF_MIN_SIZE patents, the IVF centroids; delta segments
+    are small and always searched exactly.
+    """
+
+    def __init__(self, index, dim=None, seed=None, store=None):
+        self.dim = dim or Config.EMBEDDING_DIM
+        self.seed = Config.EMBEDDING_SEED if seed is None else seed
+        self.ivf_min_size = Config.EMBEDDING_IVF_MIN_SIZE
+        self.nprobe = Config.EMBEDDING_IVF_NPROBE
+
+        super().__init__(
+            index,
+            store or SnapshotStore(os.path.join(Config.SIMILARITY_SNAPSHOT_DIR, f"embedding-{self.dim}")),
+            segment_size=Config.SIMILARITY_SEGMENT_SIZE,
+            max_segments=Config.SIMILARITY_MAX_SEGMENTS,
+            max_pending=Config.SIMILARITY_MAX_PENDING
+        )
+
+    def _compatible(self, metadata):
+        return metadata.get('dim') == self.dim and metadata.get('seed') == self.seed
+
+    def _build_base(self, patent_ids, terms, rows, frequencies):
+        keys = encode_ids(terms)
+        order = np.argsort(keys, kind='stable')
+        document_frequencies = np.fromiter((len(term_rows) for term_rows in rows), dtype=np.int64, count=len(terms))
+        idf = (np.log((len(patent_ids) + 1) / (document_frequencies + 1)) + 1).astype(np.float32)
+
+        embedder = HashingEmbedder(self.dim, self.seed, keys[order], idf[order], len(patent_ids))
+
+        codes = np.zeros((len(patent_ids), self.dim), dtype=np.int8)
+        scales = np.ones(len(patent_ids), dtype=np.float32)
+        for start, vectors in embedder.embed_postings(terms, rows, frequencies, len(patent_ids)):
+            block = slice(start, start + len(vectors))
+            codes[block], scales[block] = quantize(vectors)
+
+        arrays = {'codes': codes, 'scales': scales, 'idf_terms': keys[order], 'idf': idf[order]}
+        if len(patent_ids) >= self.ivf_min_size:
+            arrays['centroids'], arrays['assignments'] = train_ivf(codes, scales)
+
+        logger.info(f"Embedded {len(patent_ids)} patents into {self.dim} dimensions")
+
+        metadata = {'dim': self.dim, 'seed': self.seed, 'document_count': len(patent_ids)}
+        return arrays, metadata
+
+    def _build_segment(self, present, metadata, base):
+        vectors = np.zeros((len(present), self.dim), dtype=np.float32)
+        for row, (_, term_frequencies) in enumerate(present):
+            vector = base.embedder.embed(term_frequencies)
+            if vector is not None:
+                vectors[row] = vector
+
+        codes, scales = quantize(vectors)
+        return {'codes': codes, 'scales': scales}
+
+    def _open_segment(self, arrays, metadata, base):
+        embedder = None
+        if base is None:
+            embedder = HashingEmbedder(self.dim, self.seed, arrays['idf_terms'], arrays['idf'],
+                                       metadata['document_count'])
+        return _VectorSegment(arrays, self.nprobe, embedder)
+
+    def _prepare_query(self, patent, metadata, base):
+        return base.embedder.embed_patent(patent)
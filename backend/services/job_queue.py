@@ -0,0 +1,225 @@
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+from config import Config
+from services.aws_clients import get_client
+
+logger = logging.getLogger(__name__)
+
+
+class JobMessage:
+    """A job received from a queue, acknowledged once it has been processed"""
+
+    def __init__(self, job, receipt):
+        self.job = job
+        self.receipt = receipt
+
+
+class LocalJobQueue:
+    """In-process job queue used for tests and single-process deployments.
+
+    Received jobs stay in flight until they are acknowledged. If a worker dies or
+    hangs past the visibility timeout the job becomes visible again, which gives
+    the same at-least-once delivery as the SQS backend.
+    """
+
+    def __init__(self, visibility_timeout=None):
+        self.visibility_timeout = visibility_timeout or Config.ANALYSIS_VISIBILITY_TIMEOUT
+        self._ready = []
+        self._in_flight = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._ready) + len(self._in_flight)
+
+    def enqueue(self, job, delay=0):
+        """Add a job to the queue, optionally delaying its delivery"""
+        with self._condition:
+            heapq.heappush(self._ready, (time.monotonic() + delay, next(self._sequence), job))
+            self._condition.notify()
+
+    def receive(self, timeout=1):
+        """Wait up to timeout seconds for the next job"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._requeue_expired(now)
+
+                if self._ready and self._ready[0][0] <= now:
+                    _, _, job = heapq.heappop(self._ready)
+                    receipt = str(uuid.uuid4())
+                    self._in_flight[receipt] = (now + self.visibility_timeout, job)
+                    return JobMessage(job, receipt)
+
+                if now >= deadline:
+                    return None
+
+                wait = deadline - now
+                if self._ready:
+                    wait = min(wait, self._ready[0][0] - now)
+                if self._in_flight:
+                    wait = min(wait, min(expiry for expiry, _ in self._in_flight.values()) - now)
+                self._condition.wait(max(wait, 0))
+
+    def ack(self, message):
+        """Remove a processed job from the queue"""
+        with self._condition:
+            self._in_flight.pop(message.receipt, None)
+
+    def _requeue_expired(self, now):
+        for receipt, (expiry, job) in list(self._in_flight.items()):
+            if expiry <= now:
+                del self._in_flight[receipt]
+                heapq.heappush(self._ready, (now, next(self._sequence), job))
+                logger.warning(f"Job {job.get('job_id')} was not acknowledged in time and will be redelivered")
+
+
+class SQSJobQueue:
+    """Job queue backed by Amazon SQS"""
+
+    # SQS caps message delays at 15 minutes
+    MAX_DELAY_SECONDS = 900
+
+    def __init__(self, queue_url=None, visibility_timeout=None):
+        self.sqs = get_client('sqs')
+        self.queue_url = queue_url or Config.ANALYSIS_QUEUE_URL
+        self.visibility_timeout = visibility_timeout or Config.ANALYSIS_VISIBILITY_TIMEOUT
+
+        if not self.queue_url:
+            raise ValueError("ANALYSIS_QUEUE_URL must be set to use the SQS analysis queue")
+
+    def enqueue(self, job, delay=0):
+        """Add a job to the queue, optionally delaying its delivery"""
+        self.sqs.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=json.dumps(job),
+            DelaySeconds=min(int(delay), self.MAX_DELAY_SECONDS)
+        )
+
+    def receive(self, timeout=1):
+        """Long-poll up to timeout seconds for the next job"""
+        response = self.sqs.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=1,
+            WaitTimeSeconds=min(int(timeout), 20),
+            VisibilityTimeout=self.visibility_timeout
+        )
+
+        messages = response.get('Messages', [])
+        if not messages:
+            return None
+
+        return JobMessage(json.loads(messages[0]['Body']), messages[0]['ReceiptHandle'])
+
+    def ack(self, message):
+        """Remove a processed job from the queue"""
+        self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message.receipt)
+
+
+def create_job_queue(backend=None):
+    """Create the job queue for the configured backend"""
+    backend = backend or Config.ANALYSIS_QUEUE_BACKEND
+
+    if backend == 'local':
+        return LocalJobQueue()
+    if backend == 'sqs':
+        return SQSJobQueue()
+
+    raise ValueError(f"Unknown analysis queue backend: {backend}")
+
+
+class WorkerPool:
+    """Pool of worker threads draining a job queue.
+
+    A job is acknowledged only after its handler returns. Failed jobs are
+    re-enqueued with exponential backoff until max_attempts is reached;
+    on_error is told about every failure and whether it will be retried.
+    """
+
+    def __init__(self, job_queue, handler, on_error=None, workers=None, max_attempts=None, retry_delay=None,
+                 name='worker'):
+        self.job_queue = job_queue
+        self.handler = handler
+        self.on_error = on_error
+        self.workers = workers or Config.ANALYSIS_WORKERS
+        self.max_attempts = max_attempts or Config.ANALYSIS_MAX_ATTEMPTS
+        self.retry_delay = Config.ANALYSIS_RETRY_DELAY if retry_delay is None else retry_delay
+        self.name = name
+        self._threads = []
+        self._stopping = threading.Event()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        """Start the worker threads"""
+        if self.running:
+            return
+
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+        logger.info(f"Started {self.workers} {self.name} threads")
+
+    def stop(self, timeout=None):
+        """Stop the worker threads once they finish their current job"""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                message = self.job_queue.receive(timeout=1)
+            except Exception as e:
+                logger.error(f"Error receiving job: {str(e)}")
+                self._stopping.wait(self.retry_delay)
+                continue
+
+            if message is not None:
+                self._process(message)
+
+    def _process(self, message):
+        job = message.job
+        attempt = job.get('attempt', 1)
+
+        try:
+            self.handler(job)
+        except Exception as e:
+            will_retry = attempt < self.max_attempts
+            logger.error(f"Job {job.get('job_id')} failed on attempt {attempt}/{self.max_attempts}: {str(e)}")
+
+            if self.on_error:
+                try:
+                    self.on_error(job, e, will_retry)
+                except Exception as callback_error:
+                    logger.error(f"Error handling failure of job {job.get('job_id')}: {str(callback_error)}")
+
+            if will_retry:
+                # Enqueue the retry before acknowledging so the job can't be lost in between
+                retry_job = dict(job, attempt=attempt + 1)
+                try:
+                    self.job_queue.enqueue(retry_job, delay=self.retry_delay * 2 ** (attempt - 1))
+                except Exception as enqueue_error:
+                    # Leave the message unacknowledged so the queue redelivers it
+                    logger.error(f"Error scheduling retry of job {job.get('job_id')}: {str(enqueue_error)}")
+                    return
+
+        try:
+            self.job_queue.ack(message)
+        except Exception as e:
+            logger.error(f"Error acknowledging job {job.get('job_id')}: {str(e)}")
@@ -0,0 +1,49 @@
+import re
+
+
+class KeywordMatcher:
+    """Finds occurrences of a fixed set of keywords in a single pass over a text.
+
+    The keywords are compiled into one case-insensitive alternation, longest
+    first, so where keywords overlap the longest one at a position wins (a
+    match for "neural network" is not also counted as "network"). Words in a
+    keyword match across any run of whitespace.
+    """
+
+    def __init__(self, keywords):
+        # Map the normalised form of each keyword back to its original spelling
+        self._canonical = {}
+        for keyword in keywords:
+            normalised = self._normalise(keyword)
+            if normalised and normalised not in self._canonical:
+                self._canonical[normalised] = keyword
+
+        self.keywords = list(self._canonical.values())
+        self._pattern = None
+
+        if self._canonical:
+            alternatives = sorted(self._canonical, key=len, reverse=True)
+            self._pattern = re.compile(
+                r'(?<!\w)(?:' + '|'.join(r'\s+'.join(map(re.escape, k.split(' '))) for k in alternatives) + r')(?!\w)',
+                re.IGNORECASE
+            )
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def find(self, text):
+        """Count the occurrences of each keyword in the text"""
+        counts = {}
+        if self._pattern is None or not text:
+            return counts
+
+        for match in self._pattern.finditer(text):
+            keyword = self._canonical.get(self._normalise(match.group(0)))
+            if keyword is not None:
+                counts[keyword] = counts.get(keyword, 0) + 1
+
+        return counts
+
+    @staticmethod
+    def _normalise(keyword):
+        return ' '.join(str(keyword).lower().split())
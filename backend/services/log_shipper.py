@@ -0,0 +1,151 @@
+import logging
+import threading
+from collections import deque
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop_newest', 'drop_oldest')
+
+# Set while shipping or handling a record, so anything logged meanwhile isn't shipped back into the queue
+_shipping = threading.local()
+
+# Loggers of the libraries used to ship logs, whose records would feed back into the queue
+_IGNORED_LOGGERS = ('boto3', 'botocore', 's3transfer', 'urllib3', __name__)
+
+
+class LogShipper:
+    """Buffers log items in memory and writes them to DynamoDB in the background.
+
+    submit() only appends to a bounded deque, so logging never waits on
+    DynamoDB. A single thread writes the buffer through batch_writer
+    whenever batch_size items are waiting or flush_interval seconds have
+    passed. When the buffer is full, the overflow policy drops either the
+    new item or the oldest buffered one; both are counted in stats().
+    """
+
+    def __init__(self, table, batch_size=None, flush_interval=None, max_queue=None, overflow=None):
+        self.table = table
+        self.batch_size = batch_size or Config.BATCH_SIZE
+        self.flush_interval = flush_interval or Config.LOG_SHIPPER_FLUSH_INTERVAL
+        self.max_queue = max_queue or Config.LOG_SHIPPER_MAX_QUEUE
+        self.overflow = overflow or Config.LOG_SHIPPER_OVERFLOW
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown log overflow policy: {self.overflow}")
+
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        self._counters = {'submitted': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the shipper thread"""
+        if self.running:
+            return
+
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='log-shipper', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the shipper thread after writing everything still buffered"""
+        if self._thread is None:
+            return
+
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+        if self._buffer:
+            logger.warning(f"Log shipper stopped with {len(self._buffer)} log items unwritten")
+
+    def submit(self, item):
+        """Queue a log item to be written, returning False if it was dropped"""
+        with self._lock:
+            if len(self._buffer) >= self.max_queue:
+                self._counters['dropped'] += 1
+                if self.overflow == 'drop_newest':
+                    return False
+                self._buffer.popleft()
+
+            self._buffer.append(item)
+            self._counters['submitted'] += 1
+            if len(self._buffer) == self.batch_size:
+                self._wakeup.set()
+        return True
+
+    def flush(self):
+        """Write every buffered item now, on the calling thread"""
+        while True:
+            with self._lock:
+                if not self._buffer:
+                    return
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            self._write(batch)
+
+    def stats(self):
+        """Get the shipper counters and the current queue depth"""
+        with self._lock:
+            return dict(self._counters, queued=len(self._buffer), running=self.running)
+
+    def _run(self):
+        _shipping.active = True
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+        # Drain what was submitted before stop() was called
+        self.flush()
+
+    def _write(self, batch):
+        previous, _shipping.active = getattr(_shipping, 'active', False), True
+        try:
+            with self.table.batch_writer() as writer:
+                for item in batch:
+                    writer.put_item(Item=item)
+            with self._lock:
+                self._counters['written'] += len(batch)
+                self._counters['batches'] += 1
+        except Exception as e:
+            with self._lock:
+                self._counters['failed'] += len(batch)
+            logger.error(f"Error writing {len(batch)} log items: {str(e)}")
+            # Back off so a DynamoDB outage doesn't turn into a tight retry loop
+            self._stopping.wait(self.flush_interval)
+        finally:
+            _shipping.active = previous
+
+
+class DynamoDBLogHandler(logging.Handler):
+    """logging.Handler that ships records to the system logs table through a SystemLogsService"""
+
+    def __init__(self, system_logs_service, level=logging.NOTSET):
+        super().__init__(level)
+        self.system_logs_service = system_logs_service
+
+    def emit(self, record):
+        # Records logged while shipping, or by the AWS SDK, would loop back into the queue
+        if getattr(_shipping, 'active', False) or record.name.startswith(_IGNORED_LOGGERS):
+            return
+
+        _shipping.active = True
+        try:
+            additional_data = {'logger': record.name, 'line': record.lineno}
+            if record.exc_info:
+                additional_data['exception'] = self.formatException(record.exc_info)
+
+            self.system_logs_service.log_event(record.levelname, record.getMessage(), record.module, additional_data)
+        except Exception:
+            self.handleError(record)
+        finally:
+            _shipping.active = False
+
@@ -0,0 +1,334 @@
+import hashlib
+import logging
+import threading
+import time
+import numpy as np
+from config import Config
+from services.prior_art_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Patent fields whose text is shingled for near-duplicate detection
+SIGNATURE_FIELDS = ('claims', 'abstract')
+
+# Universal hashing modulo a Mersenne prime, truncated to 32-bit minhash values
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+# Shingles hashed per block, so long documents don't need a huge hash matrix
+_BLOCK_SIZE = 4096
+
+_permutations = {}
+_permutations_lock = threading.Lock()
+
+
+def _get_permutations(num_perm, seed):
+    """Get the (a, b) coefficients of the hash permutations
+
+    They come from a seeded generator, so every process computes signatures
+    that can be compared with each other.
+    """
+    key = (num_perm, seed)
+    with _permutations_lock:
+        if key not in _permutations:
+            generator = np.random.RandomState(seed)
+            a = generator.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+            b = generator.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+            _permutations[key] = (a, b)
+        return _permutations[key]
+
+
+def shingles(text, size=None):
+    """Get the set of word shingles (runs of size consecutive terms) of a text"""
+    size = size or Config.MINHASH_SHINGLE_SIZE
+    terms = tokenize(text)
+    if not terms:
+        return set()
+    if len(terms) <= size:
+        return {' '.join(terms)}
+    return {' '.join(terms[i:i + size]) for i in range(len(terms) - size + 1)}
+
+
+def signature_text(patent):
+    """Get the text of a patent that its signature is computed from"""
+    return ' '.join(str(patent.get(field) or '') for field in SIGNATURE_FIELDS)
+
+
+def minhash_signature(text, num_perm=None, seed=None):
+    """Compute the MinHash signature of a text as an array of uint32 values
+
+    Returns None if the text has no terms.
+    """
+    num_perm = num_perm or Config.MINHASH_PERMUTATIONS
+    seed = Config.MINHASH_SEED if seed is None else seed
+
+    text_shingles = shingles(text)
+    if not text_shingles:
+        return None
+
+    # A stable 32-bit hash per shingle (Python's hash() is salted per process)
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little')
+         for shingle in text_shingles),
+        dtype=np.uint64,
+        count=len(text_shingles)
+    )
+
+    a, b = _get_permutations(num_perm, seed)
+    signature = np.full(num_perm, _MAX_HASH, dtype=np.uint64)
+    for start in range(0, len(hashes), _BLOCK_SIZE):
+        block = hashes[start:start + _BLOCK_SIZE, np.newaxis]
+        permuted = ((block * a + b) % _MERSENNE_PRIME) & _MAX_HASH
+        np.minimum(signature, permuted.min(axis=0), out=signature)
+
+    return signature.astype(np.uint32)
+
+
+def signature_to_bytes(signature):
+    """Serialise a signature for storage on the patent item"""
+    return signature.astype('<u4').tobytes()
+
+
+def signature_from_bytes(data):
+    """Deserialise a stored signature (bytes or a boto3 Binary)"""
+    data = getattr(data, 'value', data)
+    return np.frombuffer(bytes(data), dtype='<u4').astype(np.uint32)
+
+
+def estimate_similarity(signature, other):
+    """Estimate the Jaccard similarity of two texts from their signatures"""
+    return float(np.mean(signature == other))
+
+
+class NearDuplicateIndex:
+    """LSH banding index over MinHash signatures.
+
+    Each signature is split into bands of consecutive rows and every band is
+    hashed into a bucket, so two patents become candidates when any band
+    matches exactly. Candidate lookup only touches the patent's own buckets;
+    candidates are then confirmed with the estimated Jaccard similarity.
+    """
+
+    def __init__(self, num_perm=None, bands=None):
+        self.num_perm = num_perm or Config.MINHASH_PERMUTATIONS
+        self.bands = bands or Config.MINHASH_BANDS
+        if self.num_perm % self.bands:
+            raise ValueError(f"{self.num_perm} permutations can't be split into {self.bands} bands")
+        self.rows = self.num_perm // self.bands
+
+        self._lock = threading.RLock()
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = {}
+        self._documents = {}
+        self._loaded_at = None
+
+        # Held for a whole rebuild, so only one caller scans the table at a time
+        self._rebuild_lock = threading.Lock()
+        # Changes made while a rebuild is scanning, replayed onto the rebuilt index
+        self._changes = None
+
+    def __len__(self):
+        return len(self._signatures)
+
+    @property
+    def is_loaded(self):
+        return self._loaded_at is not None
+
+    @property
+    def age(self):
+        """Seconds since the index was last rebuilt, or None if it never was"""
+        return None if self._loaded_at is None else time.monotonic() - self._loaded_at
+
+    def refresh(self, load_patents, max_age):
+        """Rebuild the index from load_patents() if it is older than max_age seconds
+
+        Only one caller rebuilds at a time. While it does, other callers keep
+        using the current index, or wait for the first load if there is
+        none yet. Returns whether this call rebuilt the index.
+        """
+        age = self.age
+        if age is not None and age < max_age:
+            return False
+
+        if not self._rebuild_lock.acquire(blocking=not self.is_loaded):
+            return False
+        try:
+            # Another caller may have finished a rebuild while this one waited
+            age = self.age
+            if age is not None and age < max_age:
+                return False
+            self._rebuild(load_patents())
+            return True
+        finally:
+            self._rebuild_lock.release()
+
+    def rebuild(self, patents):
+        """Rebuild the index from an iterable of patent items
+
+        Stored signatures are used when present; otherwise the signature is
+        computed from the patent text.
+        """
+        with self._rebuild_lock:
+            self._rebuild(patents)
+
+    def add_patent(self, patent, signature=None):
+        """Add or replace a patent in the index"""
+        patent_id = patent.get('patent_id')
+        if signature is None:
+            signature = self.patent_signature(patent)
+        if not patent_id or signature is None:
+            return
+
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((patent, signature))
+            self._add(self._state(), patent_id, patent, signature)
+
+    def remove_patent(self, patent_id):
+        """Remove a patent from the index"""
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((patent_id, None))
+            self._remove(self._state(), patent_id)
+
+    def _rebuild(self, patents):
+        # The table is read and the new index built without holding the lock,
+        # so lookups and updates carry on against the current index meanwhile
+        with self._lock:
+            self._changes = []
+        try:
+            state = ([{} for _ in range(self.bands)], {}, {})
+            for patent in patents:
+                patent_id = patent.get('patent_id')
+                signature = self.patent_signature(patent)
+                if patent_id and signature is not None:
+                    self._add(state, patent_id, patent, signature)
+        except Exception:
+            with self._lock:
+                self._changes = None
+            raise
+
+        with self._lock:
+            for change, signature in self._changes:
+                if signature is None:
+                    self._remove(state, change)
+                else:
+                    self._add(state, change['patent_id'], change, signature)
+            self._buckets, self._signatures, self._documents = state
+            self._changes = None
+            self._loaded_at = time.monotonic()
+
+    def _state(self):
+        return self._buckets, self._signatures, self._documents
+
+    def _add(self, state, patent_id, patent, signature):
+        buckets, signatures, documents = state
+        self._remove(state, patent_id)
+        signatures[patent_id] = signature
+        documents[patent_id] = {
+            'title': patent.get('title'),
+            'submission_date': patent.get('submission_date')
+        }
+        for band, key in enumerate(self._band_keys(signature)):
+            buckets[band].setdefault(key, set()).add(patent_id)
+
+    def _remove(self, state, patent_id):
+        buckets, signatures, documents = state
+        signature = signatures.pop(patent_id, None)
+        documents.pop(patent_id, None)
+        if signature is None:
+            return
+        for band, key in enumerate(self._band_keys(signature)):
+            bucket = buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(patent_id)
+                if not bucket:
+                    del buckets[band][key]
+
+    def patent_signature(self, patent):
+        """Get the stored signature of a patent item, computing it if missing"""
+        if patent.get('minhash') is not None:
+            signature = signature_from_bytes(patent['minhash'])
+            if len(signature) == self.num_perm:
+                return signature
+        return minhash_signature(signature_text(patent), num_perm=self.num_perm)
+
+    def find_duplicates(self, signature, threshold=None, exclude_patent_id=None):
+        """Find indexed patents whose estimated similarity reaches the threshold
+
+        Returns a list of dicts with patent_id, title, submission_date and
+        similarity, most similar first.
+        """
+        threshold = Config.NEAR_DUPLICATE_THRESHOLD if threshold is None else threshold
+        duplicates = []
+
+        with self._lock:
+            candidates = set()
+            for band, key in enumerate(self._band_keys(signature)):
+                candidates.update(self._buckets[band].get(key, ()))
+            candidates.discard(exclude_patent_id)
+
+            for patent_id in candidates:
+                similarity = estimate_similarity(signature, self._signatures[patent_id])
+                if similarity >= threshold:
+                    duplicates.append(dict(self._documents[patent_id], patent_id=patent_id, similarity=similarity))
+
+        duplicates.sort(key=lambda x: x['similarity'], reverse=True)
+        return duplicates
+
+    def duplicate_report(self, threshold=None):
+        """Find every pair of near-duplicate patents in the index
+
+        Each pair is reported once, with the later submission as patent_id and
+        the earlier one as duplicate_of.
+        """
+        threshold = Config.NEAR_DUPLICATE_THRESHOLD if threshold is None else threshold
+        pairs = {}
+
+        with self._lock:
+            for buckets in self._buckets:
+                for members in buckets.values():
+                    if len(members) < 2:
+                        continue
+                    members = sorted(members)
+                    for i, first in enumerate(members):
+                        for second in members[i + 1:]:
+                            if (first, second) in pairs:
+                                continue
+                            pairs[(first, second)] = estimate_similarity(self._signatures[first], self._signatures[second])
+
+            report = []
+            for (first, second), similarity in pairs.items():
+                if similarity < threshold:
+                    continue
+                first_document, second_document = self._documents[first], self._documents[second]
+                if (second_document.get('submission_date') or '') < (first_document.get('submission_date') or ''):
+                    first, second = second, first
+                    first_document, second_document = second_document, first_document
+                report.append({
+                    'patent_id': second,
+                    'title': second_document.get('title'),
+                    'submission_date': second_document.get('submission_date'),
+                    'duplicate_of': first,
+                    'duplicate_of_title': first_document.get('title'),
+                    'similarity': round(similarity, 4)
+                })
+
+        report.sort(key=lambda x: x['similarity'], reverse=True)
+        return report
+
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+
+_shared_index = None
+_shared_index_lock = threading.Lock()
+
+
+def get_near_duplicate_index():
+    """Get the process-wide near-duplicate index shared by the services"""
+    global _shared_index
+    with _shared_index_lock:
+        if _shared_index is None:
+            _shared_index = NearDuplicateIndex()
+        return _shared_index
@@ -0,0 +1,596 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from decimal import Decimal
+from botocore.exceptions import ClientError
+from config import Config
+from services.aws_clients import get_resource, get_table, register_table_check
+
+logger = logging.getLogger(__name__)
+
+# SNS PublishBatch accepts at most 10 messages per call
+PUBLISH_BATCH_SIZE = 10
+
+# Due entries claimed by one dispatcher poll
+CLAIM_LIMIT = 100
+
+
+def create_outbox_entry(notification_id, payload, available_at=None):
+    """Create a pending outbox entry
+
+    notification_id is the entry's deduplication key: an entry with the same
+    ID is only ever queued once. The payload must be JSON serialisable; it is
+    stored as a string, so it may hold floats. The entry isn't published
+    before available_at (epoch seconds), which defaults to now.
+    """
+    return {
+        'notification_id': notification_id,
+        'status': 'pending',
+        'payload': json.dumps(payload, default=_json_default),
+        'attempts': 0,
+        'next_attempt_at': int(time.time() if available_at is None else available_at),
+        'created_at': datetime.utcnow().isoformat(),
+        'last_error': None
+    }
+
+
+def digest_window_end(window, now=None):
+    """Get the end of the digest window now falls in
+
+    Windows are aligned to multiples of window seconds, so every alert
+    queued within one window becomes due at the same time.
+    """
+    now = time.time() if now is None else now
+    return int(-(-now // window) * window)
+
+
+def _json_default(value):
+    # Numbers read back from DynamoDB are Decimals
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+class LocalOutboxStore:
+    """In-process outbox used for tests and single-process deployments.
+
+    Entries are lost with the process, and add_with_update writes the record
+    and the entry one after the other rather than atomically.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for entry in self._entries.values() if entry['status'] == 'pending')
+
+    def add(self, entry):
+        """Queue an entry, returning False if its ID was already queued"""
+        with self._lock:
+            if entry['notification_id'] in self._entries:
+                return False
+            self._entries[entry['notification_id']] = dict(entry)
+            return True
+
+    def add_with_update(self, entry, table, **update_kwargs):
+        """Apply a table update and queue an entry"""
+        table.update_item(**update_kwargs)
+        return self.add(entry)
+
+    def get(self, notification_id):
+        with self._lock:
+            entry = self._entries.get(notification_id)
+            return dict(entry) if entry else None
+
+    def claim_due(self, limit, lease):
+        """Claim up to limit due entries for lease seconds"""
+        now = int(time.time())
+        with self._lock:
+            due = sorted(
+                (entry for entry in self._entries.values()
+                 if entry['status'] == 'pending' and entry['next_attempt_at'] <= now),
+                key=lambda entry: entry['next_attempt_at']
+            )[:limit]
+            for entry in due:
+                entry['next_attempt_at'] = now + lease
+            return [dict(entry) for entry in due]
+
+    def complete(self, entry):
+        self._update(entry, status='sent')
+
+    def retry(self, entry, error, delay):
+        self._update(entry, attempts=entry['attempts'] + 1, next_attempt_at=int(time.time() + delay),
+                     last_error=error)
+
+    def fail(self, entry, error):
+        self._update(entry, status='failed', attempts=entry['attempts'] + 1, last_error=error)
+
+    def defer(self, entry, delay):
+        self._update(entry, next_attempt_at=int(time.time() + delay))
+
+    def _update(self, entry, **changes):
+        with self._lock:
+            stored = self._entries.get(entry['notification_id'])
+            if stored:
+                stored.update(changes)
+
+
+class DynamoDBOutboxStore:
+    """Outbox stored in a DynamoDB table.
+
+    Pending entries are found through a status/next_attempt_at index. A
+    dispatcher claims an entry by conditionally pushing its next_attempt_at
+    forward by the lease, so concurrent dispatchers don't publish it twice
+    and a dispatcher that dies mid-publish only delays it. Sent entries are
+    kept until DynamoDB TTL removes them, so their IDs still deduplicate.
+    """
+
+    STATUS_INDEX = 'status-index'
+
+    def __init__(self, table_name=None):
+        self.table_name = table_name or Config.DYNAMODB_NOTIFICATION_OUTBOX_TABLE
+        self.dynamodb = get_resource('dynamodb')
+        self.table = get_table(self.table_name)
+
+        # Ensure the table exists (verified once at startup)
+        register_table_check(self.table_name, self._create_outbox_table_if_not_exists)
+
+    def _create_outbox_table_if_not_exists(self):
+        """Create the outbox table if it doesn't exist"""
+        try:
+            # Check if table exists
+            self.dynamodb.meta.client.describe_table(TableName=self.table_name)
+            logger.info(f"Table {self.table_name} already exists")
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                # Create the table
+                table = self.dynamodb.create_table(
+                    TableName=self.table_name,
+                    KeySchema=[
+                        {'AttributeName': 'notification_id', 'KeyType': 'HASH'}
+                    ],
+                    AttributeDefinitions=[
+                        {'AttributeName': 'notification_id', 'AttributeType': 'S'},
+                        {'AttributeName': 'status', 'AttributeType': 'S'},
+                        {'AttributeName': 'next_attempt_at', 'AttributeType': 'N'}
+                    ],
+                    GlobalSecondaryIndexes=[
+                        {
+                            'IndexName': self.STATUS_INDEX,
+                            'KeySchema': [
+                                {'AttributeName': 'status', 'KeyType': 'HASH'},
+                                {'AttributeName': 'next_attempt_at', 'KeyType': 'RANGE'}
+                            ],
+                            'Projection': {
+                                'ProjectionType': 'ALL'
+                            },
+                            'ProvisionedThroughput': {
+                                'ReadCapacityUnits': 5,
+                                'WriteCapacityUnits': 5
+                            }
+                        }
+                    ],
+                    ProvisionedThroughput={
+                        'ReadCapacityUnits': 5,
+                        'WriteCapacityUnits': 5
+                    }
+                )
+                # Wait for the table to be created
+                table.meta.client.get_waiter('table_exists').wait(TableName=self.table_name)
+
+                # Let DynamoDB delete sent entries once they're no longer needed for deduplication
+                self.dynamodb.meta.client.update_time_to_live(
+                    TableName=self.table_name,
+                    TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'}
+                )
+                logger.info(f"Created table {self.table_name}")
+            else:
+                logger.error(f"Error checking/creating table: {e}")
+                raise
+
+    def add(self, entry):
+        """Queue an entry, returning False if its ID was already queued"""
+        try:
+            self.table.put_item(Item=entry, ConditionExpression='attribute_not_exists(notification_id)')
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def add_with_update(self, entry, table, **update_kwargs):
+        """Apply a table update and queue an entry in a single transaction
+
+        update_kwargs are Table.update_item arguments (Key, UpdateExpression
+        and expression attributes). If the entry's ID was already queued, only
+        the update is applied and False is returned.
+        """
+        update = {
+            'TableName': table.name,
+            'Key': self._serialize(update_kwargs['Key']),
+            'UpdateExpression': update_kwargs['UpdateExpression']
+        }
+        if update_kwargs.get('ExpressionAttributeNames'):
+            update['ExpressionAttributeNames'] = update_kwargs['ExpressionAttributeNames']
+        if update_kwargs.get('ExpressionAttributeValues'):
+            update['ExpressionAttributeValues'] = self._serialize(update_kwargs['ExpressionAttributeValues'])
+
+        try:
+            self.dynamodb.meta.client.transact_write_items(TransactItems=[
+                {'Update': update},
+                {'Put': {
+                    'TableName': self.table_name,
+                    'Item': self._serialize(entry),
+                    'ConditionExpression': 'attribute_not_exists(notification_id)'
+                }}
+            ])
+            return True
+        except ClientError as e:
+            reasons = e.response.get('CancellationReasons') or []
+            if len(reasons) == 2 and reasons[1].get('Code') == 'ConditionalCheckFailed' \
+                    and reasons[0].get('Code') in (None, 'None'):
+                # A retried job queued this notification already
+                table.update_item(**update_kwargs)
+                return False
+            raise
+
+    def get(self, notification_id):
+        return self.table.get_item(Key={'notification_id': notification_id}, ConsistentRead=True).get('Item')
+
+    def claim_due(self, limit, lease):
+        """Claim up to limit due entries for lease seconds"""
+        now = int(time.time())
+        response = self.table.query(
+            IndexName=self.STATUS_INDEX,
+            KeyConditionExpression='#status = :pending and next_attempt_at <= :now',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':pending': 'pending', ':now': now},
+            Limit=limit
+        )
+
+        claimed = []
+        for entry in response.get('Items', []):
+            try:
+                self.table.update_item(
+                    Key={'notification_id': entry['notification_id']},
+                    UpdateExpression='set next_attempt_at = :lease',
+                    ConditionExpression='#status = :pending and next_attempt_at = :seen',
+                    ExpressionAttributeNames={'#status': 'status'},
+                    ExpressionAttributeValues={
+                        ':lease': now + lease,
+                        ':pending': 'pending',
+                        ':seen': entry['next_attempt_at']
+                    }
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                    continue  # Claimed by another dispatcher
+                raise
+            entry['attempts'] = int(entry.get('attempts', 0))
+            claimed.append(entry)
+
+        return claimed
+
+    def complete(self, entry):
+        self.table.update_item(
+            Key={'notification_id': entry['notification_id']},
+            UpdateExpression='set #status = :sent, expires_at = :expires_at, sent_at = :sent_at',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':sent': 'sent',
+                ':expires_at': int(time.time()) + Config.NOTIFICATION_OUTBOX_RETENTION,
+                ':sent_at': datetime.utcnow().isoformat()
+            }
+        )
+
+    def retry(self, entry, error, delay):
+        self.table.update_item(
+            Key={'notification_id': entry['notification_id']},
+            UpdateExpression='set attempts = :attempts, next_attempt_at = :next_attempt_at, last_error = :error',
+            ExpressionAttributeValues={
+                ':attempts': entry['attempts'] + 1,
+                ':next_attempt_at': int(time.time() + delay),
+                ':error': error
+            }
+        )
+
+    def fail(self, entry, error):
+        self.table.update_item(
+            Key={'notification_id': entry['notification_id']},
+            UpdateExpression='set #status = :failed, attempts = :attempts, last_error = :error',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':failed': 'failed',
+                ':attempts': entry['attempts'] + 1,
+                ':error': error
+            }
+        )
+
+    def defer(self, entry, delay):
+        """Postpone an entry without counting an attempt"""
+        self.table.update_item(
+            Key={'notification_id': entry['notification_id']},
+            UpdateExpression='set next_attempt_at = :next_attempt_at',
+            ExpressionAttributeValues={':next_attempt_at': int(time.time() + delay)}
+        )
+
+    def _serialize(self, values):
+        # Imported here so the module loads wherever boto3 is replaced by a stub
+        from boto3.dynamodb.types import TypeSerializer
+        serializer = TypeSerializer()
+        return {name: serializer.serialize(value) for name, value in values.items()}
+
+
+def create_outbox_store(backend=None):
+    """Create the notification outbox for the configured backend"""
+    backend = backend or Config.NOTIFICATION_OUTBOX_BACKEND
+
+    if backend == 'dynamodb':
+        return DynamoDBOutboxStore()
+    if backend == 'local':
+        return LocalOutboxStore()
+
+    raise ValueError(f"Unknown notification outbox backend: {backend}")
+
+
+class SNSTransport:
+    """Publishes outbox messages to the notification topic with PublishBatch"""
+
+    def __init__(self, notification_service):
+        self.notification_service = notification_service
+
+    def publish_batch(self, messages):
+        """Publish up to 10 (notification_id, message) pairs
+
+        message holds the Publish arguments (Message, Subject,
+        MessageStructure). Returns {notification_id: (error, retryable)} for
+        the messages that weren't published.
+        """
+        topic_arn = self.notification_service.topic_arn
+        fifo = topic_arn.endswith('.fifo')
+
+        request_entries = []
+        for index, (notification_id, message) in enumerate(messages):
+            request_entry = dict(message, Id=str(index))
+            if fifo:
+                # FIFO topics drop a second publish of the same ID within five minutes
+                request_entry['MessageDeduplicationId'] = notification_id
+                request_entry['MessageGroupId'] = 'alerts'
+            request_entries.append(request_entry)
+
+        try:
+            response = self.notification_service.sns.publish_batch(
+                TopicArn=topic_arn,
+                PublishBatchRequestEntries=request_entries
+            )
+        except Exception as e:
+            return {notification_id: (str(e), True) for notification_id, _ in messages}
+
+        return {
+            messages[int(failure['Id'])][0]: (f"{failure['Code']}: {failure.get('Message', '')}",
+                                              not failure.get('SenderFault', False))
+            for failure in response.get('Failed', [])
+        }
+
+
+class LocalTransport:
+    """Stand-in transport that records messages instead of publishing them.
+
+    Each notification ID is recorded once. Listing IDs in fail_ids makes
+    their publish fail with a retryable error.
+    """
+
+    def __init__(self):
+        self.published = []
+        self.fail_ids = set()
+        self._published_ids = set()
+        self._lock = threading.Lock()
+
+    def publish_batch(self, messages):
+        failures = {}
+        with self._lock:
+            for notification_id, message in messages:
+                if notification_id in self.fail_ids:
+                    failures[notification_id] = ('Local transport failure', True)
+                elif notification_id not in self._published_ids:
+                    self._published_ids.add(notification_id)
+                    self.published.append((notification_id, message))
+        return failures
+
+
+def create_transport(notification_service, transport=None):
+    """Create the transport outbox messages are published with"""
+    transport = transport or Config.NOTIFICATION_TRANSPORT
+
+    if transport == 'sns':
+        return SNSTransport(notification_service)
+    if transport == 'local':
+        return LocalTransport()
+
+    raise ValueError(f"Unknown notification transport: {transport}")
+
+
+class RateLimiter:
+    """Sliding-window cap on the messages sent to each key.
+
+    Counts are kept in memory, so with several dispatcher processes each
+    applies the cap on its own.
+    """
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self._sent = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """Record a message for key, or return the seconds until one is allowed"""
+        now = time.monotonic()
+        with self._lock:
+            sent = self._sent[key]
+            while sent and sent[0] <= now - self.period:
+                sent.popleft()
+
+            if len(sent) >= self.limit:
+                return sent[0] + self.period - now
+
+            sent.append(now)
+            return 0
+
+
+class OutboxDispatcher:
+    """Background thread that publishes pending outbox entries in batches.
+
+    Each poll claims the due entries, turns their payloads into messages
+    with build_message and publishes them PUBLISH_BATCH_SIZE at a time.
+    Failed entries are retried with exponential backoff until max_attempts
+    is reached; errors the sender caused aren't retried.
+
+    Entries whose payload sets digest are grouped by recipient, and each
+    group of more than one is published as a single message built by
+    build_digest. With a rate_limiter, messages to a recipient over its cap
+    are deferred until the cap allows them.
+    """
+
+    def __init__(self, store, transport, build_message, poll_interval=None, max_attempts=None, retry_delay=None,
+                 lease=None, build_digest=None, rate_limiter=None):
+        self.store = store
+        self.transport = transport
+        self.build_message = build_message
+        self.build_digest = build_digest
+        self.rate_limiter = rate_limiter
+        self.poll_interval = poll_interval or Config.NOTIFICATION_DISPATCH_INTERVAL
+        self.max_attempts = max_attempts or Config.NOTIFICATION_MAX_ATTEMPTS
+        self.retry_delay = Config.NOTIFICATION_RETRY_DELAY if retry_delay is None else retry_delay
+        self.lease = lease or Config.NOTIFICATION_LEASE_SECONDS
+
+        self._thread = None
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+        self._counters = {'published': 0, 'retried': 0, 'failed': 0, 'deferred': 0, 'digests': 0, 'batches': 0}
+        self._counters_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the dispatcher thread"""
+        if self.running:
+            return
+
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the dispatcher thread once its current poll finishes"""
+        if self._thread is None:
+            return
+
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def notify(self):
+        """Wake the dispatcher up, e.g. after queueing an entry"""
+        self._wakeup.set()
+
+    def stats(self):
+        with self._counters_lock:
+            return dict(self._counters, running=self.running)
+
+    def dispatch_once(self):
+        """Publish the entries that are due, returning how many were claimed"""
+        entries = self.store.claim_due(CLAIM_LIMIT, self.lease)
+
+        messages = []
+        for group, payloads in self._group(entries):
+            if self.rate_limiter is not None:
+                wait = self.rate_limiter.acquire(payloads[0].get('recipient'))
+                if wait > 0:
+                    for entry in group:
+                        self.store.defer(entry, wait)
+                        self._count('deferred')
+                    continue
+
+            try:
+                if len(group) > 1:
+                    message = self.build_digest(payloads)
+                    self._count('digests')
+                else:
+                    message = self.build_message(payloads[0])
+                messages.append((group, message))
+            except Exception as e:
+                logger.error(f"Error building notification {group[0]['notification_id']}: {str(e)}")
+                for entry in group:
+                    self._handle_failure(entry, str(e), retryable=False)
+
+        for start in range(0, len(messages), PUBLISH_BATCH_SIZE):
+            batch = messages[start:start + PUBLISH_BATCH_SIZE]
+            # A digest is published under the ID of its first entry
+            failures = self.transport.publish_batch([(group[0]['notification_id'], message) for group, message in batch])
+
+            for group, _ in batch:
+                failure = failures.get(group[0]['notification_id'])
+                for entry in group:
+                    if failure:
+                        self._handle_failure(entry, *failure)
+                    else:
+                        self.store.complete(entry)
+                        self._count('published')
+            self._count('batches')
+
+        return len(entries)
+
+    def _group(self, entries):
+        """Group digest entries by recipient, in the order their first entry was claimed"""
+        groups = []
+        digests = {}
+        for entry in entries:
+            payload = json.loads(entry['payload'])
+            if not (payload.get('digest') and self.build_digest):
+                groups.append(([entry], [payload]))
+                continue
+
+            recipient = payload.get('recipient')
+            if recipient not in digests:
+                digests[recipient] = ([], [])
+                groups.append(digests[recipient])
+            digests[recipient][0].append(entry)
+            digests[recipient][1].append(payload)
+        return groups
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                claimed = self.dispatch_once()
+            except Exception as e:
+                logger.error(f"Error dispatching notifications: {str(e)}")
+                claimed = 0
+
+            # Keep going while there's a backlog, otherwise wait for the next poll
+            if claimed < CLAIM_LIMIT:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _handle_failure(self, entry, error, retryable):
+        attempt = entry['attempts'] + 1
+        if retryable and attempt < self.max_attempts:
+            logger.warning(f"Notification {entry['notification_id']} failed on attempt {attempt}/{self.max_attempts}: {error}")
+            self.store.retry(entry, error, self.retry_delay * 2 ** (attempt - 1))
+            self._count('retried')
+        else:
+            logger.error(f"Notification {entry['notification_id']} failed permanently: {error}")
+            self.store.fail(entry, error)
+            self._count('failed')
+
+    def _count(self, counter):
+        with self._counters_lock:
+            self._counters[counter] += 1
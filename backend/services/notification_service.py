@@ -2,27 +2,62 @@ import boto3
 import json
 import logging
 import os
+import threading
+import time
+from datetime import datetime
 from botocore.exceptions import ClientError
-from jinja2 import Template, Environment, FileSystemLoader
 from config import Config
+from services.aws_clients import get_client
+from services.template_registry import TemplateRegistry
+from services.notification_outbox import (
+    OutboxDispatcher, RateLimiter, create_outbox_entry, create_outbox_store, create_transport, digest_window_end
+)
 
 logger = logging.getLogger(__name__)
 
 class NotificationService:
     def __init__(self):
-        self.sns = boto3.client('sns', region_name=Config.AWS_REGION)
-        self.topic_arn = Config.SNS_TOPIC_ARN
+        self.sns = get_client('sns')
         
-        # Create SNS topic if it doesn't exist
-        if not self.topic_arn:
-            self._create_sns_topic()
-            
-        # Initialize template environment
+        # The SNS topic is created on first use if no ARN is configured
+        self._topic_arn = Config.SNS_TOPIC_ARN
+        self._topic_lock = threading.Lock()
+        
+        # Email -> subscription ARN for the topic, reloaded every SNS_SUBSCRIPTION_CACHE_TTL seconds
+        self._subscriptions = None
+        self._subscriptions_expire = 0
+        self._subscriptions_lock = threading.Lock()
+        
+        # Alert templates are compiled once and reloaded when their file changes
         self.template_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')
-        self.template_env = Environment(loader=FileSystemLoader(self.template_dir))
+        self.templates = TemplateRegistry(self.template_dir)
         
-        # Load alert template
-        self.alert_template = self._load_alert_template()
+        # Alerts are queued in the outbox and published in batches by the dispatcher
+        # A recipient's alerts within a digest window are sent as one message, up to a rate cap
+        rate_limiter = None
+        if Config.NOTIFICATION_RATE_LIMIT > 0:
+            rate_limiter = RateLimiter(Config.NOTIFICATION_RATE_LIMIT, Config.NOTIFICATION_RATE_PERIOD)
+        self.outbox = create_outbox_store()
+        self.dispatcher = OutboxDispatcher(
+            self.outbox,
+            create_transport(self),
+            self.build_outbox_message,
+            build_digest=self.build_digest_message,
+            rate_limiter=rate_limiter
+        )
+    
+    @property
+    def topic_arn(self):
+        """The ARN of the notification topic, creating the topic if needed"""
+        if not self._topic_arn:
+            with self._topic_lock:
+                if not self._topic_arn:
+                    self._create_sns_topic()
+        return self._topic_arn
+    
+    @topic_arn.setter
+    def topic_arn(self, value):
+        self._topic_arn = value
     
     def _create_sns_topic(self):
         """Create an SNS topic for notifications"""
@@ -38,13 +73,7 @@ class NotificationService:
         """Send a notification via SNS with simple text message"""
         try:
             # If recipient is provided, publish to that specific endpoint
-            if recipient and self._is_valid_email(recipient):
-                # First check if the email is subscribed
-                subscription_arn = self._get_subscription_arn(recipient)
-                
-                # If not subscribed, subscribe the email
-                if not subscription_arn:
-                    self._subscribe_email(recipient)
+            self._ensure_subscribed(recipient)
             
             # Publish the message to the topic
             response = self.sns.publish(
@@ -64,13 +93,7 @@ class NotificationService:
         """Send a notification via SNS with structured message for different platforms"""
         try:
             # If recipient is provided, publish to that specific endpoint
-            if recipient and self._is_valid_email(recipient):
-                # First check if the email is subscribed
-                subscription_arn = self._get_subscription_arn(recipient)
-                
-                # If not subscribed, subscribe the email
-                if not subscription_arn:
-                    self._subscribe_email(recipient)
+            self._ensure_subscribed(recipient)
             
             # Publish the message to the topic with message structure
             response = self.sns.publish(
@@ -86,6 +109,16 @@ class NotificationService:
             logger.error(f"Error sending structured notification: {str(e)}")
             return {'error': str(e)}
     
+    def _ensure_subscribed(self, recipient):
+        """Subscribe a recipient's email address to the topic if it isn't already"""
+        if recipient and self._is_valid_email(recipient):
+            # First check if the email is subscribed
+            subscription_arn = self._get_subscription_arn(recipient)
+            
+            # If not subscribed, subscribe the email
+            if not subscription_arn:
+                self._subscribe_email(recipient)
+    
     def _is_valid_email(self, email):
         """Check if the recipient is a valid email address"""
         # Simple validation - in a real app, use a more robust method
@@ -93,18 +126,47 @@ class NotificationService:
     
     def _get_subscription_arn(self, email):
         """Get the subscription ARN for an email address"""
+        subscriptions = self._get_subscriptions()
+        return subscriptions.get(email) if subscriptions is not None else None
+    
+    def _get_subscriptions(self):
+        """Get the email subscriptions of the topic, reloading them once they expire
+        
+        Only one thread reloads; the others keep using the previous map.
+        """
+        if time.monotonic() < self._subscriptions_expire:
+            return self._subscriptions
+        
+        if not self._subscriptions_lock.acquire(blocking=self._subscriptions is None):
+            return self._subscriptions
         try:
-            response = self.sns.list_subscriptions_by_topic(TopicArn=self.topic_arn)
-            
-            for subscription in response['Subscriptions']:
-                if subscription['Protocol'] == 'email' and subscription['Endpoint'] == email:
-                    return subscription['SubscriptionArn']
-            
-            return None
+            if time.monotonic() >= self._subscriptions_expire:
+                self._load_subscriptions()
+            return self._subscriptions
+        finally:
+            self._subscriptions_lock.release()
+    
+    def _load_subscriptions(self):
+        """Load every email subscription of the topic, following pagination"""
+        try:
+            subscriptions = {}
+            paginator = self.sns.get_paginator('list_subscriptions_by_topic')
+            for page in paginator.paginate(TopicArn=self.topic_arn):
+                for subscription in page['Subscriptions']:
+                    if subscription['Protocol'] == 'email':
+                        subscriptions[subscription['Endpoint']] = subscription['SubscriptionArn']
             
+            self._subscriptions = subscriptions
+            self._subscriptions_expire = time.monotonic() + Config.SNS_SUBSCRIPTION_CACHE_TTL
+            logger.info(f"Loaded {len(subscriptions)} email subscriptions of {self.topic_arn}")
         except Exception as e:
             logger.error(f"Error getting subscription ARN: {str(e)}")
-            return None
+            
+            # Keep an empty map if nothing has loaded yet, so new subscriptions are still cached,
+            # and retry after a short delay rather than on every alert
+            if self._subscriptions is None:
+                self._subscriptions = {}
+            self._subscriptions_expire = time.monotonic() + Config.SNS_SUBSCRIPTION_RETRY_DELAY
     
     def _subscribe_email(self, email):
         """Subscribe an email address to the SNS topic"""
@@ -116,35 +178,17 @@ class NotificationService:
             )
             
             logger.info(f"Subscribed email {email} to topic {self.topic_arn}")
+            
+            # Pending until the recipient confirms, which still counts as subscribed
+            with self._subscriptions_lock:
+                if self._subscriptions is not None:
+                    self._subscriptions[email] = response['SubscriptionArn']
             return response['SubscriptionArn']
             
         except Exception as e:
             logger.error(f"Error subscribing email: {str(e)}")
             return None
     
-    def _load_alert_template(self):
-        """Load the SNS alert template from the JSON file"""
-        try:
-            template_path = os.path.join(self.template_dir, 'sns_alert_template.json')
-            with open(template_path, 'r') as file:
-                template_data = json.load(file)
-                logger.info(f"Loaded alert template from {template_path}")
-                return template_data
-        except Exception as e:
-            logger.error(f"Error loading alert template: {str(e)}")
-            # Return a basic template as fallback
-            return {
-                "default": "PatentAnalyzer Alert",
-                "email": {
-                    "subject": "PatentAnalyzer Alert",
-                    "body": {
-                        "text": "Patent Alert for {{patent_id}}",
-                        "html": "<html><body>Patent Alert for {{patent_id}}</body></html>"
-                    }
-                },
-                "sms": "PatentAnalyzer Alert for {{patent_id}}"
-            }
-    
     def create_alert_template(self, template_name, template_content):
         """Create or update an alert template"""
         # In a real application, you might store templates in DynamoDB or S3
@@ -155,90 +199,167 @@ class NotificationService:
     def send_alert_from_template(self, template_name, data, recipient=None):
         """Send an alert using a template"""
         try:
-            # Prepare template data with defaults for missing values
-            template_data = {
-                'user_name': data.get('user_name', 'Patent Owner'),
-                'patent_id': data.get('patent_id', 'N/A'),
-                'patent_title': data.get('patent_title', data.get('title', 'N/A')),
-                'risk_level': data.get('risk_level', 'Unknown'),
-                'alert_type': data.get('alert_type', 'Analysis Complete'),
-                'analysis_summary': data.get('analysis_summary', 'Patent analysis has been completed.'),
-                'dashboard_url': data.get('dashboard_url', '#'),
-                'timestamp': data.get('timestamp', ''),
-            }
-            
-            # Add prior art matches if available
-            if 'prior_art_matches' in data and data['prior_art_matches']:
-                template_data['prior_art_matches'] = data['prior_art_matches']
-            elif 'similar_patents' in data and data['similar_patents']:
-                template_data['prior_art_matches'] = [{
-                    'title': p.get('title', 'Unknown Patent'),
-                    'patent_id': p.get('patent_id', 'N/A'),
-                    'similarity_score': round(p.get('similarity', 0) * 100, 1),
-                    'key_overlap': p.get('key_overlap', 'N/A')
-                } for p in data['similar_patents']]
-            
-            # Add risk factors if available
-            if 'infringement_risks' in data and data['infringement_risks']:
-                template_data['infringement_risks'] = data['infringement_risks']
-            elif 'risk_factors' in data and data['risk_factors']:
-                template_data['infringement_risks'] = [{
-                    'title': 'Potential Infringement Risk',
-                    'patent_id': 'N/A',
-                    'risk_score': 'High',
-                    'critical_factors': factor
-                } for factor in data['risk_factors']]
-            
-            # Render email subject
-            subject_template = Template(self.alert_template['email']['subject'])
-            subject = subject_template.render(template_data)
-            
-            # Determine message format based on recipient type
-            # For this implementation, we'll use HTML for email and text for other channels
-            html_template = Template(self.alert_template['email']['body']['html'])
-            text_template = Template(self.alert_template['email']['body']['text'])
-            sms_template = Template(self.alert_template['sms'])
-            
-            # Create message structure for SNS
-            message_structure = {
-                'default': self.alert_template['default'],
-                'email': json.dumps({
-                    'subject': subject,
-                    'body': {
-                        'text': text_template.render(template_data),
-                        'html': html_template.render(template_data)
-                    }
-                }),
-                'sms': sms_template.render(template_data)
-            }
-            
             # Send the notification with message structure
             return self.send_notification_with_structure(
-                message_structure=message_structure,
+                message_structure=self._render_alert(template_name, data),
                 recipient=recipient
             )
             
         except Exception as e:
             logger.error(f"Error sending alert from template: {str(e)}")
             # Fallback to simple notification
-            subject = f"Patent Alert: {data.get('title', 'Alert')}"
-            message = f"""Patent Alert
-            
-            Patent ID: {data.get('patent_id', 'N/A')}
-            Title: {data.get('title', 'N/A')}
-            Risk Level: {data.get('risk_level', 'N/A')}
-            
-            Risk Factors:
-            {self._format_list(data.get('risk_factors', []))}
-            
-            Similar Patents:
-            {self._format_similar_patents(data.get('similar_patents', []))}
-            
-            Please review this patent in the PatentAnalyzer system.
-            """
-            
+            subject, message = self._fallback_alert(data)
             return self.send_notification(subject, message, recipient)
     
+    def alert_outbox_entry(self, notification_id, template_name, data, recipient=None):
+        """Create the outbox entry of a templated alert, to be queued with the record it reports on"""
+        payload = {
+            'template_name': template_name,
+            'data': data,
+            'recipient': recipient
+        }
+        
+        # Hold the alert until the end of the digest window, so it can be sent with the recipient's others
+        window = Config.NOTIFICATION_DIGEST_WINDOW
+        if window > 0:
+            payload['digest'] = True
+            return create_outbox_entry(notification_id, payload, available_at=digest_window_end(window))
+        
+        return create_outbox_entry(notification_id, payload)
+    
+    def queue_alert_from_template(self, notification_id, template_name, data, recipient=None):
+        """Queue a templated alert for the dispatcher, returning False if its ID was already queued"""
+        queued = self.outbox.add(self.alert_outbox_entry(notification_id, template_name, data, recipient))
+        self.dispatcher.notify()
+        return queued
+    
+    def build_outbox_message(self, payload):
+        """Turn the payload of an outbox entry into the arguments of an SNS publish"""
+        self._ensure_subscribed(payload.get('recipient'))
+        
+        try:
+            message_structure = self._render_alert(payload['template_name'], payload['data'])
+            return {'Message': json.dumps(message_structure), 'MessageStructure': 'json'}
+        except Exception as e:
+            logger.error(f"Error rendering alert from template: {str(e)}")
+            subject, message = self._fallback_alert(payload['data'])
+            return {'Subject': subject, 'Message': message}
+    
+    def build_digest_message(self, payloads):
+        """Combine the payloads of several outbox entries for one recipient into a single digest"""
+        self._ensure_subscribed(payloads[0].get('recipient'))
+        
+        alerts = [self._alert_template_data(payload['data']) for payload in payloads]
+        digest_data = {
+            'user_name': alerts[0]['user_name'],
+            'alert_count': len(alerts),
+            'alerts': alerts,
+            'dashboard_url': f"{Config.FRONTEND_URL}/dashboard",
+            'timestamp': datetime.utcnow().isoformat()
+        }
+        
+        try:
+            message_structure = self._message_structure(self.templates.render(Config.NOTIFICATION_DIGEST_TEMPLATE, digest_data))
+            return {'Message': json.dumps(message_structure), 'MessageStructure': 'json'}
+        except Exception as e:
+            logger.error(f"Error rendering alert digest: {str(e)}")
+            subject = f"PatentAnalyzer: {len(alerts)} patent alerts"
+            message = '\n\n'.join(self._fallback_alert(payload['data'])[1] for payload in payloads)
+            return {'Subject': subject, 'Message': message}
+    
+    def start_dispatcher(self):
+        """Start publishing queued alerts in the background"""
+        self.dispatcher.start()
+    
+    def stop_dispatcher(self, timeout=None):
+        """Stop the background publisher"""
+        self.dispatcher.stop(timeout)
+    
+    def get_dispatcher_stats(self):
+        """Get the counters of the background publisher"""
+        return self.dispatcher.stats()
+    
+    def _render_alert(self, template_name, data):
+        """Render a templated alert as an SNS message structure"""
+        # Render every channel from the compiled template
+        # HTML goes to email and text to the other channels
+        rendered = self.templates.render(template_name, self._alert_template_data(data))
+        return self._message_structure(rendered)
+    
+    def _alert_template_data(self, data):
+        """Get the template variables of an alert"""
+        # Prepare template data with defaults for missing values
+        template_data = {
+            'user_name': data.get('user_name', 'Patent Owner'),
+            'patent_id': data.get('patent_id', 'N/A'),
+            'patent_title': data.get('patent_title', data.get('title', 'N/A')),
+            'risk_level': data.get('risk_level', 'Unknown'),
+            'alert_type': data.get('alert_type', 'Analysis Complete'),
+            'analysis_summary': data.get('analysis_summary', 'Patent analysis has been completed.'),
+            'dashboard_url': data.get('dashboard_url', '#'),
+            'timestamp': data.get('timestamp', ''),
+        }
+        
+        # Add prior art matches if available
+        if 'prior_art_matches' in data and data['prior_art_matches']:
+            template_data['prior_art_matches'] = data['prior_art_matches']
+        elif 'similar_patents' in data and data['similar_patents']:
+            template_data['prior_art_matches'] = [{
+                'title': p.get('title', 'Unknown Patent'),
+                'patent_id': p.get('patent_id', 'N/A'),
+                'similarity_score': round(p.get('similarity', 0) * 100, 1),
+                'key_overlap': p.get('key_overlap', 'N/A')
+            } for p in data['similar_patents']]
+        
+        # Add risk factors if available
+        if 'infringement_risks' in data and data['infringement_risks']:
+            template_data['infringement_risks'] = data['infringement_risks']
+        elif 'risk_factors' in data and data['risk_factors']:
+            template_data['infringement_risks'] = [{
+                'title': 'Potential Infringement Risk',
+                'patent_id': 'N/A',
+                'risk_score': 'High',
+                'critical_factors': factor
+            } for factor in data['risk_factors']]
+        
+        return template_data
+    
+    def _message_structure(self, rendered):
+        """Create the SNS message structure of a rendered template"""
+        message_structure = {
+            'default': rendered['default'],
+            'email': json.dumps({
+                'subject': rendered['subject'],
+                'body': {
+                    'text': rendered['text'],
+                    'html': rendered['html']
+                }
+            }),
+            'sms': rendered['sms']
+        }
+        
+        return message_structure
+    
+    def _fallback_alert(self, data):
+        """Format an alert as plain text, for when the template can't be rendered"""
+        subject = f"Patent Alert: {data.get('title', 'Alert')}"
+        message = f"""Patent Alert
+        
+        Patent ID: {data.get('patent_id', 'N/A')}
+        Title: {data.get('title', 'N/A')}
+        Risk Level: {data.get('risk_level', 'N/A')}
+        
+        Risk Factors:
+        {self._format_list(data.get('risk_factors', []))}
+        
+        Similar Patents:
+        {self._format_similar_patents(data.get('similar_patents', []))}
+        
+        Please review this patent in the PatentAnalyzer system.
+        """
+        
+        return subject, message
+    
     def _format_list(self, items):
         """Format a list as a string with bullet points"""
         if not items:
@@ -0,0 +1,205 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when the hashing pool's queue is full"""
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('utf-8')
+
+
+def _new_salt():
+    return _b64encode(os.urandom(16))
+
+
+class PBKDF2Hasher:
+    """PBKDF2-HMAC-SHA256, encoded as pbkdf2_sha256$iterations$salt$hash"""
+
+    algorithm = 'pbkdf2_sha256'
+    default_cost = 600000
+
+    def __init__(self, cost=None):
+        self.cost = cost or self.default_cost
+
+    def hash(self, password, salt=None, cost=None):
+        salt = salt or _new_salt()
+        cost = cost or self.cost
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), cost)
+        return f"{self.algorithm}${cost}${salt}${_b64encode(digest)}"
+
+    def verify(self, encoded, password):
+        _, cost, salt, _ = encoded.split('$')
+        return hmac.compare_digest(encoded, self.hash(password, salt, int(cost)))
+
+    def needs_rehash(self, encoded):
+        return int(encoded.split('$')[1]) != self.cost
+
+
+class ScryptHasher:
+    """scrypt with block size 8 and no parallelism, encoded as scrypt$n$salt$hash"""
+
+    algorithm = 'scrypt'
+    default_cost = 2 ** 15
+    block_size = 8
+
+    def __init__(self, cost=None):
+        self.cost = cost or self.default_cost
+
+    def hash(self, password, salt=None, cost=None):
+        salt = salt or _new_salt()
+        cost = cost or self.cost
+        digest = hashlib.scrypt(
+            password.encode('utf-8'),
+            salt=salt.encode('utf-8'),
+            n=cost,
+            r=self.block_size,
+            p=1,
+            maxmem=256 * cost * self.block_size,  # scrypt needs 128 * n * r bytes
+            dklen=32
+        )
+        return f"{self.algorithm}${cost}${salt}${_b64encode(digest)}"
+
+    def verify(self, encoded, password):
+        _, cost, salt, _ = encoded.split('$')
+        return hmac.compare_digest(encoded, self.hash(password, salt, int(cost)))
+
+    def needs_rehash(self, encoded):
+        return int(encoded.split('$')[1]) != self.cost
+
+
+class LegacyHasher:
+    """The original single HMAC-SHA256, encoded as salt$hash. Only used to verify existing records"""
+
+    algorithm = 'hmac_sha256'
+
+    def verify(self, encoded, password):
+        salt, _ = encoded.split('$')
+        digest = hmac.new(salt.encode('utf-8'), password.encode('utf-8'), hashlib.sha256).digest()
+        return hmac.compare_digest(encoded, f"{salt}${_b64encode(digest)}")
+
+    def needs_rehash(self, encoded):
+        return True
+
+
+HASHERS = {hasher.algorithm: hasher for hasher in (PBKDF2Hasher, ScryptHasher)}
+
+
+def create_password_hasher(algorithm=None, cost=None):
+    """Create the password hasher for the configured algorithm and cost"""
+    algorithm = algorithm or Config.PASSWORD_HASH_ALGORITHM
+    cost = cost or Config.PASSWORD_HASH_COST
+
+    if algorithm not in HASHERS:
+        raise ValueError(f"Unknown password hash algorithm: {algorithm}")
+
+    return HASHERS[algorithm](cost)
+
+
+class PasswordHashing:
+    """Hashes and verifies passwords on a dedicated, bounded thread pool.
+
+    New passwords are hashed with the given hasher. Stored passwords are
+    verified with the hasher they were encoded with, including legacy
+    salt$hash records, and verify() reports whether a record should be
+    rehashed with the current hasher and cost. hashlib releases the GIL
+    while it hashes, so the pool's threads don't hold up request threads.
+    At most max_queue calls wait for a free thread; beyond that,
+    PasswordHashingBusy is raised at once instead of queueing.
+    """
+
+    def __init__(self, hasher=None, workers=None, max_queue=None):
+        self.hasher = hasher or create_password_hasher()
+        self.workers = workers or Config.PASSWORD_HASH_WORKERS
+        self.max_queue = Config.PASSWORD_HASH_MAX_QUEUE if max_queue is None else max_queue
+        self._legacy = LegacyHasher()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._stats = {
+            'completed': 0,
+            'rejected': 0,
+            'peak_queue_depth': 0,
+            'wait_seconds': 0.0,
+            'hash_seconds': 0.0
+        }
+
+    def hash(self, password):
+        """Hash a new password with the current hasher"""
+        return self._run(self.hasher.hash, password)
+
+    def verify(self, encoded, password):
+        """Check a password against a stored hash, returning (valid, needs_rehash)"""
+        hasher = self._hasher_for(encoded)
+        if hasher is None:
+            return False, False
+
+        valid = self._run(hasher.verify, encoded, password)
+        needs_rehash = valid and (hasher is not self.hasher or self.hasher.needs_rehash(encoded))
+        return valid, needs_rehash
+
+    def stats(self):
+        """Get the pool's queue depth and timing counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['running'] = self._running
+            stats['queue_depth'] = self._pending - self._running
+
+        completed = stats['completed']
+        wait_seconds = stats.pop('wait_seconds')
+        hash_seconds = stats.pop('hash_seconds')
+        stats['avg_wait_ms'] = round(wait_seconds / completed * 1000, 2) if completed else 0
+        stats['avg_hash_ms'] = round(hash_seconds / completed * 1000, 2) if completed else 0
+        stats['workers'] = self.workers
+        stats['max_queue'] = self.max_queue
+        return stats
+
+    def shutdown(self):
+        """Stop the pool once queued calls finish"""
+        self._executor.shutdown(wait=True)
+
+    def _hasher_for(self, encoded):
+        parts = (encoded or '').split('$')
+        if parts[0] in HASHERS and len(parts) == 4:
+            return self.hasher if parts[0] == self.hasher.algorithm else HASHERS[parts[0]]()
+        if len(parts) == 2:
+            return self._legacy
+        return None
+
+    def _run(self, function, *args):
+        with self._lock:
+            # Calls beyond the workers wait in the executor's queue
+            if self._pending >= self.workers + self.max_queue:
+                self._stats['rejected'] += 1
+                raise PasswordHashingBusy("Too many sign-in requests. Please try again shortly.")
+            self._pending += 1
+            self._stats['peak_queue_depth'] = max(self._stats['peak_queue_depth'], self._pending - self.workers)
+
+        submitted = time.monotonic()
+        try:
+            return self._executor.submit(self._timed, submitted, function, *args).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _timed(self, submitted, function, *args):
+        started = time.monotonic()
+        with self._lock:
+            self._running += 1
+            self._stats['wait_seconds'] += started - submitted
+        try:
+            return function(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._stats['completed'] += 1
+                self._stats['hash_seconds'] += time.monotonic() - started
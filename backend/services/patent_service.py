@@ -5,16 +5,28 @@ import json
 from datetime import datetime
 from botocore.exceptions import ClientError
 from config import Config
+from services.aws_clients import get_resource, get_table, register_table_check
+from services.prior_art_index import get_prior_art_index
+from services.dynamodb_repository import iter_query, iter_scan
+from services.near_duplicate import get_near_duplicate_index, minhash_signature, signature_text, signature_to_bytes
 
 logger = logging.getLogger(__name__)
 
 class PatentService:
+    # Attributes returned by listings, leaving out the large text fields
+    SUMMARY_ATTRIBUTES = [
+        'patent_id', 'user_id', 'title', 'inventors', 'technology_domain',
+        'submission_date', 'status', 'abstract', 'file_type'
+    ]
+    
     def __init__(self):
-        self.dynamodb = boto3.resource('dynamodb', region_name=Config.AWS_REGION)
-        self.patents_table = self.dynamodb.Table(Config.DYNAMODB_PATENTS_TABLE)
+        self.dynamodb = get_resource('dynamodb')
+        self.patents_table = get_table(Config.DYNAMODB_PATENTS_TABLE)
+        self.prior_art_index = get_prior_art_index()
+        self.near_duplicate_index = get_near_duplicate_index()
         
-        # Ensure the table exists
-        self._create_patents_table_if_not_exists()
+        # Ensure the table exists (verified once at startup)
+        register_table_check(Config.DYNAMODB_PATENTS_TABLE, self._create_patents_table_if_not_exists)
     
     def _create_patents_table_if_not_exists(self):
         """Create the patents table if it doesn't exist"""
@@ -33,7 +45,8 @@ class PatentService:
                     AttributeDefinitions=[
                         {'AttributeName': 'patent_id', 'AttributeType': 'S'},
                         {'AttributeName': 'user_id', 'AttributeType': 'S'},
-                        {'AttributeName': 'submission_date', 'AttributeType': 'S'}
+                        {'AttributeName': 'submission_date', 'AttributeType': 'S'},
+                        {'AttributeName': 'technology_domain', 'AttributeType': 'S'}
                     ],
                     GlobalSecondaryIndexes=[
                         {
@@ -49,6 +62,20 @@ class PatentService:
                                 'ReadCapacityUnits': 5,
                                 'WriteCapacityUnits': 5
                             }
+                        },
+                        {
+                            'IndexName': Config.DYNAMODB_PATENTS_DOMAIN_INDEX,
+                            'KeySchema': [
+                                {'AttributeName': 'technology_domain', 'KeyType': 'HASH'},
+                                {'AttributeName': 'submission_date', 'KeyType': 'RANGE'}
+                            ],
+                            'Projection': {
+                                'ProjectionType': 'KEYS_ONLY'
+                            },
+                            'ProvisionedThroughput': {
+                                'ReadCapacityUnits': 5,
+                                'WriteCapacityUnits': 5
+                            }
                         }
                     ],
                     ProvisionedThroughput={
@@ -92,9 +119,19 @@ class PatentService:
             'metadata': patent_data.get('metadata', {})
         }
         
+        # MinHash signature of the claims and abstract, used to spot near-duplicates
+        signature = minhash_signature(signature_text(patent_item))
+        if signature is not None:
+            patent_item['minhash'] = signature_to_bytes(signature)
+        
         # Save to DynamoDB
         self.patents_table.put_item(Item=patent_item)
         
+        # Make the patent searchable as prior art for later analyses
+        self.prior_art_index.add_patent(patent_item)
+        if self.near_duplicate_index.is_loaded:
+            self.near_duplicate_index.add_patent(patent_item, signature)
+        
         logger.info(f"Patent {patent_id} submitted successfully")
         
         return {
@@ -111,6 +148,9 @@ class PatentService:
         if not patent:
             raise ValueError(f"Patent with ID {patent_id} not found")
         
+        # The signature is binary and only used internally
+        patent.pop('minhash', None)
+        
         return patent
     
     def update_patent_status(self, patent_id, status, metadata=None):
@@ -136,12 +176,14 @@ class PatentService:
     
     def get_user_patents(self, user_id):
         """Get all patents for a user"""
-        response = self.patents_table.query(
+        patents = list(iter_query(
+            self.patents_table,
             IndexName='user-id-index',
             KeyConditionExpression=boto3.dynamodb.conditions.Key('user_id').eq(user_id)
-        )
+        ))
         
-        patents = response.get('Items', [])
+        for patent in patents:
+            patent.pop('minhash', None)
         
         # Sort by submission date (newest first)
         patents.sort(key=lambda x: x.get('submission_date', ''), reverse=True)
@@ -150,34 +192,35 @@ class PatentService:
     
     def search_patents(self, query_params):
         """Search for patents based on various criteria"""
-        # This is a simplified implementation
-        # In a real application, you would use more sophisticated search techniques
-        # such as DynamoDB Query with filter expressions or even ElasticSearch
+        # Exact-match and range filters are applied by DynamoDB; the
+        # case-insensitive text filters still run in memory
+        Attr = boto3.dynamodb.conditions.Attr
+        conditions = []
+        if 'technology_domain' in query_params:
+            conditions.append(Attr('technology_domain').eq(query_params['technology_domain']))
+        if 'date_from' in query_params:
+            conditions.append(Attr('submission_date').gte(query_params['date_from']))
+        if 'date_to' in query_params:
+            conditions.append(Attr('submission_date').lte(query_params['date_to']))
         
-        # For now, we'll just scan the table and filter in memory
-        response = self.patents_table.scan()
-        patents = response.get('Items', [])
+        scan_kwargs = {}
+        if conditions:
+            filter_expression = conditions[0]
+            for condition in conditions[1:]:
+                filter_expression = filter_expression & condition
+            scan_kwargs['FilterExpression'] = filter_expression
         
-        # Apply filters
-        if 'technology_domain' in query_params:
-            patents = [p for p in patents if p.get('technology_domain') == query_params['technology_domain']]
+        patents = iter_scan(self.patents_table, attributes=self.SUMMARY_ATTRIBUTES, **scan_kwargs)
         
+        # Apply filters
         if 'title_contains' in query_params:
             patents = [p for p in patents if query_params['title_contains'].lower() in p.get('title', '').lower()]
         
         if 'inventor_contains' in query_params:
             patents = [p for p in patents if any(query_params['inventor_contains'].lower() in inv.lower() for inv in p.get('inventors', []))]
         
-        if 'date_from' in query_params:
-            patents = [p for p in patents if p.get('submission_date', '') >= query_params['date_from']]
-        
-        if 'date_to' in query_params:
-            patents = [p for p in patents if p.get('submission_date', '') <= query_params['date_to']]
-        
         # Sort by submission date (newest first)
-        patents.sort(key=lambda x: x.get('submission_date', ''), reverse=True)
-        
-        return patents
+        return sorted(patents, key=lambda x: x.get('submission_date', ''), reverse=True)
     
     def delete_patent(self, patent_id):
         """Delete a patent"""
@@ -186,6 +229,8 @@ class PatentService:
         
         # Delete the patent
         self.patents_table.delete_item(Key={'patent_id': patent_id})
+        self.prior_art_index.remove_patent(patent_id)
+        self.near_duplicate_index.remove_patent(patent_id)
         
         logger.info(f"Patent {patent_id} deleted successfully")
         
@@ -0,0 +1,351 @@
+import json
+import logging
+import os
+import re
+import threading
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Patent fields that make up the indexed text of a document
+INDEXED_FIELDS = ('title', 'abstract', 'claims', 'description')
+
+# Metadata kept per document so matches can be reported without re-reading the table
+DOCUMENT_FIELDS = ('title', 'submission_date', 'technology_domain')
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    """Split text into lowercase alphanumeric terms"""
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+class PriorArtIndex:
+    """Positional inverted index over patent text used for prior art candidate retrieval.
+
+    Postings map each term to the patents containing it together with the term
+    positions, so both single terms and multi-word key phrases can be matched
+    without touching the text of non-matching patents. The index is persisted as
+    a JSON snapshot plus an append-only journal of incremental changes.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or Config.PRIOR_ART_INDEX_PATH
+        self.journal_path = f"{self.path}.journal"
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._documents = {}
+        self._loaded = False
+        self._snapshot_mtime = None
+        self._journal_offset = 0
+        self._listeners = []
+        self._muted = False
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, patent_id):
+        return patent_id in self._documents
+
+    def document(self, patent_id):
+        """Get the stored metadata for an indexed patent"""
+        return self._documents.get(patent_id)
+
+    @property
+    def is_loaded(self):
+        return self._loaded
+
+    def add_listener(self, listener):
+        """Register a callable told about every change to the index
+
+        The listener is called as listener(op, patent_id) with op 'add' or
+        'remove', or once as ('reset', None) after the whole index is reloaded
+        or rebuilt. It runs while the index is locked, so it must not call back
+        into the index.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def patent_ids(self):
+        """Get the IDs of every indexed patent"""
+        with self._lock:
+            return list(self._documents)
+
+    def term_frequencies(self, patent_id):
+        """Get the number of occurrences of each term in an indexed patent"""
+        with self._lock:
+            document = self._documents.get(patent_id)
+            if not document:
+                return {}
+            return {term: len(self._postings[term][patent_id]) for term in document.get('terms', [])}
+
+    def export_postings(self):
+        """Copy the term frequencies of the whole index into flat lists
+
+        Returns (patent_ids, terms, rows, frequencies): the postings of terms[i]
+        are rows[i] (positions in patent_ids) and frequencies[i].
+        """
+        with self._lock:
+            patent_ids = list(self._documents)
+            row_of = {patent_id: row for row, patent_id in enumerate(patent_ids)}
+            terms, rows, frequencies = [], [], []
+            for term, postings in self._postings.items():
+                terms.append(term)
+                rows.append([row_of[patent_id] for patent_id in postings])
+                frequencies.append([len(positions) for positions in postings.values()])
+            return patent_ids, terms, rows, frequencies
+
+    def load(self):
+        """Load the index from its snapshot and replay the journal
+
+        Returns False if no persisted index exists yet.
+        """
+        with self._lock:
+            self._muted = True
+            try:
+                self._reset()
+                snapshot_exists = self._load_snapshot()
+                self._replay_journal()
+            finally:
+                self._muted = False
+            self._notify('reset', None)
+
+            # Without a snapshot the journal alone is incomplete, so a rebuild is needed
+            self._loaded = snapshot_exists
+            if self._loaded:
+                logger.info(f"Loaded prior art index with {len(self._documents)} patents from {self.path}")
+            return self._loaded
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.path):
+            return False
+
+        with open(self.path, 'r') as file:
+            snapshot = json.load(file)
+        for patent_id, document in snapshot.get('documents', {}).items():
+            self._documents[patent_id] = document
+        for term, postings in snapshot.get('postings', {}).items():
+            self._postings[term] = postings
+        self._snapshot_mtime = os.path.getmtime(self.path)
+        return True
+
+    def refresh(self):
+        """Pick up changes persisted by other processes since the last load"""
+        with self._lock:
+            snapshot_mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+            journal_size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+
+            if snapshot_mtime != self._snapshot_mtime or journal_size < self._journal_offset:
+                # The snapshot was rewritten (or the journal compacted) elsewhere
+                self.load()
+            elif journal_size > self._journal_offset:
+                self._replay_journal()
+
+    def save(self):
+        """Write a full snapshot of the index and truncate the journal"""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            snapshot = {
+                'documents': self._documents,
+                'postings': self._postings
+            }
+
+            # Write to a temporary file first so readers never see a partial snapshot
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as file:
+                json.dump(snapshot, file, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+
+            with open(self.journal_path, 'w'):
+                pass
+
+            self._snapshot_mtime = os.path.getmtime(self.path)
+            self._journal_offset = 0
+            self._loaded = True
+            logger.info(f"Saved prior art index with {len(self._documents)} patents to {self.path}")
+
+    def rebuild(self, patents):
+        """Rebuild the index from scratch from an iterable of patent items"""
+        with self._lock:
+            self._muted = True
+            try:
+                self._reset()
+                for patent in patents:
+                    self._add(patent)
+            finally:
+                self._muted = False
+            self._notify('reset', None)
+            self.save()
+
+    def add_patent(self, patent):
+        """Add or replace a patent in the index"""
+        with self._lock:
+            self._add(patent)
+            self._append_journal({'op': 'add', 'patent': self._indexable(patent)})
+
+    def remove_patent(self, patent_id):
+        """Remove a patent from the index"""
+        with self._lock:
+            self._remove(patent_id)
+            self._append_journal({'op': 'remove', 'patent_id': patent_id})
+
+    def match(self, keywords, exclude_patent_id=None, candidate_ids=None):
+        """Find indexed patents containing each keyword
+
+        Returns a dict mapping patent_id to the list of keywords it contains,
+        in the order the keywords were given.
+        """
+        matches = {}
+
+        with self._lock:
+            for keyword in keywords:
+                for patent_id in self._match_phrase(tokenize(keyword)):
+                    if patent_id == exclude_patent_id:
+                        continue
+                    if candidate_ids is not None and patent_id not in candidate_ids:
+                        continue
+                    matches.setdefault(patent_id, []).append(keyword)
+
+        return matches
+
+    def _match_phrase(self, terms):
+        """Get the IDs of patents containing the terms as a contiguous phrase"""
+        if not terms:
+            return set()
+
+        postings = [self._postings.get(term) for term in terms]
+        if not all(postings):
+            return set()
+
+        if len(terms) == 1:
+            return set(postings[0])
+
+        # Intersect starting from the rarest term to keep the candidate set small
+        candidates = set(min(postings, key=len))
+        for term_postings in postings:
+            candidates.intersection_update(term_postings)
+            if not candidates:
+                return set()
+
+        matched = set()
+        for patent_id in candidates:
+            starts = set(postings[0][patent_id])
+            for offset, term_postings in enumerate(postings[1:], start=1):
+                starts.intersection_update(position - offset for position in term_postings[patent_id])
+                if not starts:
+                    break
+            if starts:
+                matched.add(patent_id)
+
+        return matched
+
+    def _indexable(self, patent):
+        """Reduce a patent item to the fields the index needs"""
+        return {field: patent.get(field) for field in ('patent_id',) + DOCUMENT_FIELDS + INDEXED_FIELDS
+                if patent.get(field) is not None}
+
+    def _add(self, patent):
+        patent_id = patent.get('patent_id')
+        if not patent_id:
+            return
+
+        if patent_id in self._documents:
+            self._remove(patent_id)
+
+        terms = tokenize(' '.join(str(patent.get(field) or '') for field in INDEXED_FIELDS))
+
+        positions = {}
+        for position, term in enumerate(terms):
+            positions.setdefault(term, []).append(position)
+
+        for term, term_positions in positions.items():
+            self._postings.setdefault(term, {})[patent_id] = term_positions
+
+        document = {field: patent.get(field) for field in DOCUMENT_FIELDS}
+        document['terms'] = list(positions)
+        self._documents[patent_id] = document
+        self._notify('add', patent_id)
+
+    def _remove(self, patent_id):
+        document = self._documents.pop(patent_id, None)
+        if not document:
+            return
+
+        for term in document.get('terms', []):
+            term_postings = self._postings.get(term)
+            if term_postings is None:
+                continue
+            term_postings.pop(patent_id, None)
+            if not term_postings:
+                del self._postings[term]
+
+        self._notify('remove', patent_id)
+
+    def _reset(self):
+        self._postings = {}
+        self._documents = {}
+        self._snapshot_mtime = None
+        self._journal_offset = 0
+        self._notify('reset', None)
+
+    def _notify(self, op, patent_id):
+        if self._muted:
+            return
+        for listener in self._listeners:
+            try:
+                listener(op, patent_id)
+            except Exception as e:
+                logger.error(f"Error notifying prior art index listener: {str(e)}")
+
+    def _append_journal(self, entry):
+        try:
+            directory = os.path.dirname(self.journal_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            with open(self.journal_path, 'a') as file:
+                start = file.tell()
+                file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+                # Only skip past our own entry if nothing from another process precedes it
+                if start == self._journal_offset:
+                    self._journal_offset = file.tell()
+        except OSError as e:
+            # The in-memory index stays correct; the change is recovered on the next rebuild
+            logger.error(f"Error writing prior art index journal: {str(e)}")
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path, 'r') as file:
+            file.seek(self._journal_offset)
+            while True:
+                line = file.readline()
+                if not line.endswith('\n'):
+                    # Stop at a partially written trailing entry
+                    break
+
+                entry = json.loads(line)
+                if entry['op'] == 'add':
+                    self._add(entry['patent'])
+                elif entry['op'] == 'remove':
+                    self._remove(entry['patent_id'])
+                self._journal_offset = file.tell()
+
+
+_shared_index = None
+_shared_index_lock = threading.Lock()
+
+
+def get_prior_art_index():
+    """Get the process-wide prior art index shared by the services"""
+    global _shared_index
+    with _shared_index_lock:
+        if _shared_index is None:
+            _shared_index = PriorArtIndex()
+            _shared_index.load()
+        return _shared_index
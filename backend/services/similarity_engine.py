@@ -0,0 +1,217 @@
+import logging
+import os
+from collections import Counter
+import numpy as np
+from config import Config
+from services.prior_art_index import INDEXED_FIELDS, tokenize
+from services.similarity_snapshot import Segment, SegmentedSimilarityEngine, SnapshotStore, encode_ids
+from services.embedding_index import EmbeddingEngine
+
+logger = logging.getLogger(__name__)
+
+SCHEMES = ('tfidf', 'bm25')
+
+
+class _TermMatrix(Segment):
+    """Sparse term-weight matrix stored column-wise (one column per term).
+
+    Terms are kept sorted so query terms are found with a binary search. The
+    postings of the term in column j are rows[indptr[j]:indptr[j + 1]] with
+    weights at the same offsets, so scoring a query only touches the
+    columns of its terms.
+    """
+
+    def __init__(self, arrays):
+        super().__init__(arrays)
+        self.terms = arrays['terms']
+        self.indptr = arrays['indptr']
+        self.rows = arrays['rows']
+        self.weights = arrays['weights']
+        self.idf = arrays.get('idf')
+
+    def columns_of(self, keys):
+        """Get the columns of the encoded terms and which of the keys were found"""
+        if not len(self.terms) or not len(keys):
+            return np.zeros(0, dtype=np.int64), np.zeros(len(keys), dtype=bool)
+        columns = np.minimum(np.searchsorted(self.terms, keys), len(self.terms) - 1)
+        found = self.terms[columns] == keys
+        return columns[found], found
+
+    def score(self, query, rows=None):
+        """Multiply the matrix by a sparse query vector"""
+        keys, query_weights = query['keys'], query['weights']
+        columns, found = self.columns_of(keys)
+        if not len(columns):
+            return np.zeros(len(self), dtype=np.float64)
+
+        # Gather the postings of every query column in one go
+        starts = self.indptr[columns]
+        lengths = self.indptr[columns + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+        return np.bincount(
+            self.rows[offsets],
+            weights=self.weights[offsets] * np.repeat(query_weights[found], lengths),
+            minlength=len(self)
+        )
+
+
+class SimilarityEngine(SegmentedSimilarityEngine):
+    """Vector-space similarity over the documents of the prior art index.
+
+    Every indexed patent is a row of a sparse term-weight matrix, weighted
+    either as lnc.ltc TF-IDF (cosine similarity) or BM25 (normalised by the
+    query's score against itself), and a patent is scored against the whole
+    corpus with a single sparse matrix-vector product per segment. Delta
+    segments are weighted with the statistics of the base they extend.
+    """
+
+    def __init__(self, index, scheme=None, k1=None, b=None, store=None):
+        self.scheme = scheme or Config.SIMILARITY_ENGINE
+        self.k1 = Config.SIMILARITY_BM25_K1 if k1 is None else k1
+        self.b = Config.SIMILARITY_BM25_B if b is None else b
+
+        if self.scheme not in SCHEMES:
+            raise ValueError(f"Unknown similarity scheme: {self.scheme}")
+
+        super().__init__(
+            index,
+            store or SnapshotStore(os.path.join(Config.SIMILARITY_SNAPSHOT_DIR, self.scheme)),
+            segment_size=Config.SIMILARITY_SEGMENT_SIZE,
+            max_segments=Config.SIMILARITY_MAX_SEGMENTS,
+            max_pending=Config.SIMILARITY_MAX_PENDING
+        )
+
+    def _compatible(self, metadata):
+        return metadata.get('scheme') == self.scheme and metadata.get('k1') == self.k1 and metadata.get('b') == self.b
+
+    def _build_base(self, patent_ids, terms, rows, frequencies):
+        # Sort the columns by term so they can be binary searched
+        order = np.argsort(encode_ids(terms), kind='stable')
+        terms = [terms[i] for i in order]
+        rows = [rows[i] for i in order]
+        frequencies = [frequencies[i] for i in order]
+
+        document_frequencies = np.fromiter((len(term_rows) for term_rows in rows), dtype=np.int64, count=len(terms))
+        indptr, row_array, tf = self._flatten(rows, frequencies)
+
+        lengths = np.bincount(row_array, weights=tf, minlength=len(patent_ids))
+        avg_length = float(lengths.mean()) if len(patent_ids) else 0.0
+        idf = self._idf_values(document_frequencies, len(patent_ids))
+
+        weights = self._document_weights(tf, row_array, lengths, np.repeat(idf, document_frequencies),
+                                         avg_length, len(patent_ids))
+
+        logger.info(f"Built {self.scheme} similarity matrix for {len(patent_ids)} patents and {len(terms)} terms")
+
+        arrays = {
+            'terms': encode_ids(terms),
+            'indptr': indptr,
+            'rows': row_array,
+            'weights': weights,
+            'idf': idf
+        }
+        metadata = {
+            'scheme': self.scheme,
+            'k1': self.k1,
+            'b': self.b,
+            'document_count': len(patent_ids),
+            'avg_length': avg_length
+        }
+        return arrays, metadata
+
+    def _build_segment(self, present, metadata, base):
+        columns = {}
+        for row, (_, term_frequencies) in enumerate(present):
+            for term, frequency in term_frequencies.items():
+                column = columns.setdefault(term, ([], []))
+                column[0].append(row)
+                column[1].append(frequency)
+
+        terms = sorted(columns)
+        document_frequencies = np.fromiter((len(columns[term][0]) for term in terms), dtype=np.int64, count=len(terms))
+        indptr, row_array, tf = self._flatten([columns[term][0] for term in terms],
+                                              [columns[term][1] for term in terms])
+
+        lengths = np.bincount(row_array, weights=tf, minlength=len(present))
+        term_keys = encode_ids(terms)
+        weights = self._document_weights(tf, row_array, lengths,
+                                         np.repeat(self._term_idf(term_keys, base, metadata), document_frequencies),
+                                         metadata['avg_length'] or 1.0, len(present))
+
+        return {'terms': term_keys, 'indptr': indptr, 'rows': row_array, 'weights': weights}
+
+    def _open_segment(self, arrays, metadata, base):
+        return _TermMatrix(arrays)
+
+    def _prepare_query(self, patent, metadata, base):
+        terms = Counter(tokenize(' '.join(str(patent.get(field) or '') for field in INDEXED_FIELDS)))
+        if not terms:
+            return None
+
+        keys = encode_ids(terms)
+        counts = np.fromiter(terms.values(), dtype=np.float64, count=len(terms))
+        idf = self._term_idf(keys, base, metadata)
+
+        if self.scheme == 'bm25':
+            # Score of the query as a document of the corpus, i.e. of an identical patent
+            length = counts.sum()
+            saturation = self.k1 * (1 - self.b + self.b * length / (metadata['avg_length'] or length))
+            self_score = float(np.sum(idf * counts * (self.k1 + 1) / (counts + saturation)))
+            return {'keys': keys, 'weights': np.ones(len(keys)), 'self_score': self_score}
+
+        # ltc: log-scaled term frequency times IDF, cosine-normalised
+        weights = (1 + np.log(counts)) * idf
+        norm = np.linalg.norm(weights) or 1.0
+        return {'keys': keys, 'weights': weights / norm}
+
+    def _normalise(self, scores, query, metadata):
+        if self.scheme == 'bm25':
+            if query['self_score'] <= 0:
+                return np.zeros_like(scores)
+            scores = scores / query['self_score']
+        return np.clip(scores, 0, 1)
+
+    def _flatten(self, rows, frequencies):
+        counts = np.fromiter((len(term_rows) for term_rows in rows), dtype=np.int64, count=len(rows))
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        row_array = np.fromiter((row for term_rows in rows for row in term_rows), dtype=np.int32, count=indptr[-1])
+        tf = np.fromiter((f for term_frequencies in frequencies for f in term_frequencies), dtype=np.float64,
+                         count=indptr[-1])
+        return indptr, row_array, tf
+
+    def _idf_values(self, document_frequencies, document_count):
+        if self.scheme == 'bm25':
+            return np.log1p((document_count - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        return np.log(np.maximum(document_count, 1) / np.maximum(document_frequencies, 1)) + 1.0
+
+    def _term_idf(self, keys, base, metadata):
+        """Look up the base IDF of encoded terms"""
+        # A term the base hasn't seen is treated as occurring in a single patent
+        idf = np.full(len(keys), self._idf_values(np.array([1]), max(metadata['document_count'], 1))[0])
+        columns, found = base.columns_of(keys)
+        idf[found] = base.idf[columns]
+        return idf
+
+    def _document_weights(self, tf, rows, lengths, idf, avg_length, row_count):
+        if self.scheme == 'bm25':
+            saturation = self.k1 * (1 - self.b + self.b * lengths[rows] / (avg_length or 1.0))
+            return idf * tf * (self.k1 + 1) / (tf + saturation)
+
+        # lnc: log-scaled term frequency, cosine-normalised per document
+        weights = 1 + np.log(tf)
+        norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=row_count))
+        return weights / np.where(norms[rows] > 0, norms[rows], 1)
+
+
+def create_similarity_engine(index, scheme=None):
+    """Create the similarity engine for the configured scheme, or None for keyword matching"""
+    scheme = scheme or Config.SIMILARITY_ENGINE
+
+    if scheme == 'keyword':
+        return None
+    if scheme == 'embedding':
+        return EmbeddingEngine(index)
+
+    return SimilarityEngine(index, scheme=scheme)
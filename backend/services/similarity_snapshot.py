@@ -0,0 +1,467 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the layout of a snapshot changes; older snapshots are rebuilt
+SNAPSHOT_FORMAT = 1
+
+
+def encode_ids(values):
+    """Encode patent IDs or terms as a fixed-width bytes array"""
+    values = [value.encode('utf-8') for value in values if value is not None]
+    return np.array(values) if values else np.zeros(0, dtype='S1')
+
+
+def decode_id(value):
+    return value.decode('utf-8')
+
+
+class Snapshot:
+    """A loaded snapshot version: the base arrays plus its delta segments"""
+
+    def __init__(self, state, metadata, base, segments):
+        self.state = state
+        self.metadata = metadata
+        self.base = base
+        self.segments = segments
+
+
+class SnapshotStore:
+    """Versioned on-disk snapshots of a similarity index.
+
+    Each version is a directory holding a manifest, the base arrays as .npy
+    files and any delta segments appended since, and the CURRENT file names
+    the live version. Arrays are opened with mmap_mode='r', so every process
+    reading the same version shares one copy in the page cache. Writers
+    publish with atomic renames under an exclusive file lock.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._current_path = os.path.join(directory, 'CURRENT')
+        self._lock_path = os.path.join(directory, 'lock')
+
+    def state(self):
+        """Get a token that changes whenever a version or segment is published"""
+        version = self._read_current()
+        if version is None:
+            return None
+        try:
+            return version, os.stat(self._manifest_path(version)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """Open the live version, or return None if there is none"""
+        state = self.state()
+        if state is None:
+            return None
+
+        version_dir = os.path.join(self.directory, state[0])
+        try:
+            with open(self._manifest_path(state[0]), 'r') as file:
+                manifest = json.load(file)
+            if manifest.get('format') != SNAPSHOT_FORMAT:
+                logger.warning(f"Ignoring similarity snapshot {version_dir} in format {manifest.get('format')}")
+                return None
+
+            base = self._read_arrays(os.path.join(version_dir, 'base'))
+            segments = [self._read_arrays(os.path.join(version_dir, name)) for name in manifest['segments']]
+        except FileNotFoundError:
+            # Removed by a compaction in another process; the caller retries on its next refresh
+            return None
+
+        return Snapshot(state, manifest['metadata'], base, segments)
+
+    def write_base(self, arrays, metadata):
+        """Publish a new version made of a base and no segments"""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._locked():
+            previous = self._read_current()
+            number = int(previous[1:]) + 1 if previous else 1
+            version = f"v{number:06d}"
+            version_dir = os.path.join(self.directory, version)
+            tmp_dir = f"{version_dir}.tmp"
+
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            self._write_arrays(os.path.join(tmp_dir, 'base'), arrays)
+            self._write_json(os.path.join(tmp_dir, 'manifest.json'), {
+                'format': SNAPSHOT_FORMAT,
+                'metadata': metadata,
+                'segments': []
+            })
+            os.rename(tmp_dir, version_dir)
+            self._write_atomic(self._current_path, version)
+
+            # Keep the previous version for readers that are still switching over
+            self._remove_versions(keep={version, previous})
+
+        logger.info(f"Published similarity snapshot {version_dir}")
+        return version
+
+    def append_segment(self, arrays, version):
+        """Append a delta segment to a version
+
+        Returns False without writing if version is no longer the live one.
+        """
+        with self._locked():
+            if self._read_current() != version:
+                return False
+
+            version_dir = os.path.join(self.directory, version)
+            manifest_path = self._manifest_path(version)
+            with open(manifest_path, 'r') as file:
+                manifest = json.load(file)
+
+            name = f"segment-{len(manifest['segments']) + 1:06d}"
+            tmp_dir = os.path.join(version_dir, f"{name}.tmp")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            self._write_arrays(tmp_dir, arrays)
+            os.rename(tmp_dir, os.path.join(version_dir, name))
+
+            manifest['segments'].append(name)
+            self._write_json(manifest_path, manifest)
+
+        return True
+
+    def _manifest_path(self, version):
+        return os.path.join(self.directory, version, 'manifest.json')
+
+    def _read_current(self):
+        try:
+            with open(self._current_path, 'r') as file:
+                return file.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _remove_versions(self, keep):
+        for name in os.listdir(self.directory):
+            if name.startswith('v') and name not in keep:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def _write_arrays(self, directory, arrays):
+        os.makedirs(directory, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+
+    def _read_arrays(self, directory):
+        arrays = {}
+        for filename in os.listdir(directory):
+            if not filename.endswith('.npy'):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                arrays[filename[:-4]] = np.load(path, mmap_mode='r')
+            except ValueError:
+                # Empty arrays can't be memory-mapped
+                arrays[filename[:-4]] = np.load(path)
+        return arrays
+
+    def _write_json(self, path, data):
+        self._write_atomic(path, json.dumps(data))
+
+    def _write_atomic(self, path, content):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+
+
+class Segment(ABC):
+    """Rows of a snapshot segment, looked up by patent ID without a Python dict"""
+
+    def __init__(self, arrays):
+        self.patent_ids = arrays['patent_ids']
+        self.id_order = arrays['id_order']
+        self.removed = arrays.get('removed', np.zeros(0, dtype='S1'))
+
+    def __len__(self):
+        return len(self.patent_ids)
+
+    def rows_of(self, keys):
+        """Get the rows of the encoded patent IDs present in the segment"""
+        if not len(keys) or not len(self.patent_ids):
+            return np.zeros(0, dtype=np.int64)
+        positions = np.searchsorted(self.patent_ids, keys, sorter=self.id_order)
+        rows = self.id_order[np.minimum(positions, len(self.patent_ids) - 1)]
+        return rows[self.patent_ids[rows] == keys]
+
+    @abstractmethod
+    def score(self, query, rows=None):
+        """Score every row (or only the given rows) against a prepared query"""
+
+
+class SegmentedSimilarityEngine(ABC):
+    """Base class for similarity engines stored as a snapshot plus delta segments.
+
+    The engine opens the live snapshot of its store, so a new process starts
+    from the memory-mapped arrays instead of rebuilding them, and reconciles
+    it with the prior art index. Patents changed since then are scored from
+    a small in-memory delta; once segment_size of them accumulate they are
+    appended to the snapshot as a delta segment that every process picks up.
+    When there are more than max_segments segments, or more than
+    max_pending changes, the engine compacts: it rebuilds the base from the
+    index and publishes a new version.
+
+    Subclasses provide the arrays and scoring of a segment (_build_base,
+    _build_segment, _open_segment) and the query (_prepare_query,
+    _normalise).
+    """
+
+    def __init__(self, index, store, segment_size, max_segments, max_pending):
+        self.index = index
+        self.store = store
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._state = None
+        self._metadata = None
+        self._segments = []
+        self._live = []
+        self._delta = None
+        self._delta_key = None
+
+        # Patents changed since the open segments; never held while locking the index
+        self._pending = set()
+        self._changes = 0
+        self._reconcile = True
+        self._pending_lock = threading.Lock()
+
+        index.add_listener(self._on_index_change)
+
+    def top_k(self, patent, k, exclude_patent_id=None, candidate_ids=None):
+        """Find the k indexed patents most similar to a patent
+
+        Returns a list of (patent_id, similarity) pairs with similarity in
+        (0, 1], most similar first. candidate_ids restricts the patents that
+        are considered.
+        """
+        if k <= 0:
+            return []
+
+        with self._lock:
+            self._refresh()
+            segments, live, metadata = list(self._segments), list(self._live), self._metadata
+            with self._pending_lock:
+                pending, changes = set(self._pending), self._changes
+            delta = self._get_delta(pending, changes, metadata, segments[0])
+
+        query = self._prepare_query(patent, metadata, segments[0])
+        if query is None:
+            return []
+
+        # Patents in the delta are scored from there rather than from older segments
+        masked_keys = encode_ids(pending | {exclude_patent_id})
+        exclude_keys = encode_ids([exclude_patent_id])
+        candidate_keys = None if candidate_ids is None else encode_ids(candidate_ids)
+
+        id_blocks, score_blocks = [], []
+        for segment, segment_live in list(zip(segments, live)) + [(delta, None)]:
+            if segment is None or not len(segment):
+                continue
+
+            mask = np.ones(len(segment), dtype=bool) if segment_live is None else segment_live.copy()
+            mask[segment.rows_of(exclude_keys if segment is delta else masked_keys)] = False
+            if candidate_keys is not None:
+                allowed = np.zeros(len(segment), dtype=bool)
+                allowed[segment.rows_of(candidate_keys)] = True
+                mask &= allowed
+
+            rows = np.flatnonzero(mask)
+            if not len(rows):
+                continue
+
+            scores = segment.score(query, rows if candidate_keys is not None else None)
+            id_blocks.append(segment.patent_ids[rows])
+            score_blocks.append(scores[rows])
+
+        if not score_blocks:
+            return []
+
+        patent_ids = np.concatenate(id_blocks)
+        scores = self._normalise(np.concatenate(score_blocks), query, metadata)
+
+        # Partial sort: only the k best scores are ordered
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+
+        return [(decode_id(patent_ids[row]), float(scores[row])) for row in top if scores[row] > 0]
+
+    def rebuild(self):
+        """Rebuild the base from the index and publish it as a new version"""
+        with self._lock:
+            self._compact()
+
+    def _refresh(self):
+        state = self.store.state()
+        if not self._segments or state != self._state:
+            snapshot = self.store.load()
+            if snapshot is None or not self._compatible(snapshot.metadata):
+                if not self.index.is_loaded and self._segments:
+                    return
+                self._compact()
+                return
+            self._open(snapshot)
+
+        if self._reconcile and self.index.is_loaded:
+            self._reconcile_with_index()
+
+        with self._pending_lock:
+            pending_count = len(self._pending)
+
+        if pending_count > self.max_pending:
+            self._compact()
+        elif pending_count >= self.segment_size:
+            self._flush()
+
+    def _open(self, snapshot):
+        metadata = snapshot.metadata
+        segments = [self._open_segment(snapshot.base, metadata, None)]
+        segments += [self._open_segment(arrays, metadata, segments[0]) for arrays in snapshot.segments]
+
+        # A row is live unless a newer segment replaced or removed its patent
+        live = []
+        newer = np.zeros(0, dtype='S1')
+        for segment in reversed(segments):
+            live.append(~np.isin(segment.patent_ids, newer) if len(newer) else np.ones(len(segment), dtype=bool))
+            newer = np.concatenate([newer, segment.patent_ids, segment.removed])
+        live.reverse()
+
+        self._state = snapshot.state
+        self._metadata = metadata
+        self._segments = segments
+        self._live = live
+        self._delta_key = None
+        with self._pending_lock:
+            self._reconcile = True
+
+        logger.info(f"Opened similarity snapshot {snapshot.state[0]} with {len(segments) - 1} delta segments")
+
+    def _reconcile_with_index(self):
+        """Queue the patents the snapshot and the index disagree about"""
+        with self._pending_lock:
+            self._reconcile = False
+
+        index_ids = encode_ids(self.index.patent_ids())
+        live_ids = np.concatenate([segment.patent_ids[live] for segment, live in zip(self._segments, self._live)])
+
+        missing = index_ids[~np.isin(index_ids, live_ids)]
+        stale = live_ids[~np.isin(live_ids, index_ids)]
+        if len(missing) or len(stale):
+            with self._pending_lock:
+                self._pending.update(decode_id(key) for key in missing)
+                self._pending.update(decode_id(key) for key in stale)
+
+    def _flush(self):
+        """Append the pending patents to the snapshot as a delta segment"""
+        pending = self._pending_ids()
+        arrays = self._segment_arrays(pending, self._metadata, self._segments[0])
+
+        if self.store.append_segment(arrays, self._state[0]):
+            with self._pending_lock:
+                self._pending -= pending
+
+        snapshot = self.store.load()
+        if snapshot is not None:
+            self._open(snapshot)
+            if len(self._segments) - 1 > self.max_segments:
+                self._compact()
+
+    def _compact(self):
+        """Rebuild the base from the index and publish it as a new version"""
+        # Changes notified from here on are newer than the export below
+        with self._pending_lock:
+            self._pending = set()
+            self._reconcile = False
+
+        export = self.index.export_postings()
+        arrays, metadata = self._build_base(*export)
+        arrays.update(self._id_arrays(export[0]))
+
+        self.store.write_base(arrays, metadata)
+        snapshot = self.store.load()
+        self._open(snapshot)
+        with self._pending_lock:
+            self._reconcile = False
+
+    def _segment_arrays(self, patent_ids, metadata, base):
+        present, removed = [], []
+        for patent_id in sorted(patent_ids):
+            term_frequencies = self.index.term_frequencies(patent_id)
+            if term_frequencies:
+                present.append((patent_id, term_frequencies))
+            else:
+                removed.append(patent_id)
+
+        arrays = self._build_segment(present, metadata, base)
+        arrays.update(self._id_arrays([patent_id for patent_id, _ in present]))
+        arrays['removed'] = encode_ids(removed)
+        return arrays
+
+    def _get_delta(self, pending, changes, metadata, base):
+        """Get the in-memory segment of the pending patents, rebuilt only after a change"""
+        if not pending:
+            return None
+        if self._delta_key != (changes, pending):
+            self._delta = self._open_segment(self._segment_arrays(pending, metadata, base), metadata, base)
+            self._delta_key = (changes, pending)
+        return self._delta
+
+    def _pending_ids(self):
+        with self._pending_lock:
+            return set(self._pending)
+
+    def _id_arrays(self, patent_ids):
+        encoded = encode_ids(patent_ids)
+        return {'patent_ids': encoded, 'id_order': np.argsort(encoded, kind='stable')}
+
+    def _on_index_change(self, op, patent_id):
+        with self._pending_lock:
+            self._changes += 1
+            if op == 'reset':
+                self._reconcile = True
+            else:
+                self._pending.add(patent_id)
+
+    def _compatible(self, metadata):
+        """Whether a snapshot was built with the engine's current settings"""
+        return True
+
+    @abstractmethod
+    def _build_base(self, patent_ids, terms, rows, frequencies):
+        """Build the arrays and metadata of a base snapshot from the index"""
+
+    @abstractmethod
+    def _build_segment(self, present, metadata, base):
+        """Build the arrays of a delta segment for the given patents"""
+
+    @abstractmethod
+    def _open_segment(self, arrays, metadata, base):
+        """Wrap the arrays of a snapshot segment in a Segment"""
+
+    @abstractmethod
+    def _prepare_query(self, patent, metadata, base):
+        """Turn a patent into a query the segments can score"""
+
+    def _normalise(self, scores, query, metadata):
+        return np.clip(scores, 0, 1)
@@ -1,20 +1,45 @@
 import boto3
+import base64
+import heapq
+import itertools
+import json
+import threading
+import time
 import uuid
 import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
+from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
 from config import Config
+from services.aws_clients import get_resource, get_table, register_table_check
+from services.dynamodb_repository import iter_pages, iter_scan
+from services.log_shipper import LogShipper, DynamoDBLogHandler
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 class SystemLogsService:
+    # Indexes of the system logs table, keyed by level or service and sorted by timestamp
+    LOG_LEVEL_INDEX = 'LogLevelIndex'
+    SERVICE_INDEX = 'ServiceIndex'
+    
+    # Levels too common for their index to narrow down a service's logs
+    VERBOSE_LOG_LEVELS = ('DEBUG', 'INFO')
+    
     def __init__(self):
-        self.dynamodb = boto3.resource('dynamodb', region_name=Config.AWS_REGION)
-        self.logs_table = self.dynamodb.Table(Config.DYNAMODB_SYSTEM_LOGS_TABLE)
+        self.dynamodb = get_resource('dynamodb')
+        self.logs_table = get_table(Config.DYNAMODB_SYSTEM_LOGS_TABLE)
+        
+        # Log items are buffered and written in batches by a background thread
+        self.shipper = LogShipper(self.logs_table)
+        
+        # Progress of the purge jobs started by this process, keyed by job ID
+        self._purge_jobs = {}
+        self._purge_jobs_lock = threading.Lock()
         
-        # Ensure the table exists
-        self._create_logs_table_if_not_exists()
+        # Ensure the table exists (verified once at startup)
+        register_table_check(Config.DYNAMODB_SYSTEM_LOGS_TABLE, self._create_logs_table_if_not_exists)
     
     def _create_logs_table_if_not_exists(self):
         """Create the system logs table if it doesn't exist"""
@@ -22,6 +47,7 @@ class SystemLogsService:
             # Check if table exists
             self.dynamodb.meta.client.describe_table(TableName=Config.DYNAMODB_SYSTEM_LOGS_TABLE)
             logger.info(f"Table {Config.DYNAMODB_SYSTEM_LOGS_TABLE} already exists")
+            self._enable_log_expiry()
         except ClientError as e:
             if e.response['Error']['Code'] == 'ResourceNotFoundException':
                 # Table will be created by setup_dynamodb.py script
@@ -30,6 +56,22 @@ class SystemLogsService:
                 logger.error(f"Error checking table existence: {str(e)}")
                 raise
     
+    def _enable_log_expiry(self):
+        """Let DynamoDB TTL delete logs once their expires_at has passed"""
+        if not Config.SYSTEM_LOGS_RETENTION_DAYS:
+            return
+        
+        client = self.dynamodb.meta.client
+        description = client.describe_time_to_live(TableName=Config.DYNAMODB_SYSTEM_LOGS_TABLE)
+        if description['TimeToLiveDescription'].get('TimeToLiveStatus') in ('ENABLED', 'ENABLING'):
+            return
+        
+        client.update_time_to_live(
+            TableName=Config.DYNAMODB_SYSTEM_LOGS_TABLE,
+            TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'}
+        )
+        logger.info(f"Enabled TTL on {Config.DYNAMODB_SYSTEM_LOGS_TABLE}")
+    
     def log_event(self, level, message, service, additional_data=None):
         """Log an event to the system logs table"""
         try:
@@ -48,97 +90,239 @@ class SystemLogsService:
             if additional_data and isinstance(additional_data, dict):
                 log_item['additional_data'] = additional_data
             
-            self.logs_table.put_item(Item=log_item)
+            # DynamoDB TTL deletes the log once the retention period is over
+            if Config.SYSTEM_LOGS_RETENTION_DAYS:
+                log_item['expires_at'] = int(time.time()) + Config.SYSTEM_LOGS_RETENTION_DAYS * 24 * 3600
+            
+            # Write synchronously when the shipper isn't running (e.g. in scripts)
+            if self.shipper.running:
+                self.shipper.submit(log_item)
+            else:
+                self.logs_table.put_item(Item=log_item)
             return log_id
         except Exception as e:
             logger.error(f"Error logging event: {str(e)}")
             # Don't raise the exception to prevent disrupting the main application flow
             return None
     
-    def get_logs(self, filters=None, limit=100):
-        """Get system logs with optional filtering"""
+    def start_shipper(self):
+        """Start writing logged events in the background"""
+        self.shipper.start()
+    
+    def stop_shipper(self, timeout=None):
+        """Write the buffered events and stop the background writer"""
+        self.shipper.stop(timeout)
+    
+    def get_shipper_stats(self):
+        """Get the counters and queue depth of the background writer"""
+        return self.shipper.stats()
+    
+    def create_log_handler(self, level=None):
+        """Create a logging handler that ships log records to the system logs table"""
+        return DynamoDBLogHandler(self, level or Config.LOG_LEVEL)
+    
+    def get_logs(self, filters=None, limit=100, cursor=None):
+        """Get the newest system logs matching the filters, a page at a time
+        
+        Logs are read newest first from the level or service index, with the
+        date range in the key condition. Returns the logs and a cursor for
+        the next page, or None when there are no more logs.
+        """
         try:
-            scan_kwargs = {
-                'Limit': limit
-            }
-            
-            # Apply filters if provided
-            filter_expressions = []
-            expression_attribute_values = {}
-            expression_attribute_names = {}
+            filters = filters or {}
+            streams = self._plan_log_query(filters)
+            start_keys = self._decode_cursor(cursor, streams) if cursor else {}
             
-            if filters:
-                if 'level' in filters:
-                    filter_expressions.append('#level = :level')
-                    expression_attribute_names['#level'] = 'log_level'
-                    expression_attribute_values[':level'] = filters['level'].upper()
-                
-                if 'service' in filters:
-                    filter_expressions.append('#service = :service')
-                    expression_attribute_names['#service'] = 'service'
-                    expression_attribute_values[':service'] = filters['service']
-                
-                if 'start_date' in filters:
-                    filter_expressions.append('#timestamp >= :start_date')
-                    expression_attribute_names['#timestamp'] = 'timestamp'
-                    expression_attribute_values[':start_date'] = filters['start_date']
-                
-                if 'end_date' in filters:
-                    filter_expressions.append('#timestamp <= :end_date')
-                    expression_attribute_names['#timestamp'] = 'timestamp'
-                    expression_attribute_values[':end_date'] = filters['end_date']
+            # Merge the streams newest first, remembering the last log taken from each
+            merged = heapq.merge(
+                *[self._iter_log_stream(name, query_kwargs, start_keys.get(name), limit)
+                  for name, query_kwargs in streams.items()],
+                reverse=True
+            )
             
-            if filter_expressions:
-                scan_kwargs['FilterExpression'] = ' AND '.join(filter_expressions)
-                scan_kwargs['ExpressionAttributeValues'] = expression_attribute_values
-                scan_kwargs['ExpressionAttributeNames'] = expression_attribute_names
+            logs = []
+            last_keys = dict(start_keys)
+            for _, _, name, log in itertools.islice(merged, limit):
+                logs.append(log)
+                last_keys[name] = self._log_key(log, streams[name])
             
-            response = self.logs_table.scan(**scan_kwargs)
-            logs = response.get('Items', [])
+            # Only hand out a cursor if at least one more log exists
+            next_cursor = None
+            if len(logs) == limit and next(merged, None) is not None:
+                next_cursor = self._encode_cursor(last_keys, streams)
             
-            # Sort logs by timestamp (newest first)
-            logs.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-            
-            return logs
+            return {'logs': logs, 'next_cursor': next_cursor}
         except Exception as e:
             logger.error(f"Error retrieving logs: {str(e)}")
             raise
     
+    def _plan_log_query(self, filters):
+        """Choose the index queries that answer a set of filters
+        
+        Returns the query kwargs of each stream of logs, keyed by stream name.
+        A level or service filter becomes the partition key of its index
+        (the more selective of the two when both are given, with the other
+        as a filter expression). Without either, every configured level's
+        partition is queried and the streams are merged.
+        """
+        level = filters['level'].upper() if filters.get('level') else None
+        service = filters.get('service')
+        
+        key_range = None
+        if filters.get('start_date') and filters.get('end_date'):
+            key_range = Key('timestamp').between(filters['start_date'], filters['end_date'])
+        elif filters.get('start_date'):
+            key_range = Key('timestamp').gte(filters['start_date'])
+        elif filters.get('end_date'):
+            key_range = Key('timestamp').lte(filters['end_date'])
+        
+        def query(index, attribute, value, filter_expression=None):
+            key_condition = Key(attribute).eq(value)
+            query_kwargs = {
+                'IndexName': index,
+                'KeyConditionExpression': key_condition & key_range if key_range else key_condition,
+                'ScanIndexForward': False
+            }
+            if filter_expression is not None:
+                query_kwargs['FilterExpression'] = filter_expression
+            return query_kwargs
+        
+        # Verbose levels are logged far more often than a single service's logs
+        if level and (not service or level not in self.VERBOSE_LOG_LEVELS):
+            service_filter = Attr('service').eq(service) if service else None
+            return {level: query(self.LOG_LEVEL_INDEX, 'log_level', level, service_filter)}
+        if service:
+            level_filter = Attr('log_level').eq(level) if level else None
+            return {service: query(self.SERVICE_INDEX, 'service', service, level_filter)}
+        
+        return {
+            log_level: query(self.LOG_LEVEL_INDEX, 'log_level', log_level)
+            for log_level in Config.SYSTEM_LOG_LEVELS
+        }
+    
+    def _iter_log_stream(self, name, query_kwargs, start_key, page_size):
+        """Yield (timestamp, log_id, name, log) for the logs of one stream, newest first"""
+        query_kwargs = dict(query_kwargs, Limit=page_size)
+        if start_key:
+            query_kwargs['ExclusiveStartKey'] = start_key
+        
+        for page in iter_pages(self.logs_table.query, **query_kwargs):
+            for log in page.get('Items', []):
+                yield log.get('timestamp', ''), log['log_id'], name, log
+    
+    def _log_key(self, log, query_kwargs):
+        """Get the index key of a log, to resume a query after it"""
+        attribute = 'log_level' if query_kwargs['IndexName'] == self.LOG_LEVEL_INDEX else 'service'
+        return {'log_id': log['log_id'], 'timestamp': log['timestamp'], attribute: log[attribute]}
+    
+    def _encode_cursor(self, last_keys, streams):
+        # Streams with nothing taken yet restart from the beginning (no key)
+        cursor = {name: last_keys.get(name, {}) for name in streams}
+        return base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode('utf-8')).decode('ascii')
+    
+    def _decode_cursor(self, cursor, streams):
+        try:
+            decoded = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        except (ValueError, UnicodeError):
+            raise ValueError('Invalid cursor')
+        if not isinstance(decoded, dict) or set(decoded) != set(streams):
+            raise ValueError('Cursor does not match the filters')
+        return {name: key for name, key in decoded.items() if key}
+    
     def clear_logs(self, older_than=None):
-        """Clear logs, optionally only those older than a specified date"""
+        """Start a background job deleting logs, optionally only those older than a specified date
+        
+        Returns the job's progress; poll get_purge_job with its job_id.
+        """
+        job = {
+            'job_id': str(uuid.uuid4()),
+            'status': 'running',
+            'older_than': older_than,
+            'scanned_count': 0,
+            'deleted_count': 0,
+            'started_at': datetime.now().isoformat(),
+            'finished_at': None,
+            'error': None
+        }
+        
+        with self._purge_jobs_lock:
+            self._purge_jobs[job['job_id']] = job
+            # Forget the oldest finished jobs
+            finished = [job_id for job_id, j in self._purge_jobs.items() if j['status'] != 'running']
+            for job_id in finished[:max(0, len(self._purge_jobs) - Config.SYSTEM_LOGS_PURGE_JOB_HISTORY)]:
+                del self._purge_jobs[job_id]
+        
+        threading.Thread(target=self._run_purge_job, args=(job,), name='log-purge', daemon=True).start()
+        logger.info(f"Started log purge job {job['job_id']} (older than {older_than or 'now'})")
+        
+        return self.get_purge_job(job['job_id'])
+    
+    def get_purge_job(self, job_id):
+        """Get the progress of a purge job, or None if this process doesn't know it"""
+        with self._purge_jobs_lock:
+            job = self._purge_jobs.get(job_id)
+            return dict(job) if job else None
+    
+    def _run_purge_job(self, job):
+        """Delete the logs matched by a purge job
+        
+        Keys are read with a parallel segmented scan and deleted in chunks by
+        a pool of threads, each with its own batch_writer. At most two chunks
+        per thread are in flight, so memory stays flat on large tables.
+        """
+        scan_kwargs = {}
+        if job['older_than']:
+            scan_kwargs = {
+                'FilterExpression': '#timestamp < :older_than',
+                'ExpressionAttributeNames': {'#timestamp': 'timestamp'},
+                'ExpressionAttributeValues': {':older_than': job['older_than']}
+            }
+        
+        workers = Config.SYSTEM_LOGS_PURGE_WORKERS
         try:
-            if older_than:
-                # Scan for logs older than the specified date
-                scan_kwargs = {
-                    'FilterExpression': '#timestamp < :older_than',
-                    'ExpressionAttributeNames': {'#timestamp': 'timestamp'},
-                    'ExpressionAttributeValues': {':older_than': older_than}
-                }
-                
-                response = self.logs_table.scan(**scan_kwargs)
-                logs_to_delete = response.get('Items', [])
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='log-purge-delete') as executor:
+                pending = set()
+                keys = iter_scan(
+                    self.logs_table,
+                    attributes=['log_id'],
+                    segments=Config.DYNAMODB_SCAN_SEGMENTS,
+                    **scan_kwargs
+                )
                 
-                # Delete each log item
-                with self.logs_table.batch_writer() as batch:
-                    for log in logs_to_delete:
-                        batch.delete_item(Key={'log_id': log['log_id']})
+                while True:
+                    chunk = [{'log_id': log['log_id']} for log in itertools.islice(keys, Config.SYSTEM_LOGS_PURGE_CHUNK_SIZE)]
+                    if not chunk:
+                        break
+                    self._update_purge_job(job, scanned_count=len(chunk))
+                    
+                    pending.add(executor.submit(self._delete_log_keys, job, chunk))
+                    if len(pending) >= workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
                 
-                return len(logs_to_delete)
-            else:
-                # This is a dangerous operation that deletes all logs
-                # In a production environment, this should require additional confirmation
-                # or be restricted to specific roles
-                
-                # Scan all logs
-                response = self.logs_table.scan()
-                logs_to_delete = response.get('Items', [])
-                
-                # Delete each log item
-                with self.logs_table.batch_writer() as batch:
-                    for log in logs_to_delete:
-                        batch.delete_item(Key={'log_id': log['log_id']})
-                
-                return len(logs_to_delete)
+                for future in pending:
+                    future.result()
+            
+            self._update_purge_job(job, status='completed')
+            logger.info(f"Log purge job {job['job_id']} deleted {job['deleted_count']} logs")
         except Exception as e:
             logger.error(f"Error clearing logs: {str(e)}")
-            raise
\ No newline at end of file
+            self._update_purge_job(job, status='failed', error=str(e))
+    
+    def _delete_log_keys(self, job, keys):
+        """Delete a chunk of logs by key"""
+        with self.logs_table.batch_writer() as batch:
+            for key in keys:
+                batch.delete_item(Key=key)
+        self._update_purge_job(job, deleted_count=len(keys))
+    
+    def _update_purge_job(self, job, scanned_count=0, deleted_count=0, status=None, error=None):
+        with self._purge_jobs_lock:
+            job['scanned_count'] += scanned_count
+            job['deleted_count'] += deleted_count
+            if status:
+                job['status'] = status
+                job['finished_at'] = datetime.now().isoformat()
+            if error:
+                job['error'] = error
@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+import threading
+import time
+from jinja2 import Environment
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Used when neither the requested nor the default template can be loaded
+FALLBACK_TEMPLATE = {
+    "default": "PatentAnalyzer Alert",
+    "email": {
+        "subject": "PatentAnalyzer Alert",
+        "body": {
+            "text": "Patent Alert for {{patent_id}}",
+            "html": "<html><body>Patent Alert for {{patent_id}}</body></html>"
+        }
+    },
+    "sms": "PatentAnalyzer Alert for {{patent_id}}"
+}
+
+
+class CompiledTemplate:
+    """The compiled channels of an alert template"""
+
+    def __init__(self, environment, template_data):
+        self.default = template_data['default']
+        self.subject = environment.from_string(template_data['email']['subject'])
+        self.text = environment.from_string(template_data['email']['body']['text'])
+        self.html = environment.from_string(template_data['email']['body']['html'])
+        self.sms = environment.from_string(template_data['sms'])
+
+    def render(self, data):
+        """Render every channel of the template with the same data"""
+        return {
+            'default': self.default,
+            'subject': self.subject.render(data),
+            'text': self.text.render(data),
+            'html': self.html.render(data),
+            'sms': self.sms.render(data)
+        }
+
+
+class TemplateRegistry:
+    """Compiled alert templates, looked up by name.
+
+    The template named "name" is read from name.json in the template
+    directory and compiled once. Its file's mtime is checked at most every
+    check_interval seconds, and a changed file is recompiled; if the new
+    version fails to load, the previous one is kept. Unknown names resolve
+    to the default template.
+    """
+
+    def __init__(self, template_dir, default_name=None, check_interval=None):
+        self.template_dir = template_dir
+        self.default_name = default_name or Config.NOTIFICATION_DEFAULT_TEMPLATE
+        self.check_interval = Config.NOTIFICATION_TEMPLATE_CHECK_INTERVAL if check_interval is None else check_interval
+        self.environment = Environment()
+
+        # name -> (mtime_ns, next check time, compiled template)
+        self._templates = {}
+        self._lock = threading.Lock()
+        self._fallback = CompiledTemplate(self.environment, FALLBACK_TEMPLATE)
+
+    def get(self, name=None):
+        """Get the compiled template for a name, falling back to the default template"""
+        for candidate in (name, self.default_name):
+            if candidate:
+                template = self._get(candidate)
+                if template is not None:
+                    return template
+
+        return self._fallback
+
+    def render(self, name, data):
+        """Render every channel of a named template"""
+        return self.get(name).render(data)
+
+    def _get(self, name):
+        now = time.monotonic()
+        entry = self._templates.get(name)
+        if entry is not None and now < entry[1]:
+            return entry[2]
+
+        with self._lock:
+            entry = self._templates.get(name)
+            if entry is not None and now < entry[1]:
+                return entry[2]
+
+            path = self._path(name)
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                # Remember missing templates too, so unknown names don't stat every call
+                self._templates[name] = (None, now + self.check_interval, None)
+                return None
+
+            template = entry[2] if entry is not None else None
+            if entry is None or entry[0] != mtime_ns:
+                template = self._compile(path) or template
+                if template is not None:
+                    logger.info(f"Loaded alert template {name} from {path}")
+
+            self._templates[name] = (mtime_ns, now + self.check_interval, template)
+            return template
+
+    def _path(self, name):
+        # Template names map to files directly inside the template directory
+        return os.path.join(self.template_dir, os.path.basename(name) + '.json')
+
+    def _compile(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8-sig') as file:
+                return CompiledTemplate(self.environment, json.load(file))
+        except Exception as e:
+            logger.error(f"Error loading alert template {path}: {str(e)}")
+            return None
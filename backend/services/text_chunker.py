@@ -0,0 +1,79 @@
+import re
+from config import Config
+
+# Sentence ends followed by whitespace, or blank lines between paragraphs/claims
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?;:])\s+|\n\s*\n')
+
+
+def utf8_length(text):
+    """Get the size of text in UTF-8 bytes"""
+    return len(text.encode('utf-8'))
+
+
+def truncate_utf8(text, max_bytes):
+    """Cut text to at most max_bytes of UTF-8 without splitting a character"""
+    return text.encode('utf-8')[:max_bytes].decode('utf-8', errors='ignore')
+
+
+def split_sentences(text):
+    """Split text into sentences"""
+    return [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence and sentence.strip()]
+
+
+def chunk_text(text, max_bytes=None):
+    """Split text into chunks of whole sentences that each fit in max_bytes of UTF-8
+
+    Sentences longer than max_bytes are split between words, and words that are
+    still too long are cut on character boundaries.
+    """
+    max_bytes = max_bytes or Config.COMPREHEND_MAX_CHUNK_BYTES
+
+    chunks = []
+    current = []
+    current_bytes = 0
+
+    for sentence in split_sentences(text or ''):
+        for piece in _split_oversized(sentence, max_bytes):
+            piece_bytes = utf8_length(piece)
+            # Account for the space joining this piece to the previous one
+            if current and current_bytes + 1 + piece_bytes > max_bytes:
+                chunks.append(' '.join(current))
+                current = []
+                current_bytes = 0
+
+            current_bytes += piece_bytes + (1 if current else 0)
+            current.append(piece)
+
+    if current:
+        chunks.append(' '.join(current))
+
+    return chunks
+
+
+def _split_oversized(sentence, max_bytes):
+    """Break a sentence that doesn't fit in max_bytes into pieces that do"""
+    if utf8_length(sentence) <= max_bytes:
+        return [sentence]
+
+    pieces = []
+    current = ''
+    for word in sentence.split():
+        while utf8_length(word) > max_bytes:
+            if current:
+                pieces.append(current)
+                current = ''
+            head = truncate_utf8(word, max_bytes)
+            pieces.append(head)
+            word = word[len(head):]
+
+        candidate = f"{current} {word}" if current else word
+        if utf8_length(candidate) > max_bytes:
+            pieces.append(current)
+            current = word
+        else:
+            current = candidate
+
+    if current:
+        pieces.append(current)
+
+    return pieces